@@ -12,12 +12,57 @@
 from flask import Flask, request, jsonify
 from flask_cors import CORS, cross_origin
 from datetime import datetime
-import delineate
+import catalog
+import metrics
+import output
+import jobs
+import results
+import threading
+import logging
+import os
 
 app = Flask(__name__)
 cors = CORS(app)
 app.config['CORS_HEADERS'] = 'Content-Type'
 
+DATA_PATH = 'C:/NYBackup/GitHub/ss-delineate/data/'
+
+#delineation diagnostics are logged at debug, set SS_DELINEATE_LOG_LEVEL=DEBUG to see them
+logging.basicConfig(level=os.environ.get('SS_DELINEATE_LOG_LEVEL', 'WARNING'))
+
+#datasets stay open between requests
+CATALOG = catalog.get_catalog(DATA_PATH)
+
+#watersheds are cached on the snapped pour point cell
+RESULTS = results.ResultCache(CATALOG)
+
+#regions each job worker opens before taking work
+PRELOAD_REGIONS = ['ny', 'ma']
+
+#worker processes start with the first submitted job, job state lives in this process
+#so with several web workers a job can only be polled through the one that took it
+JOBS = jobs.JobQueue(DATA_PATH, PRELOAD_REGIONS)
+
+def warm_catalog():
+
+    #spatial indexes for the preloaded regions are built in the background at startup
+    try:
+        CATALOG.warm(PRELOAD_REGIONS)
+    except Exception as e:
+        app.logger.error('could not warm regions %s: %s', PRELOAD_REGIONS, e)
+
+threading.Thread(target=warm_catalog, name='warm-catalog', daemon=True).start()
+
+def send(body, mimetype='application/json'):
+
+    #compress with whatever the client accepts, brotli before gzip
+    body, encoding = output.compress(body, request.headers.get('Accept-Encoding'))
+    response = app.response_class(body, mimetype=mimetype)
+    response.headers['Vary'] = 'Accept-Encoding'
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    return response
+
 @app.route("/")
 
 def home():
@@ -31,9 +76,53 @@ def main():
     lat = float(request.args.get('lat'))
     lng = float(request.args.get('lng'))
 
-    print(region,lat,lng)
-    dataPath = 'C:/NYBackup/GitHub/ss-delineate/data/'
+    includeMetrics = request.args.get('metrics', '').lower() in ('1', 'true', 'yes')
+
+    #geojson (default), topojson with shared arcs, or binary flatgeobuf
+    format = request.args.get('format', 'geojson').lower()
+    if format not in output.FORMATS:
+        response = jsonify({'error': 'unknown format: ' + format, 'formats': list(output.FORMATS)})
+        response.status_code = 400
+        return response
+
+    app.logger.info('delineate: %s %s %s', region, lat, lng)
+
+    #start main program, the body comes back already encoded
+    return send(RESULTS.delineate(lat,lng,region,includeMetrics,format), output.FORMATS[format])
+
+@app.route("/metrics")
+@cross_origin(origin='*')
+def get_metrics():
+
+    #stage time and counter histograms by point classification
+    return jsonify(metrics.REGISTRY.snapshot())
+
+@app.route("/jobs", methods=['POST'])
+@cross_origin(origin='*')
+def submit_job():
+
+    region = request.values.get('region')
+    lat = float(request.values.get('lat'))
+    lng = float(request.values.get('lng'))
+
+    app.logger.info('job: %s %s %s', region, lat, lng)
+
+    #queue the delineation and hand back an id to poll
+    job = JOBS.submit(lat, lng, region)
+    response = jsonify(job)
+    response.status_code = 202
+    response.headers['Location'] = '/jobs/' + job['id']
+    return response
+
+@app.route("/jobs/<job_id>")
+@cross_origin(origin='*')
+def poll_job(job_id):
+
+    job = JOBS.status(job_id)
+    if job is None:
+        response = jsonify({'error': 'unknown job: ' + job_id})
+        response.status_code = 404
+        return response
 
-    #start main program
-    results = delineate.Watershed(lat,lng,region,dataPath)
-    return jsonify(results.serialize())
\ No newline at end of file
+    #finished results are json text from the worker, pass them through
+    return send(output.object_bytes(job.items()))
@@ -0,0 +1,169 @@
+## StreamStats batch delineation
+
+# -----------------------------------------------------
+# Delineates a CSV or GeoJSON of points, grouped by
+# region and HUC so each worker loads a HUC once
+#
+# run with: "python batch.py points.csv watersheds.geojsonl --data C:/temp/"
+# -----------------------------------------------------
+
+from osgeo import ogr
+from multiprocessing import get_context
+from catalog import RegionCatalog, get_catalog
+from jobs import WORKER_START_METHOD
+from output import RawJSON, object_bytes
+import delineate
+import argparse
+import time
+import json
+import csv
+
+#points per task, keeps one huc on one worker without starving the others
+CHUNK_SIZE = 25
+
+LAT_FIELDS = ['lat', 'latitude', 'y']
+LNG_FIELDS = ['lng', 'lon', 'long', 'longitude', 'x']
+ID_FIELDS = ['id', 'siteid', 'site_no', 'name']
+
+def first_field(row, names):
+    for name in names:
+        if name in row and row[name] not in (None, ''):
+            return row[name]
+    return None
+
+def read_points(path, region=None):
+
+    points = []
+
+    if path.lower().endswith(('.geojson', '.json')):
+        with open(path) as f:
+            collection = json.load(f)
+
+        for i, feature in enumerate(collection['features']):
+            properties = {key.lower(): value for key, value in (feature.get('properties') or {}).items()}
+            lng, lat = feature['geometry']['coordinates'][:2]
+            points.append({
+                'id': first_field(properties, ID_FIELDS) or feature.get('id') or str(i),
+                'region': properties.get('region') or region,
+                'lat': float(lat),
+                'lng': float(lng)
+            })
+
+    else:
+        with open(path, newline='') as f:
+            for i, row in enumerate(csv.DictReader(f)):
+                row = {key.strip().lower(): value for key, value in row.items()}
+                points.append({
+                    'id': first_field(row, ID_FIELDS) or str(i),
+                    'region': row.get('region') or region,
+                    'lat': float(first_field(row, LAT_FIELDS)),
+                    'lng': float(first_field(row, LNG_FIELDS))
+                })
+
+    return points
+
+def group_points(points, dataPath):
+
+    catalog = get_catalog(dataPath)
+    groups = {}
+
+    for point in points:
+        hucName = None
+        try:
+            regionHandle = catalog.region(point['region'])
+            x, y = regionHandle.project(point['lng'], point['lat'])
+
+            inputPointProjected = ogr.Geometry(ogr.wkbPoint)
+            inputPointProjected.SetPoint_2D(0, x, y)
+            hucName = regionHandle.huc_for_point(inputPointProjected)
+        except Exception as e:
+            print('ERROR: could not locate HUC for point', point['id'], e)
+
+        groups.setdefault((point['region'], hucName), []).append(point)
+
+    #split big hucs into chunks, each chunk still only touches one huc
+    tasks = []
+    for (region, hucName), members in sorted(groups.items(), key=lambda item: -len(item[1])):
+        for i in range(0, len(members), CHUNK_SIZE):
+            tasks.append((region, hucName, members[i:i + CHUNK_SIZE]))
+    return tasks
+
+_catalog = None
+_dataPath = None
+
+def init_worker(dataPath):
+
+    #each worker keeps its own catalog so hucs stay open across tasks
+    global _catalog, _dataPath
+    _dataPath = dataPath
+    _catalog = RegionCatalog(dataPath)
+
+def delineate_point(point, hucName, catalog, dataPath):
+
+    if hucName is None:
+        return {'type': 'Feature', 'geometry': None, 'properties': dict(point, error='point is not inside any HUC')}
+
+    try:
+        results = delineate.Watershed(point['lat'], point['lng'], point['region'], dataPath, catalog)
+    except Exception as e:
+        return {'type': 'Feature', 'geometry': None, 'properties': dict(point, huc=hucName, error=str(e))}
+
+    merged = results.mergedCatchment
+    properties = dict(point, huc=hucName, type=results.classification, area=merged['properties']['area'], splitArea=results.splitCatchment['properties']['area'])
+    return {'type': 'Feature', 'geometry': RawJSON(merged.geometryJson), 'properties': properties}
+
+def delineate_group(task):
+
+    region, hucName, points = task
+    return [delineate_point(point, hucName, _catalog, _dataPath) for point in points]
+
+def delineate_batch(points, dataPath, outPath, processes=None):
+
+    timeBefore = time.perf_counter()
+    tasks = group_points(points, dataPath)
+    print('Grouped', len(points), 'points into', len(tasks), 'tasks')
+
+    done = 0
+    errors = 0
+    #group_points has opened datasets in this process, so workers start clean like the job workers
+    context = get_context(WORKER_START_METHOD)
+    with open(outPath, 'w') as out, context.Pool(processes, initializer=init_worker, initargs=(dataPath,)) as pool:
+
+        #write each huc's results as soon as its worker finishes
+        for features in pool.imap_unordered(delineate_group, tasks):
+            for feature in features:
+                out.write(object_bytes(feature.items()).decode('utf-8') + '\n')
+                if 'error' in feature['properties']:
+                    errors += 1
+            out.flush()
+
+            done += len(features)
+            elapsed = time.perf_counter() - timeBefore
+            print('Delineated %d/%d points, %.2f points per second' % (done, len(points), done / elapsed))
+
+    totalTime = time.perf_counter() - timeBefore
+    return {
+        'points': done,
+        'errors': errors,
+        'seconds': totalTime,
+        'pointsPerSecond': done / totalTime if totalTime else 0.0
+    }
+
+def main():
+
+    parser = argparse.ArgumentParser(description='delineate a batch of points')
+    parser.add_argument('points', help='CSV (id, region, lat, lng) or GeoJSON of points')
+    parser.add_argument('output', help='newline delimited GeoJSON output file')
+    parser.add_argument('--data', required=True, help='archydro data path, ex: C:/temp/')
+    parser.add_argument('--region', help='region for points without one')
+    parser.add_argument('--processes', type=int, default=None)
+    args = parser.parse_args()
+
+    points = read_points(args.points, args.region)
+    stats = delineate_batch(points, args.data, args.output, args.processes)
+
+    print('Total Time:', stats['seconds'])
+    print('Points per second:', round(stats['pointsPerSecond'], 2), 'errors:', stats['errors'])
+
+if __name__=='__main__':
+    main()
@@ -0,0 +1,105 @@
+## StreamStats catchment tracer benchmark
+
+# -----------------------------------------------------
+# Compares the native iterative tracer in catchment.py
+# with the recursive pysheds grid.catchment call on
+# large synthetic flow direction grids
+#
+# run with: "python benchmarks/bench_catchment.py --size 4000"
+# -----------------------------------------------------
+
+import os
+import sys
+import time
+import argparse
+import tracemalloc
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from catchment import trace_catchment
+
+def fishbone_fdr(size):
+
+    #tributary columns drain to a main channel along the middle row, which drains east
+    fdr = np.empty((size, size), dtype='uint8')
+    middle = size // 2
+    fdr[:middle, :] = 4
+    fdr[middle + 1:, :] = 64
+    fdr[middle, :] = 1
+    fdr[middle, -1] = 0
+    return fdr, (middle, size - 1)
+
+def serpentine_fdr(size):
+
+    #one flow path through every cell, the worst case for path length
+    fdr = np.where(np.arange(size)[:, None] % 2 == 0, 1, 16).repeat(size, axis=1).astype('uint8')
+    fdr[0::2, -1] = 4
+    fdr[1::2, 0] = 4
+    last = size - 1
+    outletCol = 0 if last % 2 else size - 1
+    fdr[last, outletCol] = 0
+    return fdr, (last, outletCol)
+
+PATTERNS = {'fishbone': fishbone_fdr, 'serpentine': serpentine_fdr}
+
+def run_native(fdr, row, col):
+    mask, window = trace_catchment(fdr, row, col)
+    return int(mask.sum())
+
+def run_pysheds(fdr, row, col):
+
+    from pysheds.grid import Grid
+    from affine import Affine
+
+    grid = Grid()
+    grid.add_gridded_data(data=fdr, data_name='dir', affine=Affine(30.0, 0.0, 0.0, 0.0, -30.0, 0.0), nodata=0)
+    grid.catchment(data='dir', x=col, y=row, out_name='catch', recursionlimit=15000, xytype='index')
+    return int((grid.catch != 0).sum())
+
+def measure(func, fdr, row, col, repeat):
+
+    times = []
+    peak = 0
+    cells = None
+    for i in range(repeat):
+        tracemalloc.start()
+        timeBefore = time.perf_counter()
+        try:
+            cells = func(fdr, row, col)
+        except (RecursionError, ImportError) as e:
+            tracemalloc.stop()
+            return {'error': type(e).__name__ + ': ' + str(e)}
+        times.append(time.perf_counter() - timeBefore)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+    return {
+        'cells': cells,
+        'median_seconds': float(np.median(times)),
+        'peak_mb': peak / 1024.0 / 1024.0
+    }
+
+def main():
+
+    parser = argparse.ArgumentParser(description='benchmark catchment tracing')
+    parser.add_argument('--size', type=int, nargs='+', default=[1000, 2000, 4000])
+    parser.add_argument('--pattern', choices=sorted(PATTERNS), default='fishbone')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--skip-pysheds', action='store_true')
+    args = parser.parse_args()
+
+    for size in args.size:
+        fdr, (row, col) = PATTERNS[args.pattern](size)
+
+        results = {'native': measure(run_native, fdr, row, col, args.repeat)}
+        if not args.skip_pysheds:
+            results['pysheds'] = measure(run_pysheds, fdr, row, col, args.repeat)
+
+        for name, result in results.items():
+            if 'error' in result:
+                print('%-10s %6d x %-6d %s' % (args.pattern, size, size, name + ' failed: ' + result['error']))
+            else:
+                print('%-10s %6d x %-6d %-8s cells: %10d  time: %8.3fs  peak: %8.1f MB' % (args.pattern, size, size, name, result['cells'], result['median_seconds'], result['peak_mb']))
+
+if __name__=='__main__':
+    main()
@@ -0,0 +1,213 @@
+## StreamStats per-stage delineation benchmark
+
+# -----------------------------------------------------
+# Runs the regression points from tests/test_delineate.py
+# and records wall time and peak memory for each stage
+# of the Watershed pipeline
+#
+# run with: "python benchmarks/bench_stages.py --data c:/temp/ --save benchmarks/baseline.json"
+# compare:  "python benchmarks/bench_stages.py --data c:/temp/ --compare benchmarks/baseline.json"
+# -----------------------------------------------------
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import functools
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import delineate
+from catalog import RegionCatalog
+from cache import TieredCache, LRUCache
+
+STAGES = ['get_global', 'get_local', 'split_catchment', 'search_upstream_geometry', 'aggregate_geometries', 'geom_to_geojson']
+
+#same points and expected areas as tests/test_delineate.py
+SCENARIOS = [
+    ('ny_local', 'local', 'ny', 44.00683, -73.74586, 0.63),
+    ('ny_local_on_str_no_adjoint', 'local_on_str_no_adjoint', 'ny', 44.03115617578595, -73.71244903077174, 8.37),
+    ('ny_localGlobal', 'localGlobal', 'ny', 44.00431, -73.71348, 53.59),
+    ('ny_global_non_nested', 'global_non_nested', 'ny', 43.29139, -73.82705, 2719.84),
+    ('ny_global_nested_small', 'global_nested_small', 'ny', 42.17209, -73.87555, 9996.5),
+    ('ny_global_nested_large', 'global_nested_large', 'ny', 41.00155, -73.89282, 13280.1),
+    ('ny_bad_catchment_geom', 'edge', 'ny', 43.45338620107029, -74.50329065322877, 17.47),
+    ('ny_bad_split_catchment', 'edge', 'ny', 41.310936704746936, -74.51668024063112, 157.78),
+    ('ny_spatially_disconnected_hucs', 'edge', 'ny', 43.31392194207697, -73.8442397117614, 1053.99),
+    ('ny_bad_single_upstream_huc', 'edge', 'ny', 42.82741831644657, -73.93358945846559, 3312.89),
+    ('ma_local', 'local', 'ma', 42.55415514336133, -71.50470972061159, 0.29),
+    ('ma_local_on_str_no_adjoint', 'local_on_str_no_adjoint', 'ma', 42.567036149018534, -71.5099883079529, 6.93),
+    ('ma_localGlobal', 'localGlobal', 'ma', 42.5975606206426, -71.42810583114625, 34.71),
+    ('ma_global_non_nested', 'global_non_nested', 'ma', 42.809522580037786, -71.47342443466188, 3432.86),
+    ('ma_global_nested_small', 'global_nested_small', 'ma', 42.645371184571744, -71.29590511322023, 4628.4),
+    ('ma_global_nested_large', 'global_nested_large', 'ma', 42.48847603472268, -72.57074832916261, 7918.2),
+]
+
+meters_to_miles = 0.00000038610
+
+class StageRecorder:
+
+    def __init__(self):
+        self.stack = []
+        self.stages = {}
+
+    def reset(self):
+        self.stack = []
+        self.stages = {}
+
+    def enter(self, name):
+
+        current, peak = tracemalloc.get_traced_memory()
+
+        #parents keep the highest peak seen before the child resets it
+        for frame in self.stack:
+            frame['peak'] = max(frame['peak'], peak)
+
+        #reset_peak is python 3.9+, older pythons report the scenario peak so far for each stage
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+
+        self.stack.append({'name': name, 'start': time.perf_counter(), 'base': current, 'peak': current})
+
+    def exit(self):
+
+        current, peak = tracemalloc.get_traced_memory()
+        frame = self.stack.pop()
+        frame['peak'] = max(frame['peak'], peak)
+        for parent in self.stack:
+            parent['peak'] = max(parent['peak'], frame['peak'])
+
+        #stages called more than once (geom_to_geojson) add up their time
+        stage = self.stages.setdefault(frame['name'], {'seconds': 0.0, 'peak_mb': 0.0, 'calls': 0})
+        stage['seconds'] += time.perf_counter() - frame['start']
+        stage['peak_mb'] = max(stage['peak_mb'], (frame['peak'] - frame['base']) / 1024.0 / 1024.0)
+        stage['calls'] += 1
+
+def instrument(recorder):
+
+    #wrap each pipeline stage on the Watershed class
+    for name in STAGES:
+        method = getattr(delineate.Watershed, name)
+
+        def wrapper(self, *args, _method=method, _name=name, **kwargs):
+            recorder.enter(_name)
+            try:
+                return _method(self, *args, **kwargs)
+            finally:
+                recorder.exit()
+
+        setattr(delineate.Watershed, name, functools.wraps(method)(wrapper))
+
+def fresh_catalog(dataPath):
+
+    #memory only geometry cache so earlier runs on disk don't skew cold timings
+    catalog = RegionCatalog(dataPath)
+    catalog.geometryCache = TieredCache(LRUCache())
+    return catalog
+
+def run_scenario(recorder, catalog, scenario, dataPath):
+
+    name, category, region, lat, lng, expected = scenario
+    recorder.reset()
+
+    tracemalloc.start()
+    timeBefore = time.perf_counter()
+    results = delineate.Watershed(lat, lng, region, dataPath, catalog)
+    total = time.perf_counter() - timeBefore
+    tracemalloc.stop()
+
+    area = round(results.mergedCatchment['properties']['area'] * meters_to_miles, 2)
+    return {
+        'category': category,
+        'seconds': total,
+        'area': area,
+        'area_ok': area == expected,
+        'stages': recorder.stages
+    }
+
+def compare(results, baseline, tolerance, min_seconds):
+
+    regressions = []
+    for mode in ('cold', 'warm'):
+        for name, result in results[mode].items():
+            base = baseline.get(mode, {}).get(name)
+            if base is None:
+                continue
+            for stage, timing in result['stages'].items():
+                baseTiming = base['stages'].get(stage)
+                if baseTiming is None:
+                    continue
+
+                #ignore tiny stages where timer noise is bigger than the stage
+                if timing['seconds'] < min_seconds:
+                    continue
+                if timing['seconds'] > baseTiming['seconds'] * (1 + tolerance):
+                    regressions.append((mode, name, stage, 'seconds', baseTiming['seconds'], timing['seconds']))
+                if timing['peak_mb'] > max(baseTiming['peak_mb'] * (1 + tolerance), 1.0):
+                    regressions.append((mode, name, stage, 'peak_mb', baseTiming['peak_mb'], timing['peak_mb']))
+    return regressions
+
+def main():
+
+    parser = argparse.ArgumentParser(description='per-stage delineation benchmark')
+    parser.add_argument('--data', default='c:/temp/', help='archydro data path')
+    parser.add_argument('--scenario', nargs='*', help='scenario names or categories to run (default all)')
+    parser.add_argument('--repeat', type=int, default=3, help='warm runs per scenario')
+    parser.add_argument('--save', help='write results to this JSON baseline')
+    parser.add_argument('--compare', help='baseline JSON to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed fractional slowdown')
+    parser.add_argument('--min-seconds', type=float, default=0.01)
+    args = parser.parse_args()
+
+    scenarios = [s for s in SCENARIOS if not args.scenario or s[0] in args.scenario or s[1] in args.scenario]
+
+    recorder = StageRecorder()
+    instrument(recorder)
+
+    results = {
+        'machine': {'platform': platform.platform(), 'python': platform.python_version()},
+        'cold': {},
+        'warm': {}
+    }
+
+    for scenario in scenarios:
+        name = scenario[0]
+
+        #cold: nothing open yet, warm: best of repeated runs on the same catalog
+        catalog = fresh_catalog(args.data)
+        results['cold'][name] = run_scenario(recorder, catalog, scenario, args.data)
+
+        warmRuns = [run_scenario(recorder, catalog, scenario, args.data) for i in range(args.repeat)]
+        if warmRuns:
+            results['warm'][name] = min(warmRuns, key=lambda run: run['seconds'])
+
+        for mode in ('cold', 'warm'):
+            if name not in results[mode]:
+                continue
+            result = results[mode][name]
+            print('%-32s %-5s total: %8.3fs  area: %10.2f %s' % (name, mode, result['seconds'], result['area'], '' if result['area_ok'] else '(expected %s)' % scenario[5]))
+            for stage in STAGES:
+                if stage in result['stages']:
+                    timing = result['stages'][stage]
+                    print('    %-26s %8.3fs  peak: %8.1f MB  calls: %d' % (stage, timing['seconds'], timing['peak_mb'], timing['calls']))
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+        print('Saved baseline:', args.save)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+        regressions = compare(results, baseline, args.tolerance, args.min_seconds)
+        for mode, name, stage, metric, before, after in regressions:
+            print('REGRESSION %s %s %s %s: %.3f -> %.3f' % (mode, name, stage, metric, before, after))
+        if regressions:
+            sys.exit(1)
+        print('No regressions beyond', args.tolerance)
+
+if __name__=='__main__':
+    main()
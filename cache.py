@@ -0,0 +1,175 @@
+## StreamStats cache helpers
+
+# -----------------------------------------------------
+# Bounded in-memory LRU and on-disk byte caches used to
+# keep results that never change between requests
+# -----------------------------------------------------
+
+from collections import OrderedDict
+import tempfile
+import hashlib
+import threading
+import os
+
+#arguments
+CACHE_PATH = os.environ.get('SS_DELINEATE_CACHE', os.path.join(tempfile.gettempdir(), 'ss-delineate-cache'))
+MEMORY_CACHE_BYTES = 256 * 1024 * 1024
+DISK_CACHE_BYTES = 4 * 1024 * 1024 * 1024
+
+def cache_key(*parts):
+
+    #stable short key from any mix of strings, numbers and sorted collections
+    text = '|'.join(str(part) for part in parts)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+class LRUCache:
+
+    def __init__(self, max_bytes=MEMORY_CACHE_BYTES):
+
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+
+        with self.lock:
+            value = self.items.get(key)
+            if value is not None:
+                self.items.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+
+        with self.lock:
+            old = self.items.pop(key, None)
+            if old is not None:
+                self.bytes -= len(old)
+
+            #values bigger than the whole cache are never kept
+            if len(value) > self.max_bytes:
+                return
+
+            self.items[key] = value
+            self.bytes += len(value)
+
+            while self.bytes > self.max_bytes:
+                evictedKey, evicted = self.items.popitem(last=False)
+                self.bytes -= len(evicted)
+
+    def clear(self):
+
+        with self.lock:
+            self.items.clear()
+            self.bytes = 0
+
+class DiskCache:
+
+    def __init__(self, path, max_bytes=DISK_CACHE_BYTES):
+
+        self.path = path
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+        #work out what is already on disk from an earlier run
+        self.bytes = 0
+        for name in os.listdir(path):
+            if name.endswith('.bin'):
+                self.bytes += os.path.getsize(os.path.join(path, name))
+
+    def file_path(self, key):
+        return os.path.join(self.path, key + '.bin')
+
+    def get(self, key):
+
+        filePath = self.file_path(key)
+        try:
+            with open(filePath, 'rb') as f:
+                value = f.read()
+        except OSError:
+            return None
+
+        #touch so eviction drops the least recently used files first
+        try:
+            os.utime(filePath)
+        except OSError:
+            pass
+        return value
+
+    def put(self, key, value):
+
+        filePath = self.file_path(key)
+
+        #write then rename so readers in other processes never see half a file
+        fd, tmpPath = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(value)
+
+        with self.lock:
+            if os.path.exists(filePath):
+                self.bytes -= os.path.getsize(filePath)
+            os.replace(tmpPath, filePath)
+            self.bytes += len(value)
+
+            if self.bytes > self.max_bytes:
+                self.evict()
+
+    def evict(self):
+
+        files = []
+        for name in os.listdir(self.path):
+            if name.endswith('.bin'):
+                filePath = os.path.join(self.path, name)
+                try:
+                    stat = os.stat(filePath)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, filePath))
+
+        #drop oldest first until we are back under three quarters of the cap
+        files.sort()
+        total = sum(size for mtime, size, filePath in files)
+        for mtime, size, filePath in files:
+            if total <= self.max_bytes * 0.75:
+                break
+            try:
+                os.remove(filePath)
+                total -= size
+            except OSError:
+                pass
+        self.bytes = total
+
+class TieredCache:
+
+    def __init__(self, memory=None, disk=None):
+
+        self.memory = memory if memory is not None else LRUCache()
+        self.disk = disk
+
+    def get(self, key):
+
+        value = self.memory.get(key)
+        if value is not None:
+            return value
+
+        if self.disk is not None:
+            value = self.disk.get(key)
+            if value is not None:
+                self.memory.put(key, value)
+        return value
+
+    def put(self, key, value):
+
+        self.memory.put(key, value)
+        if self.disk is not None:
+            self.disk.put(key, value)
+
+def tiered_cache(name, memory_bytes=MEMORY_CACHE_BYTES, disk_bytes=DISK_CACHE_BYTES, path=CACHE_PATH):
+
+    #disk tier is skipped if the cache directory can't be created
+    try:
+        disk = DiskCache(os.path.join(path, name), disk_bytes)
+    except OSError:
+        disk = None
+    return TieredCache(LRUCache(memory_bytes), disk)
@@ -0,0 +1,550 @@
+## StreamStats region dataset catalog
+
+# -----------------------------------------------------
+# Long lived handles to the global and local archydro
+# datasets so requests don't reopen them
+# -----------------------------------------------------
+
+# list of required python packages:
+# gdal
+
+from osgeo import ogr, osr
+from collections import OrderedDict
+from raster import RasterSampler, ArraySampler
+from huc_graph import HucGraph
+from spatial_index import FeatureIndex
+from cache import tiered_cache
+import threading
+import logging
+import sqlite3
+import json
+import os
+
+#archydro dataset layout
+GLOBAL_GDB_LIST = ['global.GDB','global.gdb']
+HUCPOLY_LAYER = 'hucpoly'
+HUCPOLY_LAYER_ID = 'NAME'
+HUCPOLY_LAYER_JUNCTION_ID = 'JunctionID'
+GLOBAL_STREAM_LAYER_LIST = ['streams', 'streams3d']
+GLOBAL_STREAM_LAYER_ID = 'HydroID'
+HUC_NET_JUNCTIONS_LAYER_LIST = ['Huc_net_Junctions3D','Huc_net_Junctions']
+HUC_NET_JUNCTIONS_LAYER_ID_LIST = ['Point2DID', 'HydroID']
+CATCHMENT_LAYER = 'Catchment'
+CATCHMENT_LAYER_ID = 'GridID'
+ADJOINT_CATCHMENT_LAYER = 'AdjointCatchment'
+ADJOINT_CATCHMENT_LAYER_ID = 'GridID'
+
+#built by preprocess.py next to the fdr/str grids
+CATCHMENT_GRID_NAME = 'catid.tif'
+CATCHMENT_ENVELOPES_NAME = 'catid.json'
+STACK_DIR = 'stack/'
+STACK_FDR_NAME = 'fdr.tif'
+STACK_CELLS_NAME = 'cells.tif' # str and GridID bands, pixel interleaved
+STACK_MANIFEST_NAME = 'stacks.json' # per region, next to global.gdb
+STACK_NODATA = -1
+ARRAY_STORE_DIR = 'arrays/' # uncompressed .npy grids for memory mapping
+ARRAY_HEADER_NAME = 'header.json'
+UPSTREAM_STORE_NAME = 'upstream.sqlite' # merged upstream polygon of every GridID with an adjoint catchment
+
+#eviction caps
+MAX_REGIONS = 8
+MAX_HUCS_PER_REGION = 32
+
+logger = logging.getLogger(__name__)
+
+def open_gdb(path):
+
+    driver = ogr.GetDriverByName("OpenFileGDB")
+    try:
+        return driver.Open(path, 0)
+    except RuntimeError:
+        return None
+
+def data_version(path):
+
+    #newest modification time of anything in a gdb folder
+    version = 0
+    try:
+        version = os.path.getmtime(path)
+        for name in os.listdir(path):
+            version = max(version, os.path.getmtime(os.path.join(path, name)))
+    except OSError:
+        pass
+    return str(int(version))
+
+def grid_version(localDataPath):
+
+    #fdr/str grids are esri grid folders or single files, either way the newest change wins
+    return str(max(int(data_version(localDataPath + name)) for name in ('fdr', 'str')))
+
+def store_version(localDataPath):
+
+    #fdr/str grids and everything preprocess.py builds from them, a rebuild of any one changes it
+    names = ('fdr', 'str', CATCHMENT_GRID_NAME, CATCHMENT_ENVELOPES_NAME, STACK_DIR, ARRAY_STORE_DIR, UPSTREAM_STORE_NAME)
+    return str(max(int(data_version(localDataPath + name)) for name in names))
+
+def load_stacks(globalDataPath):
+
+    #huc name -> stack entry written by preprocess.py, empty when the region has none
+    try:
+        with open(globalDataPath + STACK_MANIFEST_NAME) as f:
+            return json.load(f).get('hucs', {})
+    except (OSError, ValueError):
+        return {}
+
+def load_array_header(localDataPath):
+
+    #geotransform, crs and nodata of each mapped grid, None when the huc has no array store
+    try:
+        with open(localDataPath + ARRAY_STORE_DIR + ARRAY_HEADER_NAME) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def first_layer(gdb, layer_list):
+
+    for layerName in layer_list:
+        layer = gdb.GetLayer(layerName)
+        if layer is not None:
+            return layer
+    return None
+
+class HucHandle:
+
+    def __init__(self, globalDataPath, hucName, stack=None, regionVersion=None):
+
+        self.hucName = hucName
+        self.localDataPath = globalDataPath + hucName + '/'
+        self.localGDBPath = self.localDataPath + hucName + '.gdb'
+        self.fdr_grid = self.localDataPath + 'fdr'
+        self.str_grid = self.localDataPath + 'str'
+
+        #layers share one gdb handle so filters must not interleave between threads
+        self.lock = threading.RLock()
+
+        self.local_gdb = open_gdb(self.localGDBPath)
+        if self.local_gdb is None:
+            logger.error('Check to make sure you have a local gdb for: %s', hucName)
+
+        #define local data layers
+        self.catchmentLayer = self.local_gdb.GetLayer(CATCHMENT_LAYER)
+        if self.catchmentLayer is None:
+            logger.error('Check to make sure you have a local catchment for: %s', hucName)
+
+        self.adjointCatchmentLayer = self.local_gdb.GetLayer(ADJOINT_CATCHMENT_LAYER)
+        if self.adjointCatchmentLayer is None:
+            logger.error('Check to make sure you have a local adjoint catchment for: %s', hucName)
+
+        self.catchmentLayerNameFieldIndex = self.catchmentLayer.GetLayerDefn().GetFieldIndex(CATCHMENT_LAYER_ID)
+        self.adjointCatchmentLayerNameFieldIndex = self.adjointCatchmentLayer.GetLayerDefn().GetFieldIndex(ADJOINT_CATCHMENT_LAYER_ID)
+
+        #cached results built from this huc are keyed on its version
+        self.dataVersion = data_version(self.localGDBPath)
+        self.regionVersion = regionVersion
+        self.storeVersion = store_version(self.localDataPath)
+
+        #tiled stack from preprocess.py, only used while it matches the gdb and grids it was built from
+        self.stack = None
+        if stack is not None:
+            if stack.get('dataVersion') == self.dataVersion and stack.get('gridVersion') == grid_version(self.localDataPath):
+                self.stack = stack
+            else:
+                logger.warning('Raster stack for %s is older than its data, rerun preprocess.py', hucName)
+
+        #memory-mapped arrays win over both the stack and the original grids when present and current
+        self.arrays = load_array_header(self.localDataPath)
+        if self.arrays is not None:
+            if self.arrays.get('dataVersion') != self.dataVersion or self.arrays.get('gridVersion') != grid_version(self.localDataPath):
+                logger.warning('Array store for %s is older than its data, rerun preprocess.py', hucName)
+                self.arrays = None
+
+        self._str_sampler = None
+        self._fdr_sampler = None
+        self._catchmentIndex = None
+        self._catchmentEnvelopes = None
+        self._catchmentGrid = None
+        self._upstreamStore = None
+
+    @property
+    def upstreamStore(self):
+
+        #precomputed upstream polygons from preprocess.py, False when missing or built from older gdbs
+        with self.lock:
+            if self._upstreamStore is None:
+                self._upstreamStore = False
+                storePath = self.localDataPath + UPSTREAM_STORE_NAME
+                if os.path.exists(storePath):
+                    store = sqlite3.connect(storePath, check_same_thread=False)
+                    versions = dict(store.execute('SELECT key, value FROM meta').fetchall())
+                    if versions.get('dataVersion') == self.dataVersion and versions.get('regionVersion') == self.regionVersion:
+                        self._upstreamStore = store
+                    else:
+                        store.close()
+                        logger.warning('Upstream polygons for %s are older than the gdbs, rerun preprocess.py', self.hucName)
+            return self._upstreamStore
+
+    def upstream_record(self, catchmentID):
+
+        #buffered adjoint catchment and, when hucs drain into it, the adjoint dissolved with every upstream huc
+        store = self.upstreamStore
+        if not store:
+            return None
+        with self.lock:
+            row = store.execute('SELECT adjoint, merged, area, hucs, junctions FROM upstream WHERE gridid = ?', (catchmentID,)).fetchone()
+        if row is None:
+            return None
+        adjoint, merged, area, hucs, junctions = row
+        return {
+            'adjoint': ogr.CreateGeometryFromWkb(bytes(adjoint)),
+            'merged': ogr.CreateGeometryFromWkb(bytes(merged)) if merged is not None else None,
+            'area': area,
+            'hucs': json.loads(hucs),
+            'junctions': json.loads(junctions)
+        }
+
+    @property
+    def catchmentEnvelopes(self):
+
+        #GridID -> envelope sidecar from preprocess.py, False when missing or older than the gdb
+        with self.lock:
+            if self._catchmentEnvelopes is None:
+                self._catchmentEnvelopes = False
+                envelopesPath = self.localDataPath + CATCHMENT_ENVELOPES_NAME
+                if os.path.exists(envelopesPath):
+                    with open(envelopesPath) as f:
+                        sidecar = json.load(f)
+                    if sidecar.get('dataVersion') == self.dataVersion:
+                        self._catchmentEnvelopes = sidecar['envelopes']
+                    else:
+                        logger.warning('Catchment grid for %s is older than its gdb, rerun preprocess.py', self.hucName)
+            return self._catchmentEnvelopes
+
+    @property
+    def catchmentGrid(self):
+
+        #GridID raster and envelopes from preprocess.py, False when either is missing or stale
+        with self.lock:
+            if self._catchmentGrid is None:
+                self._catchmentGrid = False
+                envelopes = self.catchmentEnvelopes
+                if envelopes and self.arrays is not None and 'catid' in self.arrays['grids']:
+                    self._catchmentGrid = (self.array_sampler('catid'), envelopes)
+                elif envelopes and os.path.exists(self.localDataPath + CATCHMENT_GRID_NAME):
+                    self._catchmentGrid = (RasterSampler(self.localDataPath + CATCHMENT_GRID_NAME), envelopes)
+            return self._catchmentGrid
+
+    def catchment_for_id(self, value):
+
+        #GridID cell value to (GridID, envelope), None for nodata or an id missing from the sidecar
+        envelopes = self.catchmentEnvelopes
+        if value is None or value == STACK_NODATA or not envelopes:
+            return None
+        catchmentID = str(int(value))
+        envelope = envelopes.get(catchmentID)
+        return (catchmentID, tuple(envelope)) if envelope is not None else None
+
+    def catchment_cell(self, x, y):
+
+        #GridID and envelope from the preprocessed grid, None when there is no grid to read
+        catchmentGrid = self.catchmentGrid
+        if not catchmentGrid:
+            return None
+
+        sampler, envelopes = catchmentGrid
+        value, outX, outY = sampler.sample(x, y)
+        if value is not None and value == sampler.nodata:
+            return None
+        return self.catchment_for_id(value)
+
+    def sample_local(self, x, y):
+
+        #str value, snapped cell corner and (GridID, envelope) or None for the cell holding x, y
+        if self.arrays is None and self.stack is not None and 'catid' in self.stack['bands']:
+
+            #one read of the pixel interleaved stack gives both bands
+            values, outX, outY = self.str_sampler.sample_bands(x, y)
+            if values is None:
+                return None, outX, outY, None
+            return values[self.stack['bands']['str'] - 1], outX, outY, self.catchment_for_id(values[self.stack['bands']['catid'] - 1])
+
+        value, outX, outY = self.str_sampler.sample(x, y)
+        return value, outX, outY, self.catchment_cell(x, y)
+
+    @property
+    def catchmentIndex(self):
+
+        #every catchment held in memory after the first request into this huc
+        with self.lock:
+            if self._catchmentIndex is None:
+                self._catchmentIndex = FeatureIndex.from_layer(self.catchmentLayer, self.catchmentLayerNameFieldIndex)
+            return self._catchmentIndex
+
+    def catchment_at(self, point):
+
+        #GridID and geometry of the catchment holding the point, the geometry is shared so don't modify it
+        index = self.catchmentIndex
+        i = index.at_point(point.GetX(), point.GetY())
+        if i is None:
+            return None, None
+        return index.values[i], index.geometries[i]
+
+    def array_sampler(self, name):
+        grid = self.arrays['grids'][name]
+        return ArraySampler(self.localDataPath + ARRAY_STORE_DIR + grid['file'], grid)
+
+    @property
+    def str_sampler(self):
+        with self.lock:
+            if self._str_sampler is None:
+                if self.arrays is not None:
+                    self._str_sampler = self.array_sampler('str')
+                elif self.stack is not None:
+                    self._str_sampler = RasterSampler(self.localDataPath + STACK_DIR + self.stack['cells'], self.stack['bands']['str'])
+                else:
+                    self._str_sampler = RasterSampler(self.str_grid)
+            return self._str_sampler
+
+    @property
+    def fdr_sampler(self):
+        with self.lock:
+            if self._fdr_sampler is None:
+                if self.arrays is not None:
+                    self._fdr_sampler = self.array_sampler('fdr')
+                elif self.stack is not None:
+                    self._fdr_sampler = RasterSampler(self.localDataPath + STACK_DIR + self.stack['fdr'])
+                else:
+                    self._fdr_sampler = RasterSampler(self.fdr_grid)
+            return self._fdr_sampler
+
+class RegionHandle:
+
+    def __init__(self, dataPath, region, max_hucs=MAX_HUCS_PER_REGION):
+
+        self.region = region
+        self.globalDataPath = dataPath + region + '/archydro/'
+        self.max_hucs = max_hucs
+        self.hucs = OrderedDict()
+
+        #layers share one gdb handle so filters must not interleave between threads
+        self.lock = threading.RLock()
+
+        # opening the FileGDB
+        self.global_gdb = None
+        for globalGDBName in GLOBAL_GDB_LIST:
+            self.globalGDBPath = self.globalDataPath + globalGDBName
+            self.global_gdb = open_gdb(self.globalGDBPath)
+            if self.global_gdb is not None:
+                break
+        if self.global_gdb is None:
+            logger.error('Missing global gdb for: %s', region)
+
+        #global HUC layer (should be only one possibility)
+        self.hucLayer = self.global_gdb.GetLayer(HUCPOLY_LAYER)
+        if self.hucLayer is None:
+            logger.error('Missing the hucpoly layer for: %s', region)
+
+        self.hucNameFieldIndex = self.hucLayer.GetLayerDefn().GetFieldIndex(HUCPOLY_LAYER_ID)
+        if self.hucNameFieldIndex == -1:
+            logger.error('Missing hucNameFieldIndex: %s', HUCPOLY_LAYER_ID)
+
+        self.hucJunctionFieldIndex = self.hucLayer.GetLayerDefn().GetFieldIndex(HUCPOLY_LAYER_JUNCTION_ID)
+        if self.hucJunctionFieldIndex == -1:
+            logger.error('Missing hucJunctionFieldIndex: %s', HUCPOLY_LAYER_JUNCTION_ID)
+
+        #global streams layer (multiple possibilities)
+        self.globalStreamsLayer = first_layer(self.global_gdb, GLOBAL_STREAM_LAYER_LIST)
+        if self.globalStreamsLayer is None:
+            logger.error('Missing global streams layer for: %s', region)
+
+        self.globalStreamsHydroIdIndex = self.globalStreamsLayer.GetLayerDefn().GetFieldIndex(GLOBAL_STREAM_LAYER_ID)
+        if self.globalStreamsHydroIdIndex == -1:
+            logger.error('globalStreamsHydroIdIndex: %s', GLOBAL_STREAM_LAYER_ID)
+
+        #huc_net_junctions layer (multiple possibilities)
+        self.hucNetJunctionsLayer = first_layer(self.global_gdb, HUC_NET_JUNCTIONS_LAYER_LIST)
+        if self.hucNetJunctionsLayer is None:
+            logger.error('Missing huc_net_junctions layer for: %s', region)
+
+        #looks like there are also multiple possibilities for the huc_net_junctions layerID field
+        for hucNetJunctionsLayerID in HUC_NET_JUNCTIONS_LAYER_ID_LIST:
+            self.hucNetJunctionsIdIndex = self.hucNetJunctionsLayer.GetLayerDefn().GetFieldIndex(hucNetJunctionsLayerID)
+            if self.hucNetJunctionsIdIndex != -1:
+                break
+        if self.hucNetJunctionsIdIndex == -1:
+            logger.error('huc_net_junctions ID not found for: %s', region)
+
+        #Create a transformation between this and the hucpoly projection
+        self.region_ref = self.hucLayer.GetSpatialRef()
+        self.webmerc_ref = osr.SpatialReference()
+        self.webmerc_ref.ImportFromEPSG(4326)
+
+        #gdal 3 changes require this line: https://github.com/OSGeo/gdal/blob/master/gdal/swig/python/samples/ogr2ogr.py
+        self.webmerc_ref.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+
+        self.toRegion = osr.CoordinateTransformation(self.webmerc_ref, self.region_ref)
+        self.toWGS = osr.CoordinateTransformation(self.region_ref, self.webmerc_ref)
+
+        #cached results built from this gdb are keyed on its version
+        self.dataVersion = data_version(self.globalGDBPath)
+
+        #preprocessed raster stacks, hucs without one read their original grids
+        self.stacks = load_stacks(self.globalDataPath)
+
+        self._huc_graph = None
+        self._hucIndex = None
+        self._globalStreamIndex = None
+
+    @property
+    def hucIndex(self):
+        with self.lock:
+            if self._hucIndex is None:
+                self._hucIndex = FeatureIndex.from_layer(self.hucLayer, self.hucNameFieldIndex)
+            return self._hucIndex
+
+    @property
+    def globalStreamIndex(self):
+        with self.lock:
+            if self._globalStreamIndex is None:
+                self._globalStreamIndex = FeatureIndex.from_layer(self.globalStreamsLayer, self.globalStreamsHydroIdIndex)
+            return self._globalStreamIndex
+
+    def build_indexes(self):
+
+        #warm up builds everything the first request would otherwise pay for
+        self.hucIndex
+        self.globalStreamIndex
+        self.huc_graph
+
+    @property
+    def huc_graph(self):
+
+        #built on first use, every later global search is a walk over this graph
+        with self.lock:
+            if self._huc_graph is None:
+                self._huc_graph = HucGraph.from_layers(self.hucLayer, self.hucNameFieldIndex, self.hucJunctionFieldIndex, self.hucNetJunctionsLayer, self.hucNetJunctionsIdIndex)
+            return self._huc_graph
+
+    def project(self, lng, lat):
+
+        #coordinate transformations are not safe to share between threads
+        with self.lock:
+            x, y, z = self.toRegion.TransformPoint(lng, lat)
+        return x, y
+
+    def to_wgs(self, geom):
+
+        #transforms geom in place, same transformation reused for every output
+        with self.lock:
+            geom.Transform(self.toWGS)
+        return geom
+
+    def huc_for_point(self, point):
+
+        #find the HUC the point is in from the in-memory index
+        index = self.hucIndex
+        i = index.at_point(point.GetX(), point.GetY())
+        return index.values[i] if i is not None else None
+
+    def dissolve_hucs(self, huc_list):
+
+        #create multipolygon container for all watershed parks
+        mergedWatershed = ogr.Geometry(ogr.wkbMultiPolygon)
+
+        with self.lock:
+
+            #make sure filter is clear
+            self.hucLayer.SetAttributeFilter(None)
+
+            #set attribute filter 
+            if len(huc_list) == 1:
+                self.hucLayer.SetAttributeFilter(HUCPOLY_LAYER_ID + " = '" + huc_list[0] + "'")
+            #'in' operator doesnt work with list len of 1
+            else:
+                self.hucLayer.SetAttributeFilter(HUCPOLY_LAYER_ID + ' IN {}'.format(tuple(huc_list)))
+
+            #loop and merge upstream global HUCs
+            for huc_select_feat in self.hucLayer:
+                upstreamHUCgeom = huc_select_feat.GetGeometryRef()
+
+                #add polygon parts to container
+                if upstreamHUCgeom.GetGeometryName() == 'MULTIPOLYGON':
+                    for geom_part in upstreamHUCgeom:
+                        mergedWatershed.AddGeometry(geom_part)
+                else:
+                    mergedWatershed.AddGeometry(upstreamHUCgeom)
+
+            self.hucLayer.SetAttributeFilter(None)
+
+        return mergedWatershed.UnionCascaded()
+
+    def global_stream_near(self, point, distance):
+
+        #global stream within distance of the point, same as the old buffered point filter
+        index = self.globalStreamIndex
+        i = index.near_point(point.GetX(), point.GetY(), distance)
+        return index.values[i] if i is not None else None
+
+    def huc(self, hucName):
+
+        with self.lock:
+            handle = self.hucs.get(hucName)
+            if handle is not None:
+                self.hucs.move_to_end(hucName)
+                return handle
+
+            handle = HucHandle(self.globalDataPath, hucName, self.stacks.get(hucName), self.dataVersion)
+            self.hucs[hucName] = handle
+
+            #least recently used hucs are dropped, requests still holding one keep it alive
+            while len(self.hucs) > self.max_hucs:
+                self.hucs.popitem(last=False)
+
+            return handle
+
+class RegionCatalog:
+
+    def __init__(self, dataPath, max_regions=MAX_REGIONS, max_hucs=MAX_HUCS_PER_REGION):
+
+        self.dataPath = dataPath
+        self.max_regions = max_regions
+        self.max_hucs = max_hucs
+        self.regions = OrderedDict()
+        self.lock = threading.Lock()
+
+        #dissolved upstream huc polygons as wkb, shared by every region
+        self.geometryCache = tiered_cache('geometry')
+
+    def region(self, region):
+
+        with self.lock:
+            handle = self.regions.get(region)
+            if handle is not None:
+                self.regions.move_to_end(region)
+                return handle
+
+            handle = RegionHandle(self.dataPath, region, self.max_hucs)
+            self.regions[region] = handle
+
+            while len(self.regions) > self.max_regions:
+                self.regions.popitem(last=False)
+
+            return handle
+
+    def warm(self, regions):
+
+        #open each region and build its indexes up front so the first request doesn't pay for it
+        for region in regions:
+            self.region(region).build_indexes()
+
+_catalogs = {}
+_catalogsLock = threading.Lock()
+
+def get_catalog(dataPath):
+
+    #one shared catalog per data path for the life of the process
+    with _catalogsLock:
+        catalog = _catalogs.get(dataPath)
+        if catalog is None:
+            catalog = RegionCatalog(dataPath)
+            _catalogs[dataPath] = catalog
+    return catalog
@@ -0,0 +1,166 @@
+## StreamStats catchment tracing
+
+# -----------------------------------------------------
+# Vectorized D8 catchment tracer working directly on an
+# in-memory flow direction array
+# -----------------------------------------------------
+
+# list of required python packages:
+# numpy
+
+import numpy as np
+import logging
+
+#flow direction codes in N, NE, E, SE, S, SW, W, NW order (same order pysheds uses)
+ESRI_DIRMAP = (64, 128, 1, 2, 4, 8, 16, 32)
+
+#row, col offset to the cell each direction drains into
+D8_OFFSETS = ((-1, 0), (-1, 1), (0, 1), (1, 1), (1, 0), (1, -1), (0, -1), (-1, -1))
+
+#cells searched outward from the click when snapping to a stream, 450 m on the 30 m NHDPlus grid.
+#the pysheds snap searched the whole window, a click further out than this keeps its own cell
+SNAP_RADIUS = 15
+
+#NLDI mode snaps to any cell draining more than this many cells, the rule it used with pysheds (acc > 50)
+NLDI_SNAP_THRESHOLD = 50
+
+#sliver buffer on merged polygons, shared by delineate.py and the upstream polygons preprocess.py stores
+POLYGON_BUFFER_DISTANCE = 1
+
+logger = logging.getLogger(__name__)
+
+def cell_index(transform, x, y):
+
+    #row, col of the cell whose top left corner (or interior) holds x, y
+    col = int(np.floor((x - transform[0]) / transform[1] + 1e-9))
+    row = int(np.floor((y - transform[3]) / transform[5] + 1e-9))
+    return row, col
+
+def receivers(fdr, dirmap=ESRI_DIRMAP):
+
+    #flat index of the cell each cell drains into, rows * cols for off grid, nodata or sinks
+    rows, cols = fdr.shape
+    size = rows * cols
+    indexType = np.int32 if size < 2 ** 31 - 1 else np.int64
+
+    fdr = fdr.ravel()
+    receiver = np.full(size + 1, size, dtype=indexType)
+
+    for code, (dr, dc) in zip(dirmap, D8_OFFSETS):
+        donor = np.flatnonzero(fdr == code).astype(indexType)
+        if not len(donor):
+            continue
+        donorRows, donorCols = np.divmod(donor, cols)
+        inside = (donorRows + dr >= 0) & (donorRows + dr < rows) & (donorCols + dc >= 0) & (donorCols + dc < cols)
+        donor = donor[inside]
+        receiver[donor] = donor + (dr * cols + dc)
+
+    return receiver
+
+def trace_catchment(fdr, row, col, dirmap=ESRI_DIRMAP):
+
+    rows, cols = fdr.shape
+    if not (0 <= row < rows and 0 <= col < cols):
+        raise ValueError('pour point is outside the flow direction window')
+
+    size = rows * cols
+    receiver = receivers(fdr, dirmap)
+
+    #pour point becomes a sink so every path either ends there or runs off the window
+    start = row * cols + col
+    receiver[start] = start
+
+    #pointer jumping: each pass doubles how far down its flow path every cell points,
+    #so a path of any length resolves in log2 passes with no recursion or per-cell loop
+    active = np.flatnonzero((receiver[:size] != start) & (receiver[:size] != size)).astype(receiver.dtype)
+    for i in range(int(np.ceil(np.log2(size + 1))) + 1):
+        if not len(active):
+            break
+        jumped = receiver[receiver[active]]
+        receiver[active] = jumped
+
+        #cells already pointing at the pour point or off the window are settled
+        active = active[(jumped != start) & (jumped != size)]
+
+    #anything still active is stuck in a flow direction loop and never reaches the pour point
+    visited = (receiver[:size] == start).reshape(rows, cols)
+
+    #trim to the bounding window of the catchment
+    rowHits = np.flatnonzero(visited.any(axis=1))
+    colHits = np.flatnonzero(visited.any(axis=0))
+    window = (int(rowHits[0]), int(rowHits[-1]) + 1, int(colHits[0]), int(colHits[-1]) + 1)
+    mask = visited[window[0]:window[1], window[2]:window[3]]
+
+    return mask, window
+
+def upstream_counts(fdr, candidates, dirmap=ESRI_DIRMAP):
+
+    #cells draining through each candidate (itself included), without a flow accumulation pass over the window
+    rows, cols = fdr.shape
+    size = rows * cols
+    receiver = receivers(fdr, dirmap)
+    candidates = np.asarray(candidates, dtype=receiver.dtype)
+
+    isStop = np.zeros(size + 1, dtype=bool)
+    isStop[candidates] = True
+    isStop[size] = True
+
+    #candidates become sinks, pointer jumping then resolves every cell to the first candidate below it
+    downstream = receiver[candidates].copy()
+    receiver[candidates] = candidates
+    active = np.flatnonzero(~isStop[receiver[:size]]).astype(receiver.dtype)
+    for i in range(int(np.ceil(np.log2(size + 1))) + 1):
+        if not len(active):
+            break
+        jumped = receiver[receiver[active]]
+        receiver[active] = jumped
+        active = active[~isStop[jumped]]
+
+    #cells stuck in a flow direction loop never reach a stop and are left out
+    first = receiver[:size]
+    reaches = isStop[first] & (first != size)
+    own = np.bincount(first[reaches], minlength=size + 1)[candidates]
+
+    #candidate next below each candidate, so totals add up along the small candidate tree
+    position = dict((int(cell), i) for i, cell in enumerate(candidates))
+    below = [position.get(int(receiver[cell])) if cell != size else None for cell in downstream]
+
+    counts = own.astype('int64')
+    for i in range(len(candidates)):
+        seen = set([i])
+        j = below[i]
+        while j is not None and j not in seen:
+            counts[j] += own[i]
+            seen.add(j)
+            j = below[j]
+    return counts
+
+def snap_to_stream(fdr, row, col, threshold, radius=SNAP_RADIUS, dirmap=ESRI_DIRMAP):
+
+    #nearest cell within radius draining more than threshold cells, the click itself when there is none
+    rows, cols = fdr.shape
+    if not (0 <= row < rows and 0 <= col < cols):
+        raise ValueError('pour point is outside the flow direction window')
+
+    searchRows, searchCols = np.mgrid[max(row - radius, 0):min(row + radius + 1, rows), max(col - radius, 0):min(col + radius + 1, cols)]
+    searchRows = searchRows.ravel()
+    searchCols = searchCols.ravel()
+    counts = upstream_counts(fdr, searchRows * cols + searchCols, dirmap)
+
+    distance = (searchRows - row) ** 2 + (searchCols - col) ** 2
+    inside = (distance <= radius ** 2) & (counts > threshold)
+    if not inside.any():
+        logger.warning('No cell draining more than %s cells within %s cells of the pour point, using the clicked cell', threshold, radius)
+        return row, col
+
+    #closest first, the bigger stream wins a tie
+    order = np.lexsort((-counts, distance))
+    best = order[inside[order]][0]
+    return int(searchRows[best]), int(searchCols[best])
+
+def window_transform(transform, window):
+
+    #geotransform of a row/col window cut from a larger grid
+    row0, row1, col0, col1 = window
+    return (transform[0] + col0 * transform[1] + row0 * transform[2], transform[1], transform[2],
+            transform[3] + col0 * transform[4] + row0 * transform[5], transform[4], transform[5])
@@ -7,40 +7,35 @@
 # -----------------------------------------------------
 
 # list of required python packages:
-# gdal, pysheds
+# gdal, numpy
 
 ###### CONDA CREATE ENVIRONMENT COMMAND
-#conda create -n delineate python=3.6.8 gdal pysheds
+#conda create -n delineate python=3.6.8 gdal numpy
 ###### CONDA CREATE ENVIRONMENT COMMAND
 
-from osgeo import ogr, osr, gdal
-from pysheds.grid import Grid
+from osgeo import ogr, gdal
+from catchment import trace_catchment, cell_index, window_transform, POLYGON_BUFFER_DISTANCE
+from polygonize import mask_to_geometry
+from metrics import Metrics, count_vertices
+from output import Feature, encode, COORDINATE_PRECISION
+import logging
 import time
 import json
 
+from cache import cache_key
+from catalog import get_catalog, ADJOINT_CATCHMENT_LAYER_ID
+
 #arguments
-GLOBAL_GDB_LIST = ['global.GDB','global.gdb']
-HUCPOLY_LAYER = 'hucpoly'
-HUCPOLY_LAYER_ID = 'NAME'
-HUCPOLY_LAYER_JUNCTION_ID = 'JunctionID'
-GLOBAL_STREAM_LAYER_LIST = ['streams', 'streams3d']
-GLOBAL_STREAM_LAYER_ID = 'HydroID'
-HUC_NET_JUNCTIONS_LAYER_LIST = ['Huc_net_Junctions3D','Huc_net_Junctions']
-HUC_NET_JUNCTIONS_LAYER_ID_LIST = ['Point2DID', 'HydroID']
-CATCHMENT_LAYER = 'Catchment'
-CATCHMENT_LAYER_ID = 'GridID'
-ADJOINT_CATCHMENT_LAYER = 'AdjointCatchment'
-ADJOINT_CATCHMENT_LAYER_ID = 'GridID'
 POINT_BUFFER_DISTANCE = 5 # used for searching line features for local and global
-POLYGON_BUFFER_DISTANCE = 1 # used for eliminating slivers when merging polygon geometries
-FAC_SNAP_THRESHOLD = 900 
+
+logger = logging.getLogger(__name__)
 
 class Watershed:
 
     ogr.UseExceptions()
     gdal.UseExceptions() 
 
-    def __init__(self, y=None, x=None, region=None, dataPath=None):
+    def __init__(self, y=None, x=None, region=None, dataPath=None, catalog=None, precision=COORDINATE_PRECISION):
 
         self.x = x
         self.y = y
@@ -51,432 +46,350 @@ class Watershed:
         self.splitCatchment = None
         self.adjointCatchment = None
         self.mergedCatchment = None
-        self.driver = ogr.GetDriverByName("OpenFileGDB")
+        self.classification = None
+        self.upstreamRecord = None
+        self.precision = precision
+
+        #stage timers and counters for this request
+        self.metrics = Metrics()
+
+        #open datasets are shared between requests through the catalog
+        self.catalog = catalog if catalog is not None else get_catalog(dataPath)
 
         #kick off
-        self.get_global() 
+        with self.metrics.stage('total'):
+            self.get_global() 
 
-    def serialize(self):
-        return {
+    def serialize(self, include_metrics=False):
+        results = {
             'splitCatchment': self.splitCatchment, 
             'adjointCatchment': self.adjointCatchment,
             'mergedCatchment': self.mergedCatchment
         }
+        if include_metrics:
+            results['metrics'] = self.metrics.as_dict()
+        return results
 
-    def split_catchment(self, flow_dir, geom, x, y): 
+    def to_json(self, include_metrics=False):
 
-        #method to use catchment bounding box instead of exact geom
-        minX, maxX, minY, maxY = geom.GetEnvelope()
-        print('HERE', minX, minY, maxX, maxY)
-        gdal.Warp('/vsimem/fdr.tif', flow_dir, outputBounds=[minX, minY, maxX, maxY])
+        #response body as utf-8 bytes, feature geometry text is written as ogr exported it
+        return self.encode('geojson', include_metrics)
 
-        #start pysheds catchment delineation
-        grid = Grid.from_raster('/vsimem/fdr.tif', data_name='dir')
+    def encode(self, format='geojson', include_metrics=False):
 
-        #get catchment with pysheds
-        grid.catchment(data='dir', x=x, y=y, out_name='catch', recursionlimit=15000, xytype='label')
+        #geojson, topojson (shared arcs, quantized) or flatgeobuf bytes
+        return encode(self.serialize(include_metrics).items(), format)
 
-        # Clip the bounding box to the catchment
-        grid.clip_to('catch')
+    def split_catchment(self, flow_dir, envelope, x, y): 
 
-        #some sort of strange raster to polygon conversion using rasterio method
-        shapes = grid.polygonize()
+        with self.metrics.stage('split_catchment'):
 
-        #get split Catchment geometry
-        print('Split catchment complete')
-        split_geom = ogr.Geometry(ogr.wkbPolygon)
+            #method to use catchment bounding box instead of exact geom
+            minX, maxX, minY, maxY = envelope
+            logger.debug('Split catchment envelope: %s %s %s %s', minX, minY, maxX, maxY)
 
-        for shape in shapes:
-            split_geom = split_geom.Union(ogr.CreateGeometryFromJson(json.dumps(shape[0])))
-        
-        return split_geom
+            #read the window straight from the open fdr grid, no intermediate raster
+            fdr, transform = flow_dir.read_window(minX, maxX, minY, maxY)
+            self.metrics.add('cellsRead', fdr.size)
+            self.metrics.add('bytesRead', fdr.nbytes)
 
-    def retrieve_pixel_value(self, geo_coord, raster):
-        dataset = gdal.Open(raster)
-        transform = dataset.GetGeoTransform()
-        xOrigin = transform[0]
-        yOrigin = transform[3]
-        pixelWidth = transform[1]
-        pixelHeight = -transform[5]
+            #trace the catchment upstream of the pour point cell, no recursion limit
+            row, col = cell_index(transform, x, y)
+            mask, window = trace_catchment(fdr, row, col)
+            self.metrics.add('splitCells', int(mask.sum()))
 
-        cols = dataset.RasterXSize
-        rows = dataset.RasterYSize
-        band = dataset.GetRasterBand(1)
-        data = band.ReadAsArray(0, 0, cols, rows)
+            #get split Catchment geometry
+            split_geom = mask_to_geometry(mask, window_transform(transform, window))
+            logger.debug('Split catchment complete')
 
-        col = int((geo_coord[0] - xOrigin) / pixelWidth)
-        row = int((yOrigin - geo_coord[1] ) / pixelHeight)
-        value = data[row][col]
+        return split_geom
 
-        #pysheds actually wants the top left of pixel, not the center
-        outX = ((col * pixelWidth) + xOrigin)
-        outY = ((row * -pixelHeight) + yOrigin)
+    def geom_to_geojson(self, in_geom, name, simplify_tolerance, write_output=False):
+        with self.metrics.stage('geom_to_geojson'):
 
-        del dataset #cleanup
+            #simplify returns a new geometry, the original is untouched
+            transform_geom = in_geom.Simplify(simplify_tolerance)
 
-        #return value and adjusted x,y
-        return(value, outX, outY)
+            #get area in local units
+            area = transform_geom.GetArea()
 
-    def geom_to_geojson(self, in_geom, name, simplify_tolerance, in_ref, out_ref, write_output=False):
-        in_geom = in_geom.Simplify(simplify_tolerance)
-        out_ref.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+            #trasnsform geometry from whatever the local projection is to wgs84, reusing the region transform
+            self.regionHandle.to_wgs(transform_geom)
+            json_text = transform_geom.ExportToJson(options=['COORDINATE_PRECISION=%d' % self.precision])
+            self.metrics.add('outputVertices', count_vertices(transform_geom))
 
-        transform = osr.CoordinateTransformation(in_ref, out_ref)
-        
-        #don't want to affect original geometry
-        transform_geom = in_geom.Clone()
-        
-        #trasnsform geometry from whatever the local projection is to wgs84
-        transform_geom.Transform(transform)
-        json_text = transform_geom.ExportToJson()
+            logger.info('processing: %s area: %s', name, area*0.00000038610)
+
+            feature = Feature(json_text, area, transform_geom)
 
-        #add some attributes
-        geom_json = json.loads(json_text)
+            if write_output:
+                f = open('./' + name + '.geojson','w')
+                f.write(feature.to_json())
+                f.close()
+                logger.info('Exported geojson: %s', name)
+        
+            return feature
 
-        #get area in local units
-        area = in_geom.GetArea()
+    def search_upstream_geometry(self, geom, name):
 
-        print('processing: ' + name + ' area: ' + str(area*0.00000038610))
+        with self.metrics.stage('search_upstream_geometry'):
 
-        geojson_dict = {
-            "type": "Feature",
-            "geometry": geom_json,
-            "properties": {
-                "area": area
-            }
-        }
+            logger.debug('Search upstream geometry: %s', name)
 
-        if write_output:
-            f = open('./' + name + '.geojson','w')
-            f.write(json.dumps(geojson_dict))
-            f.close()
-            print('Exported geojson:', name)
-        
-        return geojson_dict
+            #junction -> huc graph is built once per region
+            hucGraph = self.regionHandle.huc_graph
 
-    def search_upstream_geometry(self, geom, name):
+            #get list of huc_net_junctions using merged catchment geometry
+            junctions = hucGraph.junctions_in(geom)
+            if len(junctions) == 0:
+                logger.error('no huc_net_junction features found within the geom: %s', name)
+                return
 
-        print('Search upstream geometry:', name)
-        
+            for junctionID in junctions:
+                if junctionID not in self.huc_net_junction_list:
+                    self.huc_net_junction_list.append(junctionID)
 
-        #get list of huc_net_junctions using merged catchment geometry
-        self.hucNetJunctionsLayer.SetSpatialFilter(None)
-        self.hucNetJunctionsLayer.SetSpatialFilter(geom)
-        self.hucNetJunctionsFeat = None
-
-        #loop over each junction
-        for hucNetJunctions_feat in self.hucNetJunctionsLayer:
-            self.hucNetJunctionsID = hucNetJunctions_feat.GetFieldAsString(self.hucNetJunctionsIdIndex)
-            self.hucNetJunctionsFeat = hucNetJunctions_feat
-            s = (HUCPOLY_LAYER_JUNCTION_ID + " = " + self.hucNetJunctionsID + "")
-            #print('huc search string:',s)
-            if s not in self.huc_net_junction_list:
-                self.huc_net_junction_list.append(s)
-
-        if not self.hucNetJunctionsFeat:
-            print('ERROR: no huc_net_junction features found within the geom:',name)
-                
-        #print("HUC_net_junction list:",huc_net_junction_list)
+            #every huc draining through those junctions and everything upstream of them
+            for huc_name in hucGraph.upstream_hucs(junctions):
+                if huc_name not in self.upstream_huc_list:
+                    self.upstream_huc_list.append(huc_name)
 
-        if len(self.huc_net_junction_list) == 0:
             return
 
-        #search for upstream connected HUC using huc_net_junctions
-        operator = " OR "
-        huc_net_junction_string = operator.join(self.huc_net_junction_list) 
-        self.hucLayer.SetAttributeFilter(None)
-        self.hucLayer.SetAttributeFilter(huc_net_junction_string)
+    def dissolve_upstream_hucs(self, huc_list):
 
-        #loop over upstream HUCs
-        for huc_select_feat in self.hucLayer:
-            huc_name = huc_select_feat.GetFieldAsString(self.hucNameFieldIndex)
-            #print('found huc:',huc_name)
-            
-            if huc_name not in self.upstream_huc_list:
-                upstreamHUC = huc_select_feat.GetGeometryRef()
-                self.upstream_huc_list.append(huc_name)
+        with self.metrics.stage('dissolve_upstream_hucs'):
+
+            geometryCache = self.catalog.geometryCache
+            key = cache_key('hucs', self.region, self.regionHandle.dataVersion, sorted(huc_list))
+
+            cached = geometryCache.get(key)
+            if cached is not None:
+                logger.debug('Using cached upstream HUC geometry')
+                self.metrics.add('geometryCacheHits')
+                return ogr.CreateGeometryFromWkb(cached)
 
-                #recursive call to search next HUC
-                self.search_upstream_geometry(upstreamHUC, huc_name)
+            mergedWatershed = self.regionHandle.dissolve_hucs(huc_list)
+
+            geometryCache.put(key, bytes(mergedWatershed.ExportToWkb()))
+
+            return mergedWatershed
 
-        return       
-    
     def get_global(self):
 
-        globalDataPath = self.dataPath + self.region + '/archydro/'
-        self.global_gdb = None
-
-        # opening the FileGDB
-        for self.global_gdb in GLOBAL_GDB_LIST:
-            globalGDB = globalDataPath + self.global_gdb
-            self.global_gdb = self.driver.Open(globalGDB, 0)
-            if self.global_gdb is None:
-                continue    
-            break
-        if self.global_gdb is None:
-            print('ERROR: Missing global gdb for:', self.region)
-
-        print('y,x:',self.y,',',self.x,'\nRegion:',self.region,'\nGlobalDataPath:',globalDataPath,'\nGlobalGDB:',globalGDB)
-
-        #global HUC layer (should be only one possibility)
-        self.hucLayer = self.global_gdb.GetLayer(HUCPOLY_LAYER)
-        if self.hucLayer is None:
-            print('ERROR: Missing the hucpoly layer for:', self.region)
-
-        try:
-            self.hucNameFieldIndex = self.hucLayer.GetLayerDefn().GetFieldIndex(HUCPOLY_LAYER_ID)
-        except ValueError:
-            print('ERROR: Missing hucNameFieldIndex:', HUCPOLY_LAYER_ID)
-
-        #global streams layer (multiple possibilities)     
-        for globalStreamsLayerName in GLOBAL_STREAM_LAYER_LIST:
-            self.globalStreamsLayer = self.global_gdb.GetLayer(globalStreamsLayerName)
-            if self.globalStreamsLayer is None:
-                continue    
-            break
-        if self.globalStreamsLayer is None:
-            print('ERROR: Missing global streams layer for:', self.region)
-
-        try:
-            self.globalStreamsHydroIdIndex = self.globalStreamsLayer.GetLayerDefn().GetFieldIndex(GLOBAL_STREAM_LAYER_ID)
-        except ValueError:
-            print('ERROR: globalStreamsHydroIdIndex:', HUCPOLY_LAYER_ID)
-
-        #huc_net_junctions layer (multiple possibilities)
-        for hucNetJunctionsLayerName in HUC_NET_JUNCTIONS_LAYER_LIST:
-            self.hucNetJunctionsLayer = self.global_gdb.GetLayer(hucNetJunctionsLayerName)
-            if self.hucNetJunctionsLayer is None:
-                continue
-            break
-        if self.hucNetJunctionsLayer is None:
-            print('ERROR: Missing huc_net_junctions layer for:', self.region)
-
-        #looks like there are also multiple possibilities for the huc_net_junctions layerID field
-        for hucNetJunctionsLayerID in HUC_NET_JUNCTIONS_LAYER_ID_LIST:
-            self.hucNetJunctionsIdIndex = self.hucNetJunctionsLayer.GetLayerDefn().GetFieldIndex(hucNetJunctionsLayerID)
-            if self.hucNetJunctionsIdIndex == -1:
-                continue
-            break
-        if self.hucNetJunctionsIdIndex == -1:
-            print('ERROR: huc_net_junctions ID not found for:', region)
-
-        #Create a transformation between this and the hucpoly projection
-        self.region_ref = self.hucLayer.GetSpatialRef()
-        self.webmerc_ref = osr.SpatialReference()
-        self.webmerc_ref.ImportFromEPSG(4326)
-
-        #gdal 3 changes require this line: https://github.com/OSGeo/gdal/blob/master/gdal/swig/python/samples/ogr2ogr.py
-        self.webmerc_ref.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
-
-        ctran = osr.CoordinateTransformation(self.webmerc_ref,self.region_ref)
-
-        #Transform incoming longitude/latitude to the hucpoly projection
-        [self.projectedLng,self.projectedLat,z] = ctran.TransformPoint(self.x,self.y)
-
-        print(self.projectedLng,self.projectedLat)
-
-        #Create a point
-        inputPointProjected = ogr.Geometry(ogr.wkbPoint)
-        inputPointProjected.SetPoint_2D(0, self.projectedLng, self.projectedLat)
-
-        #find the HUC the point is in
-        self.hucLayer.SetSpatialFilter(inputPointProjected)
-
-        #Loop through the overlapped features and display the field of interest
-        for hucpoly_feat in self.hucLayer:
-            hucName = hucpoly_feat.GetFieldAsString(self.hucNameFieldIndex)
-            print('found your hucpoly: ',hucName)
-
-            #store local path info now that we know it
-            localDataPath = globalDataPath + hucName + '/'
-            localGDB = localDataPath + hucName + '.gdb'
-
-        try:
-            hucName
-        except NameError:
-            print('no hucpoly found')
-
-        #clear hucLayer spatial filter
-        self.hucLayer.SetSpatialFilter(None)
+        with self.metrics.stage('get_global'):
+
+            #region datasets, layers and field indexes are opened once and reused
+            self.regionHandle = self.catalog.region(self.region)
+            self.hucLayer = self.regionHandle.hucLayer
+            self.hucNameFieldIndex = self.regionHandle.hucNameFieldIndex
+            self.globalStreamsLayer = self.regionHandle.globalStreamsLayer
+            self.globalStreamsHydroIdIndex = self.regionHandle.globalStreamsHydroIdIndex
+            self.hucNetJunctionsLayer = self.regionHandle.hucNetJunctionsLayer
+            self.hucNetJunctionsIdIndex = self.regionHandle.hucNetJunctionsIdIndex
+            self.region_ref = self.regionHandle.region_ref
+            self.webmerc_ref = self.regionHandle.webmerc_ref
+
+            logger.info('y,x: %s, %s Region: %s GlobalDataPath: %s GlobalGDB: %s', self.y, self.x, self.region, self.regionHandle.globalDataPath, self.regionHandle.globalGDBPath)
+
+            #Transform incoming longitude/latitude to the hucpoly projection
+            self.projectedLng, self.projectedLat = self.regionHandle.project(self.x, self.y)
+
+            logger.debug('Projected point: %s, %s', self.projectedLng, self.projectedLat)
+
+            #Create a point
+            inputPointProjected = ogr.Geometry(ogr.wkbPoint)
+            inputPointProjected.SetPoint_2D(0, self.projectedLng, self.projectedLat)
+
+            #find the HUC the point is in
+            hucName = self.regionHandle.huc_for_point(inputPointProjected)
+            logger.debug('found your hucpoly: %s', hucName)
+
+            if hucName is None:
+                logger.error('no hucpoly found')
 
         #now that we know local huc, get rest of local info
-        self.get_local(inputPointProjected, localDataPath, localGDB)
+        self.hucHandle = self.regionHandle.huc(hucName)
+        self.get_local(inputPointProjected, self.hucHandle)
 
-    def get_local(self, inputPointProjected, localDataPath, localGDB):
-            
-        fdr_grid = localDataPath + 'fdr'
-        str_grid = localDataPath + 'str'
-
-        #to start assume we have a local
-        on_str_grid = False
-        self.isLocal = True
-        self.isLocalGlobal = False
-        self.isGlobal = False
-
-        #query str grid with pixel value
-        str_val, self.snappedProjectedX, self.snappedProjectedY = self.retrieve_pixel_value((self.projectedLng, self.projectedLat), str_grid)
-
-        #point is on an str cell
-        if str_val == 1:
-            on_str_grid = True
-
-        # opening the FileGDB
-        try:
-            local_gdb = self.driver.Open(localGDB, 0)
-        except e:
-            print('ERROR: Check to make sure you have a local gdb for:', hucName)
-
-        #define local data layers
-        catchmentLayer = local_gdb.GetLayer(CATCHMENT_LAYER)
-        if catchmentLayer is None:
-            print('ERROR: Check to make sure you have a local catchment for:', hucName)
-
-        adjointCatchmentLayer = local_gdb.GetLayer(ADJOINT_CATCHMENT_LAYER)
-        if adjointCatchmentLayer is None:
-            print('ERROR: Check to make sure you have a local adjoint catchment for:', hucName)
-
-        #Put the title of the field you are interested in here
-        catchmentLayerNameFieldIndex = catchmentLayer.GetLayerDefn().GetFieldIndex(CATCHMENT_LAYER_ID)
-        adjointCatchmentLayerNameFieldIndex = adjointCatchmentLayer.GetLayerDefn().GetFieldIndex(ADJOINT_CATCHMENT_LAYER_ID)
-
-        #Get local catchment
-        catchmentLayer.SetSpatialFilter(inputPointProjected)
-        catchmentFeat = None
-        for catchment_feat in catchmentLayer:
-            catchmentID = catchment_feat.GetFieldAsString(catchmentLayerNameFieldIndex)
-            catchmentFeat = catchment_feat
-            print('found your catchment. HydroID is: ',catchmentID)
-
-        if catchmentFeat:
-            catchmentGeom = catchmentFeat.GetGeometryRef()
-        else:
-            print('ERROR: A local catchment was not found for your input point')
+    def get_local(self, inputPointProjected, hucHandle):
+
+        with self.metrics.stage('get_local'):
 
-        #we know we are on an str cell, so need to check for an adjointCatchment
-        if on_str_grid:
+            #to start assume we have a local
+            on_str_grid = False
+            self.isLocal = True
+            self.isLocalGlobal = False
+            self.isGlobal = False
 
-            #select adjoint catchment layer using ID from current catchment
-            select_string = (ADJOINT_CATCHMENT_LAYER_ID + " = '" + catchmentID + "'")
-            print('select string:',select_string)
-            adjointCatchmentLayer.SetAttributeFilter(select_string)
+            #query str grid with pixel value, a preprocessed stack returns the GridID from the same read
+            str_val, self.snappedProjectedX, self.snappedProjectedY, catchment = hucHandle.sample_local(self.projectedLng, self.projectedLat)
+            self.metrics.add('cellsRead')
 
-            adjointCatchmentFeat = None
-            for adjointCatchment_feat in adjointCatchmentLayer:
-                print('found upstream adjointCatchment')
-                self.adjointCatchmentGeom = adjointCatchment_feat.GetGeometryRef()
-                adjointCatchmentFeat = adjointCatchment_feat
+            #point is on an str cell
+            if str_val == 1:
+                on_str_grid = True
 
-                #create multipolygon container for all parts
-                mergedAdjointCatchmentGeom = ogr.Geometry(ogr.wkbMultiPolygon)
+            adjointCatchmentLayer = hucHandle.adjointCatchmentLayer
 
-                #for some reason this is coming out as multipolygon
-                if self.adjointCatchmentGeom.GetGeometryName() == 'MULTIPOLYGON':
-                    for geom_part in self.adjointCatchmentGeom:
-                        mergedAdjointCatchmentGeom.AddGeometry(geom_part)
-                        
-                    self.adjointCatchmentGeom = mergedAdjointCatchmentGeom.UnionCascaded()
+            #Get local catchment id and envelope, from the preprocessed GridID grid when there is one
+            if catchment is not None:
+                catchmentID, catchmentEnvelope = catchment
+            else:
+                #otherwise from the huc's in-memory index, only read from so no clone needed
+                catchmentID, catchmentGeom = hucHandle.catchment_at(inputPointProjected)
+                catchmentEnvelope = catchmentGeom.GetEnvelope() if catchmentGeom is not None else None
+
+            if catchmentEnvelope is not None:
+                logger.debug('found your catchment. HydroID is: %s', catchmentID)
+            else:
+                logger.error('A local catchment was not found for your input point')
 
-            #there are cases where a point has str cell, but does not have an adjointCatchment
-            if adjointCatchmentFeat:
-                print('point is a localGlobal')
+            #precomputed upstream polygons already hold the buffered adjoint catchment
+            if on_str_grid and catchmentID is not None:
+                self.upstreamRecord = hucHandle.upstream_record(catchmentID)
 
+            if self.upstreamRecord is not None:
+                logger.debug('found precomputed upstream polygons for: %s', catchmentID)
+                self.adjointCatchmentGeom = self.upstreamRecord['adjoint']
                 self.isLocal = False
                 self.isLocalGlobal = True
+                self.metrics.add('precomputedUpstream')
 
-                #buffer point
-                bufferPoint = inputPointProjected.Buffer(POINT_BUFFER_DISTANCE)
+                globalStreamID = self.regionHandle.global_stream_near(inputPointProjected, POINT_BUFFER_DISTANCE)
+                if globalStreamID is not None:
+                    logger.debug('input point is type "global" with ID: %s', globalStreamID)
+                    self.isGlobal = True
 
-                #since we know we are local global, also check if we are global
-                self.globalStreamsLayer.SetSpatialFilter(bufferPoint)
+            #we know we are on an str cell, so need to check for an adjointCatchment
+            elif on_str_grid:
 
-                #Loop through the overlapped features and display the field of interest
-                for stream_feat in self.globalStreamsLayer:
-                    globalStreamID = stream_feat.GetFieldAsString(self.globalStreamsHydroIdIndex)
-                    print('input point is type "global" with ID:', globalStreamID)
-                    self.isGlobal = True
-            else:
-                print('point is a local')
+                #select adjoint catchment layer using ID from current catchment
+                select_string = (ADJOINT_CATCHMENT_LAYER_ID + " = '" + catchmentID + "'")
+                logger.debug('select string: %s', select_string)
 
-        else:
-            #no adjoint catchment
-            print('No adjoint catchment for this point')
+                adjointCatchmentFeat = None
+                with hucHandle.lock:
+                    adjointCatchmentLayer.SetAttributeFilter(select_string)
 
-        #print("Time before split catchment:",time.perf_counter() - timeBefore)
-        print('Projected X,Y:',self.projectedLng, ',', self.projectedLat)
-        print('Center Projected X,Y:',self.snappedProjectedX, ',', self.snappedProjectedY)
+                    for adjointCatchment_feat in adjointCatchmentLayer:
+                        logger.debug('found upstream adjointCatchment')
+                        self.adjointCatchmentGeom = adjointCatchment_feat.GetGeometryRef().Clone()
+                        adjointCatchmentFeat = adjointCatchment_feat
 
-        self.splitCatchmentGeom = self.split_catchment(fdr_grid, catchmentGeom, self.snappedProjectedX, self.snappedProjectedY)
+                        #create multipolygon container for all parts
+                        mergedAdjointCatchmentGeom = ogr.Geometry(ogr.wkbMultiPolygon)
 
-        #print("Time after split catchment:",time.perf_counter() - timeBefore)
+                        #for some reason this is coming out as multipolygon
+                        if self.adjointCatchmentGeom.GetGeometryName() == 'MULTIPOLYGON':
+                            for geom_part in self.adjointCatchmentGeom:
+                                mergedAdjointCatchmentGeom.AddGeometry(geom_part)
 
-        #cleanup
-        del local_gdb
+                            self.adjointCatchmentGeom = mergedAdjointCatchmentGeom.UnionCascaded()
+
+                    adjointCatchmentLayer.SetAttributeFilter(None)
+
+                #there are cases where a point has str cell, but does not have an adjointCatchment
+                if adjointCatchmentFeat:
+                    logger.debug('point is a localGlobal')
+
+                    self.isLocal = False
+                    self.isLocalGlobal = True
+
+                    #since we know we are local global, also check if we are global
+                    globalStreamID = self.regionHandle.global_stream_near(inputPointProjected, POINT_BUFFER_DISTANCE)
+                    if globalStreamID is not None:
+                        logger.debug('input point is type "global" with ID: %s', globalStreamID)
+                        self.isGlobal = True
+                else:
+                    logger.debug('point is a local')
+
+            else:
+                #no adjoint catchment
+                logger.debug('No adjoint catchment for this point')
+
+            if self.isGlobal:
+                self.classification = 'global'
+            elif self.isLocalGlobal:
+                self.classification = 'localGlobal'
+            else:
+                self.classification = 'local'
+            self.metrics.classification = self.classification
+
+            logger.debug('Projected X,Y: %s, %s', self.projectedLng, self.projectedLat)
+            logger.debug('Center Projected X,Y: %s, %s', self.snappedProjectedX, self.snappedProjectedY)
+
+        self.splitCatchmentGeom = self.split_catchment(hucHandle.fdr_sampler, catchmentEnvelope, self.snappedProjectedX, self.snappedProjectedY)
 
         self.aggregate_geometries()
 
+    def precomputed_upstream(self):
+
+        #stored polygon is only complete when no junction inside the split adds hucs it doesn't have
+        record = self.upstreamRecord
+        if record is None or record['merged'] is None:
+            return False
+        if not set(self.regionHandle.huc_graph.junctions_in(self.splitCatchmentGeom)) <= set(record['junctions']):
+            logger.debug('split catchment holds junctions the precomputed polygon does not')
+            return False
+
+        self.huc_net_junction_list = list(record['junctions'])
+        self.upstream_huc_list = list(record['hucs'])
+        return True
+
     def aggregate_geometries(self):
 
-        #merge adjoint Catchment geom with split catchment and were done
-        if self.isLocalGlobal:
-        
-            #apply a small buffer to adjoint catchment to remove sliver
-            self.adjointCatchmentGeom = self.adjointCatchmentGeom.Buffer(POLYGON_BUFFER_DISTANCE)
-            
-            #need to merge splitCatchment and adjointCatchment
-            mergedCatchmentGeom = self.adjointCatchmentGeom.Union(self.splitCatchmentGeom)
+        with self.metrics.stage('aggregate_geometries'):
+
+            #apply a small buffer to adjoint catchment to remove sliver, stored adjoint catchments already have it
+            if self.isLocalGlobal and self.upstreamRecord is None:
+                self.adjointCatchmentGeom = self.adjointCatchmentGeom.Buffer(POLYGON_BUFFER_DISTANCE)
+
+            #only the split depends on the click, adjoint catchment and upstream hucs are one stored polygon
+            precomputed = self.isGlobal and self.precomputed_upstream()
+
+            #merge adjoint Catchment geom with split catchment and were done
+            if self.isLocalGlobal and not precomputed:
             
-        #need to merge all upstream hucs in addition to localGlobal
-        if self.isGlobal:
+                #need to merge splitCatchment and adjointCatchment
+                mergedCatchmentGeom = self.adjointCatchmentGeom.Union(self.splitCatchmentGeom)
+
+            if precomputed:
+
+                #same as buffering the adjoint and split union before adding the hucs, the buffer distributes over the union
+                logger.debug('UPSTREAM HUC LIST: %s', self.upstream_huc_list)
+                self.metrics.add('upstreamHucs', len(self.upstream_huc_list))
+                mergedCatchmentGeom = self.upstreamRecord['merged'].Union(self.splitCatchmentGeom.Buffer(POLYGON_BUFFER_DISTANCE))
+
+            #need to merge all upstream hucs in addition to localGlobal
+            elif self.isGlobal:
         
-            #kick off upstream global search recursive function starting with mergedCatchment
-            self.search_upstream_geometry(mergedCatchmentGeom, 'adjointCatchment')
+                #kick off upstream global search starting with mergedCatchment
+                self.search_upstream_geometry(mergedCatchmentGeom, 'adjointCatchment')
             
-            #print("Time before merge:",time.perf_counter() - timeBefore)
-            print('UPSTREAM HUC LIST:', self.upstream_huc_list)
+                logger.debug('UPSTREAM HUC LIST: %s', self.upstream_huc_list)
+                self.metrics.add('upstreamHucs', len(self.upstream_huc_list))
             
-            if len(self.upstream_huc_list) > 0:
-                
-                #make sure filter is clear
-                self.hucLayer.SetAttributeFilter(None)
+                if len(self.upstream_huc_list) > 0:
 
-                #set attribute filter 
-                if len(self.upstream_huc_list) == 1:
-                    self.hucLayer.SetAttributeFilter(HUCPOLY_LAYER_ID + " = '" + self.upstream_huc_list[0] + "'")
-                #'in' operator doesnt work with list len of 1
-                else:
-                    self.hucLayer.SetAttributeFilter(HUCPOLY_LAYER_ID + ' IN {}'.format(tuple(self.upstream_huc_list)))
-                
-                #create multipolygon container for all watershed parks
-                mergedWatershed = ogr.Geometry(ogr.wkbMultiPolygon)
-                
-                #loop and merge upstream global HUCs
-                for huc_select_feat in self.hucLayer:
-                    upstreamHUCgeom = huc_select_feat.GetGeometryRef()
-                    
-                    #add polygon parts to container
-                    if upstreamHUCgeom.GetGeometryName() == 'MULTIPOLYGON':
-                        for geom_part in upstreamHUCgeom:
-                            mergedWatershed.AddGeometry(geom_part)
-                    else:
-                        mergedWatershed.AddGeometry(upstreamHUCgeom)
-                        
-                mergedWatershed = mergedWatershed.UnionCascaded()
-                
-                mergedCatchmentGeom =  mergedCatchmentGeom.Buffer(POLYGON_BUFFER_DISTANCE)
-                mergedCatchmentGeom = mergedCatchmentGeom.Union(mergedWatershed)
+                    #dissolved upstream hucs only change when the global gdb does
+                    mergedWatershed = self.dissolve_upstream_hucs(self.upstream_huc_list)
+
+                    mergedCatchmentGeom =  mergedCatchmentGeom.Buffer(POLYGON_BUFFER_DISTANCE)
+                    mergedCatchmentGeom = mergedCatchmentGeom.Union(mergedWatershed)
                 
-            else:
-                print('Something went wrong with global HUC aggregation')
+                else:
+                    logger.error('Something went wrong with global HUC aggregation')
+
+        #always write out split catchment
+        self.splitCatchment =  self.geom_to_geojson(self.splitCatchmentGeom, 'splitCatchment', 10, False)
 
         if self.isLocal:
-            #if its a local this is all we want to return
-            self.mergedCatchment = self.geom_to_geojson(self.splitCatchmentGeom, 'mergedCatchment', 10, self.region_ref, self.webmerc_ref, False)
+            #if its a local this is all we want to return, same feature as the split
+            self.mergedCatchment = self.splitCatchment
         else:
-            self.mergedCatchment =  self.geom_to_geojson(mergedCatchmentGeom, 'mergedCatchment', 10, self.region_ref, self.webmerc_ref, False)
-            self.adjointCatchment =  self.geom_to_geojson(self.adjointCatchmentGeom, 'adjointCatchment', 10, self.region_ref, self.webmerc_ref, False)
-        
-        #always write out split catchment
-        self.splitCatchment =  self.geom_to_geojson(self.splitCatchmentGeom, 'splitCatchment', 10, self.region_ref, self.webmerc_ref, False)
+            self.mergedCatchment =  self.geom_to_geojson(mergedCatchmentGeom, 'mergedCatchment', 10, False)
+            self.adjointCatchment =  self.geom_to_geojson(self.adjointCatchmentGeom, 'adjointCatchment', 10, False)
 
         self.cleanup()
 
@@ -484,21 +397,16 @@ class Watershed:
         
     def cleanup(self):
 
-        # clean close
-        del self.global_gdb
-        del self.driver
-        del self.globalStreamsLayer
+        #region and huc handles belong to the catalog, only drop what this request made
+        del self.splitCatchmentGeom
         del self.hucLayer
+        del self.globalStreamsLayer
         del self.hucNetJunctionsLayer
-        del self.region_ref
-        del self.webmerc_ref
-        del self.splitCatchmentGeom
-        del self.globalStreamsHydroIdIndex
-        del self.hucNameFieldIndex
-        del self.hucNetJunctionsIdIndex
 
 if __name__=='__main__':
 
+    logging.basicConfig(level=logging.INFO)
+
     timeBefore = time.perf_counter()  
 
     #test site
@@ -513,4 +421,5 @@ if __name__=='__main__':
 
     timeAfter = time.perf_counter() 
     totalTime = timeAfter - timeBefore
-    print("Total Time:",totalTime)
\ No newline at end of file
+    print("Total Time:",totalTime)
+    print("Metrics:",json.dumps(delineation.metrics.as_dict()))
\ No newline at end of file
@@ -0,0 +1,142 @@
+## StreamStats HUC junction graph
+
+# -----------------------------------------------------
+# Junction -> HUC adjacency built once per region so the
+# upstream HUC search is a graph walk instead of
+# repeated attribute and spatial filters on the gdb
+# -----------------------------------------------------
+
+# list of required python packages:
+# gdal, numpy
+
+from osgeo import ogr
+import numpy as np
+import threading
+
+def normalize_id(value):
+
+    #junction ids are stored as int in some gdbs and double in others
+    try:
+        return str(int(float(value)))
+    except ValueError:
+        return value.strip()
+
+class HucGraph:
+
+    def __init__(self, junctionIDs, junctionXY, hucsByJunction, directUpstream):
+
+        self.junctionIDs = junctionIDs
+        self.junctionXY = junctionXY
+        self.hucsByJunction = hucsByJunction
+        self.directUpstream = directUpstream
+
+        #closures are computed on demand and kept for the life of the graph
+        self.upstreamClosure = {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_layers(cls, hucLayer, hucNameFieldIndex, hucJunctionFieldIndex, junctionLayer, junctionIdIndex):
+
+        #read every junction point once
+        junctionLayer.SetSpatialFilter(None)
+        junctionLayer.SetAttributeFilter(None)
+        junctionIDs = []
+        junctionXY = []
+        for junction_feat in junctionLayer:
+            geom = junction_feat.GetGeometryRef()
+            if geom is None:
+                continue
+            junctionIDs.append(normalize_id(junction_feat.GetFieldAsString(junctionIdIndex)))
+            junctionXY.append(geom.GetPoint_2D(0))
+        junctionXY = np.array(junctionXY, dtype='float64').reshape(-1, 2)
+
+        graph = cls(junctionIDs, junctionXY, {}, {})
+
+        #each huc drains through its own junction, and takes in every junction inside it
+        hucLayer.SetSpatialFilter(None)
+        hucLayer.SetAttributeFilter(None)
+        hucJunctions = {}
+        for huc_feat in hucLayer:
+            hucName = huc_feat.GetFieldAsString(hucNameFieldIndex)
+            junctionID = normalize_id(huc_feat.GetFieldAsString(hucJunctionFieldIndex))
+            graph.hucsByJunction.setdefault(junctionID, []).append(hucName)
+            hucJunctions[hucName] = graph.junctions_in(huc_feat.GetGeometryRef())
+
+        for hucName, junctions in hucJunctions.items():
+            graph.directUpstream[hucName] = graph.hucs_at(junctions)
+
+        return graph
+
+    def junctions_in(self, geom):
+
+        if geom is None or len(self.junctionXY) == 0:
+            return []
+
+        #envelope test on all junctions at once, exact test on the few left
+        minX, maxX, minY, maxY = geom.GetEnvelope()
+        xs = self.junctionXY[:, 0]
+        ys = self.junctionXY[:, 1]
+        candidates = np.nonzero((xs >= minX) & (xs <= maxX) & (ys >= minY) & (ys <= maxY))[0]
+
+        junctions = []
+        point = ogr.Geometry(ogr.wkbPoint)
+        for i in candidates:
+            point.SetPoint_2D(0, xs[i], ys[i])
+            if geom.Intersects(point):
+                junctions.append(self.junctionIDs[i])
+        return junctions
+
+    def hucs_at(self, junctions):
+
+        hucs = []
+        for junctionID in junctions:
+            for hucName in self.hucsByJunction.get(junctionID, []):
+                if hucName not in hucs:
+                    hucs.append(hucName)
+        return hucs
+
+    def upstream_of(self, hucName):
+
+        with self.lock:
+            closure = self.upstreamClosure.get(hucName)
+        if closure is not None:
+            return closure
+
+        #iterative walk, reusing any closure already known along the way
+        visited = [hucName]
+        seen = set(visited)
+        stack = list(self.directUpstream.get(hucName, []))
+        while stack:
+            upstreamHUC = stack.pop()
+            if upstreamHUC in seen:
+                continue
+
+            with self.lock:
+                known = self.upstreamClosure.get(upstreamHUC)
+            if known is not None:
+                for knownHUC in known:
+                    if knownHUC not in seen:
+                        seen.add(knownHUC)
+                        visited.append(knownHUC)
+                continue
+
+            seen.add(upstreamHUC)
+            visited.append(upstreamHUC)
+            stack.extend(self.directUpstream.get(upstreamHUC, []))
+
+        closure = tuple(visited)
+        with self.lock:
+            self.upstreamClosure[hucName] = closure
+        return closure
+
+    def upstream_hucs(self, junctions):
+
+        #every huc draining through one of the junctions, plus everything above it
+        upstream = []
+        seen = set()
+        for hucName in self.hucs_at(junctions):
+            for upstreamHUC in self.upstream_of(hucName):
+                if upstreamHUC not in seen:
+                    seen.add(upstreamHUC)
+                    upstream.append(upstreamHUC)
+        return upstream
@@ -0,0 +1,272 @@
+## StreamStats delineation job queue
+
+# -----------------------------------------------------
+# Local pool of pre-warmed worker processes behind the
+# flask submit/poll endpoints, with separate queues for
+# fast local jobs and slow global jobs
+# -----------------------------------------------------
+
+from osgeo import ogr
+from catalog import RegionCatalog, get_catalog
+from metrics import REGISTRY
+from output import RawJSON
+import multiprocessing
+import threading
+import queue
+import time
+import logging
+import uuid
+import os
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+#arguments
+FAST_WORKERS = 2
+SLOW_WORKERS = 1
+MAX_JOBS_PER_WORKER = 200
+MAX_WORKER_MEMORY_MB = 2048
+FINISHED_JOB_TTL = 3600 # seconds a finished job can still be polled
+GLOBAL_STREAM_DISTANCE = 5 # same buffer delineate uses to find global streams
+FINISHED_STATES = ('done', 'error')
+WORKER_START_METHOD = 'spawn' # workers start clean, never forked from a threaded parent holding GDAL handles
+
+logger = logging.getLogger(__name__)
+
+def memory_mb():
+
+    #current resident size where /proc exists, peak size otherwise
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024.0 / 1024.0
+    except (OSError, ValueError, AttributeError):
+        pass
+    if resource is not None:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    return 0.0
+
+def worker_loop(taskQueue, resultQueue, dataPath, regions, maxJobs, maxMemory, cacheClass=None):
+
+    if cacheClass is None:
+        from results import ResultCache as cacheClass
+
+    #open the configured regions before taking any work
+    catalog = RegionCatalog(dataPath)
+    resultCache = cacheClass(catalog)
+    for region in regions:
+        try:
+            catalog.region(region).build_indexes()
+        except Exception as e:
+            logger.error('could not preload region %s: %s', region, e)
+
+    jobs = 0
+    while True:
+        task = taskQueue.get()
+        if task is None:
+            break
+
+        jobId, lat, lng, region = task
+        resultQueue.put((jobId, 'running', os.getpid()))
+        try:
+            body, metrics = resultCache.lookup(lat, lng, region)
+            resultQueue.put((jobId, 'done', (body.decode('utf-8'), metrics)))
+        except Exception as e:
+            resultQueue.put((jobId, 'error', str(e)))
+
+        #recycle after enough jobs or once memory has grown too far, the pool starts a fresh one
+        jobs += 1
+        if jobs >= maxJobs or (maxMemory and memory_mb() > maxMemory):
+            break
+
+class WorkerPool:
+
+    def __init__(self, name, size, context, resultQueue, dataPath, regions, maxJobs, maxMemory, cacheClass=None):
+
+        self.name = name
+        self.size = size
+        self.context = context
+        self.taskQueue = context.Queue()
+        self.resultQueue = resultQueue
+        self.args = (self.taskQueue, resultQueue, dataPath, tuple(regions), maxJobs, maxMemory, cacheClass)
+        self.processes = []
+
+    def spawn(self):
+
+        process = self.context.Process(target=worker_loop, args=self.args, name='delineate-' + self.name, daemon=True)
+        process.start()
+        return process
+
+    def start(self):
+        self.processes = [self.spawn() for i in range(self.size)]
+
+    def replace_dead(self):
+
+        #returns pids of workers that went away so their running job can be failed
+        dead = []
+        for i, process in enumerate(self.processes):
+            if not process.is_alive():
+                dead.append(process.pid)
+                process.join(0)
+                self.processes[i] = self.spawn()
+        return dead
+
+    def stop(self):
+
+        for process in self.processes:
+            self.taskQueue.put(None)
+        for process in self.processes:
+            process.join(5)
+
+class JobQueue:
+
+    def __init__(self, dataPath, regions=(), fast_workers=FAST_WORKERS, slow_workers=SLOW_WORKERS, max_jobs=MAX_JOBS_PER_WORKER, max_memory_mb=MAX_WORKER_MEMORY_MB, cache_class=None):
+
+        self.dataPath = dataPath
+        self.regions = regions
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.started = False
+        self.stopped = False
+
+        #pools start lazily from a request thread, after the catalog has opened datasets
+        context = multiprocessing.get_context(WORKER_START_METHOD)
+        self.resultQueue = context.Queue()
+
+        #cache_class must be importable by the spawned workers, defaults to results.ResultCache
+        self.pools = {
+            'fast': WorkerPool('fast', fast_workers, context, self.resultQueue, dataPath, regions, max_jobs, max_memory_mb, cache_class),
+            'slow': WorkerPool('slow', slow_workers, context, self.resultQueue, dataPath, regions, max_jobs, max_memory_mb, cache_class)
+        }
+
+    def start(self):
+
+        with self.lock:
+            if self.started:
+                return
+            self.started = True
+
+        for pool in self.pools.values():
+            pool.start()
+
+        threading.Thread(target=self.collect, name='delineate-results', daemon=True).start()
+
+    def stop(self):
+
+        #collect stops replacing workers before they are asked to exit
+        self.stopped = True
+        for pool in self.pools.values():
+            pool.stop()
+
+    def classify(self, lat, lng, region):
+
+        #points on a global stream pull in upstream hucs, everything else is quick
+        try:
+            regionHandle = get_catalog(self.dataPath).region(region)
+            x, y = regionHandle.project(lng, lat)
+            point = ogr.Geometry(ogr.wkbPoint)
+            point.SetPoint_2D(0, x, y)
+            if regionHandle.global_stream_near(point, GLOBAL_STREAM_DISTANCE) is not None:
+                return 'slow'
+        except Exception as e:
+            logger.error('could not classify point, using fast queue: %s', e)
+        return 'fast'
+
+    def submit(self, lat, lng, region):
+
+        self.start()
+
+        jobId = uuid.uuid4().hex
+        queueName = self.classify(lat, lng, region)
+
+        with self.lock:
+            self.jobs[jobId] = {'id': jobId, 'status': 'queued', 'queue': queueName, 'submitted': time.time()}
+
+        self.pools[queueName].taskQueue.put((jobId, lat, lng, region))
+        return self.status(jobId)
+
+    def status(self, jobId):
+
+        with self.lock:
+            job = self.jobs.get(jobId)
+            return dict(job) if job is not None else None
+
+    def drain(self, timeout):
+
+        #waits up to timeout for the first message, then takes whatever else is already queued
+        try:
+            message = self.resultQueue.get(timeout=timeout) if timeout else self.resultQueue.get_nowait()
+            while True:
+                self.update(*message)
+                message = self.resultQueue.get_nowait()
+        except queue.Empty:
+            pass
+
+    def collect(self):
+
+        while True:
+            self.drain(1)
+            if self.stopped:
+                break
+
+            #restart recycled or crashed workers, failing whatever a crashed one was running
+            dead = [pid for pool in self.pools.values() for pid in pool.replace_dead()]
+            if dead:
+
+                #a worker that recycled right after its last result is only reaped here, read that result first
+                self.drain(0)
+                for pid in dead:
+                    self.fail_running(pid)
+
+            self.prune()
+
+    def update(self, jobId, status, payload):
+
+        metrics = None
+        with self.lock:
+            job = self.jobs.get(jobId)
+            if job is None or job['status'] in FINISHED_STATES:
+                return
+
+            job['status'] = status
+            if status == 'running':
+                job['pid'] = payload
+                job['started'] = time.time()
+            else:
+                job['finished'] = time.time()
+                job.pop('pid', None)
+                if status == 'done':
+
+                    #workers send their metrics back so /metrics covers every process
+                    body, metrics = payload
+                    job['metrics'] = metrics
+                    job['result'] = RawJSON(body)
+                    job.pop('error', None)
+                else:
+                    job['error'] = payload
+
+        #registry has its own lock, keep it out of the jobs lock
+        if metrics:
+            if metrics.get('cached'):
+                REGISTRY.cache_hit()
+            else:
+                REGISTRY.observe(metrics)
+
+    def fail_running(self, pid):
+
+        #only jobs still running, a finished job keeps its result
+        with self.lock:
+            for job in self.jobs.values():
+                if job['status'] == 'running' and job.get('pid') == pid:
+                    job['status'] = 'error'
+                    job['error'] = 'worker exited while running this job'
+                    job['finished'] = time.time()
+                    job.pop('pid', None)
+
+    def prune(self):
+
+        cutoff = time.time() - FINISHED_JOB_TTL
+        with self.lock:
+            for jobId in [jobId for jobId, job in self.jobs.items() if job.get('finished', time.time()) < cutoff]:
+                del self.jobs[jobId]
@@ -0,0 +1,140 @@
+## StreamStats delineation metrics
+
+# -----------------------------------------------------
+# Per request stage timers and counters, and process
+# wide histograms of them for the /metrics endpoint
+# -----------------------------------------------------
+
+from contextlib import contextmanager
+import threading
+import time
+
+#arguments
+TIME_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60) # seconds
+COUNT_BUCKETS = (1, 10, 100, 1000, 10000, 100000, 1000000, 10000000, 100000000, 1000000000)
+
+def count_vertices(geom):
+
+    #points in every ring and part of an ogr geometry
+    if geom is None:
+        return 0
+    parts = geom.GetGeometryCount()
+    if parts:
+        return sum(count_vertices(geom.GetGeometryRef(i)) for i in range(parts))
+    return geom.GetPointCount()
+
+class Metrics:
+
+    def __init__(self):
+        self.timings = {}
+        self.counts = {}
+        self.classification = None
+
+    @contextmanager
+    def stage(self, name):
+
+        #stages nest, so each timing includes the stages it calls
+        timeBefore = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0.0) + time.perf_counter() - timeBefore
+
+    def add(self, name, value=1):
+        self.counts[name] = self.counts.get(name, 0) + value
+
+    def as_dict(self):
+        return {
+            'classification': self.classification,
+            'timings': dict(self.timings),
+            'counts': dict(self.counts)
+        }
+
+class Histogram:
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.bucketCounts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                break
+        else:
+            i = len(self.buckets)
+        self.bucketCounts[i] += 1
+
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def as_dict(self):
+
+        #cumulative counts per upper bound, prometheus style
+        buckets = {}
+        total = 0
+        for bound, bucketCount in zip(list(self.buckets) + ['+Inf'], self.bucketCounts):
+            total += bucketCount
+            buckets[str(bound)] = total
+
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'min': self.min,
+            'max': self.max,
+            'buckets': buckets
+        }
+
+class MetricsRegistry:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = {}
+        self.cacheHits = 0
+        self.stages = {}
+        self.counts = {}
+
+    def observe(self, metrics):
+
+        #takes a Metrics or its as_dict(), worker processes send the dict back
+        if isinstance(metrics, Metrics):
+            metrics = metrics.as_dict()
+        label = metrics.get('classification') or 'unknown'
+
+        with self.lock:
+            self.requests[label] = self.requests.get(label, 0) + 1
+            for name, seconds in metrics.get('timings', {}).items():
+                self.histogram(self.stages, name, label, TIME_BUCKETS).observe(seconds)
+            for name, value in metrics.get('counts', {}).items():
+                self.histogram(self.counts, name, label, COUNT_BUCKETS).observe(value)
+
+    def histogram(self, group, name, label, buckets):
+
+        byLabel = group.setdefault(name, {})
+        histogram = byLabel.get(label)
+        if histogram is None:
+            histogram = byLabel[label] = Histogram(buckets)
+        return histogram
+
+    def cache_hit(self):
+        with self.lock:
+            self.cacheHits += 1
+
+    def snapshot(self):
+
+        with self.lock:
+            return {
+                'requests': dict(self.requests),
+                'cacheHits': self.cacheHits,
+                'stages': {name: {label: h.as_dict() for label, h in byLabel.items()} for name, byLabel in self.stages.items()},
+                'counts': {name: {label: h.as_dict() for label, h in byLabel.items()} for name, byLabel in self.counts.items()}
+            }
+
+#one registry per process
+REGISTRY = MetricsRegistry()
@@ -0,0 +1,182 @@
+## StreamStats NLDI response cache
+
+# -----------------------------------------------------
+# Catchment and basin responses kept by COMID and query
+# kind in a bounded memory + disk cache, with geometry
+# stored as WKB so repeat and nearby requests skip both
+# the network and the GeoJSON parse
+# -----------------------------------------------------
+
+# list of required python packages:
+# gdal, requests
+
+from osgeo import ogr
+from collections import OrderedDict
+from cache import tiered_cache, cache_key
+from nldi_client import default_client
+import threading
+import logging
+import struct
+import json
+import time
+import os
+
+#arguments
+NLDI_CACHE_TTL = int(os.environ.get('SS_DELINEATE_NLDI_TTL', 7 * 24 * 3600)) # seconds before an entry is revalidated
+NLDI_MEMORY_CACHE_BYTES = 128 * 1024 * 1024
+NLDI_DISK_CACHE_BYTES = 2 * 1024 * 1024 * 1024
+RECENT_CATCHMENTS = 1024 # catchment polygons kept for point in polygon hits
+POINT_PRECISION = 6 # decimal places of lng/lat in point lookup keys
+
+logger = logging.getLogger(__name__)
+
+def pack_entry(header, wkb):
+
+    #length prefixed json header then the raw WKB
+    headerBytes = json.dumps(header).encode('utf-8')
+    return struct.pack('<I', len(headerBytes)) + headerBytes + bytes(wkb)
+
+def unpack_entry(data):
+
+    size = struct.unpack_from('<I', data)[0]
+    return json.loads(data[4:4 + size].decode('utf-8')), data[4 + size:]
+
+def geometry_wkb(geometry):
+    return bytes(ogr.CreateGeometryFromJson(json.dumps(geometry)).ExportToWkb())
+
+class CachedNLDI:
+
+    def __init__(self, client=None, cache=None, ttl=NLDI_CACHE_TTL, clock=time.time):
+
+        self.client = client if client is not None else default_client()
+        self.cache = cache if cache is not None else tiered_cache('nldi', NLDI_MEMORY_CACHE_BYTES, NLDI_DISK_CACHE_BYTES)
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+
+        #comid -> (envelope, geometry) of recent catchments, nearby clicks land in one of these
+        self.recent = OrderedDict()
+        self.lock = threading.Lock()
+
+    def fresh(self, header):
+        return self.clock() - header['fetchedAt'] < self.ttl
+
+    def entry(self, key):
+
+        data = self.cache.get(key)
+        if data is None:
+            return None, None
+        return unpack_entry(data)
+
+    def store(self, key, properties, wkb, etag):
+
+        header = {'fetchedAt': self.clock(), 'etag': etag, 'properties': properties}
+        self.cache.put(key, pack_entry(header, wkb))
+        return header
+
+    def fetch_feature(self, key, url, params, what, header=None, wkb=None):
+
+        #conditional on the stored ETag, a 304 only refreshes the entry's age
+        resp, etag = self.client.fetch(url, params, header.get('etag') if header else None)
+        if resp is None:
+            logger.debug('NLDI %s not modified', what)
+            return self.store(key, header['properties'], wkb, etag)['properties'], wkb
+
+        feature = self.client.first_feature(resp, what)
+        wkb = geometry_wkb(feature['geometry'])
+        return self.store(key, feature.get('properties') or {}, wkb, etag)['properties'], wkb
+
+    def remember(self, comid, wkb):
+
+        geom = ogr.CreateGeometryFromWkb(wkb)
+        with self.lock:
+            self.recent[comid] = (geom.GetEnvelope(), geom)
+            self.recent.move_to_end(comid)
+            while len(self.recent) > RECENT_CATCHMENTS:
+                self.recent.popitem(last=False)
+
+    def recent_containing(self, x, y):
+
+        point = ogr.Geometry(ogr.wkbPoint)
+        point.AddPoint_2D(x, y)
+        with self.lock:
+            for comid, (envelope, geom) in reversed(self.recent.items()):
+                minX, maxX, minY, maxY = envelope
+                if minX <= x <= maxX and minY <= y <= maxY and geom.Contains(point):
+                    self.recent.move_to_end(comid)
+                    return comid
+        return None
+
+    def catchment_at(self, x, y):
+
+        #properties and a fresh wgs84 geometry of the NHDPlus catchment holding the point
+        pointKey = cache_key('nldi', 'point', round(x, POINT_PRECISION), round(y, POINT_PRECISION))
+        cachedComid = self.cache.get(pointKey)
+        cachedComid = cachedComid.decode('utf-8') if cachedComid is not None else None
+        comid = self.recent_containing(x, y) or cachedComid
+
+        header = wkb = None
+        if comid is not None:
+            header, wkb = self.entry(cache_key('nldi', 'catchment', comid))
+            if header is not None and self.fresh(header):
+                self.hits += 1
+                self.remember_point(pointKey, comid, cachedComid)
+                self.remember(comid, wkb)
+                return header['properties'], ogr.CreateGeometryFromWkb(wkb)
+
+        #catchments come from a point query, so the comid is only known once it answers
+        self.misses += 1
+        resp, etag = self.client.fetch(self.client.geoserver_url, self.client.catchment_payload(x, y), header.get('etag') if header else None)
+        if resp is None:
+            properties = self.store(cache_key('nldi', 'catchment', comid), header['properties'], wkb, etag)['properties']
+        else:
+            feature = self.client.first_feature(resp, 'catchment at %s, %s' % (x, y))
+            properties = feature.get('properties') or {}
+            comid = json.dumps(properties['featureid'])
+            wkb = geometry_wkb(feature['geometry'])
+            self.store(cache_key('nldi', 'catchment', comid), properties, wkb, etag)
+
+        self.remember_point(pointKey, comid, cachedComid)
+        self.remember(comid, wkb)
+        return properties, ogr.CreateGeometryFromWkb(wkb)
+
+    def remember_point(self, pointKey, comid, cachedComid):
+
+        #every put can hit the disk tier and its eviction scan, so only write a new or changed comid
+        if comid != cachedComid:
+            self.cache.put(pointKey, comid.encode('utf-8'))
+
+    def basin(self, comid):
+
+        #fresh wgs84 geometry of the full resolution upstream basin
+        key = cache_key('nldi', 'basin', comid)
+        header, wkb = self.entry(key)
+        if header is not None and self.fresh(header):
+            self.hits += 1
+            return ogr.CreateGeometryFromWkb(wkb)
+
+        self.misses += 1
+        url, payload = self.client.basin_request(comid)
+        properties, wkb = self.fetch_feature(key, url, payload, 'basin for comid %s' % comid, header, wkb)
+        return ogr.CreateGeometryFromWkb(wkb)
+
+    def basin_async(self, comid):
+
+        #started as soon as the comid is known so it overlaps the raster split
+        return self.client.executor.submit(self.basin, comid)
+
+    def position(self, x, y):
+        return self.client.position(x, y)
+
+NLDI = None
+NLDI_LOCK = threading.Lock()
+
+def default_nldi():
+
+    #one cache per process, the disk tier is shared with other processes
+    global NLDI
+    with NLDI_LOCK:
+        if NLDI is None:
+            NLDI = CachedNLDI()
+        return NLDI
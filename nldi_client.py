@@ -0,0 +1,135 @@
+## StreamStats NLDI http client
+
+# -----------------------------------------------------
+# One pooled, keep-alive session for the NLDI and its
+# geoserver, with timeouts, bounded retries and a small
+# thread pool so the basin fetch can overlap the split
+# -----------------------------------------------------
+
+# list of required python packages:
+# requests
+
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import requests
+import threading
+import logging
+import os
+
+#arguments
+NLDI_URL = os.environ.get('SS_DELINEATE_NLDI_URL', 'https://labs.waterdata.usgs.gov/api/nldi/linked-data/comid/')
+NLDI_GEOSERVER_URL = os.environ.get('SS_DELINEATE_NLDI_GEOSERVER_URL', 'https://labs.waterdata.usgs.gov/geoserver/wmadata/ows')
+CONNECT_TIMEOUT = 5 # seconds to open a connection
+READ_TIMEOUT = 60 # seconds between bytes, big river basins are several MB
+MAX_RETRIES = 3
+RETRY_BACKOFF = 0.5 # seconds, doubled on each retry
+RETRY_STATUS = (429, 500, 502, 503, 504)
+POOL_SIZE = 16
+FETCH_WORKERS = 4
+
+logger = logging.getLogger(__name__)
+
+class NLDIError(Exception):
+    pass
+
+def make_session(pool_size=POOL_SIZE, retries=MAX_RETRIES, backoff=RETRY_BACKOFF):
+
+    #only idempotent GETs are sent so every failure is safe to retry
+    retry = Retry(total=retries, connect=retries, read=retries, status=retries, backoff_factor=backoff, status_forcelist=RETRY_STATUS, allowed_methods=frozenset(['GET']), raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+class NLDIClient:
+
+    def __init__(self, nldi_url=NLDI_URL, geoserver_url=NLDI_GEOSERVER_URL, session=None, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), workers=FETCH_WORKERS):
+
+        self.nldi_url = nldi_url
+        self.geoserver_url = geoserver_url
+        self.session = session if session is not None else make_session()
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='nldi')
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        self.session.close()
+
+    def fetch(self, url, params, etag=None):
+
+        #json body and ETag, or (None, etag) when a conditional request comes back 304 Not Modified
+        headers = {'If-None-Match': etag} if etag else None
+        try:
+            r = self.session.get(url, params=params, timeout=self.timeout, headers=headers)
+        except requests.RequestException as e:
+            raise NLDIError('NLDI request failed: %s' % e)
+        if r.status_code == 304 and etag:
+            return None, etag
+        if r.status_code != 200:
+            raise NLDIError('NLDI request failed with HTTP %s: %s' % (r.status_code, r.url))
+        try:
+            return r.json(), r.headers.get('ETag')
+        except ValueError:
+            raise NLDIError('NLDI returned a non json response: %s' % r.url)
+
+    def get_json(self, url, params):
+        return self.fetch(url, params)[0]
+
+    def first_feature(self, resp, what):
+
+        features = resp.get('features') or []
+        if not features:
+            raise NLDIError('No %s found' % what)
+        return features[0]
+
+    def catchment_payload(self, x, y):
+
+        #point in polygon query against the NHDPlus catchments on the NLDI geoserver
+        return {
+            'service': 'wfs',
+            'version': '1.0.0',
+            'request': 'GetFeature',
+            'typeName': 'wmadata:catchmentsp',
+            'outputFormat': 'application/json',
+            'srsName': 'EPSG:4326',
+            'CQL_FILTER': 'INTERSECTS(the_geom, POINT(%f %f))' % (x, y)
+        }
+
+    def catchment_at(self, x, y):
+        return self.first_feature(self.get_json(self.geoserver_url, self.catchment_payload(x, y)), 'catchment at %s, %s' % (x, y))
+
+    def position(self, x, y):
+
+        #comid of the catchment the point is in
+        payload = {'f': 'json', 'coords': 'POINT(%f %f)' % (x, y)}
+        return self.first_feature(self.get_json(self.nldi_url + 'position', payload), 'comid at %s, %s' % (x, y))
+
+    def basin_request(self, comid):
+
+        #full resolution upstream basin of a comid
+        return self.nldi_url + str(comid) + '/basin', {'f': 'json', 'simplified': 'false'}
+
+    def basin(self, comid):
+        url, payload = self.basin_request(comid)
+        return self.first_feature(self.get_json(url, payload), 'basin for comid %s' % comid)
+
+    def basin_async(self, comid):
+
+        #started as soon as the comid is known so it overlaps the raster split
+        logger.debug('Fetching basin for comid %s', comid)
+        return self.executor.submit(self.basin, comid)
+
+CLIENT = None
+CLIENT_LOCK = threading.Lock()
+
+def default_client():
+
+    #one shared client per process so connections are reused across requests
+    global CLIENT
+    with CLIENT_LOCK:
+        if CLIENT is None:
+            CLIENT = NLDIClient()
+        return CLIENT
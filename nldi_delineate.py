@@ -7,34 +7,77 @@
 # -----------------------------------------------------
 
 # list of required python packages:
-# gdal, pysheds, requests
+# gdal, requests, numpy
 
 ###### CONDA CREATE ENVIRONMENT COMMAND
 #conda create -n delineate python=3.6.8 gdal pysheds requests
 ###### CONDA CREATE ENVIRONMENT COMMAND
 
 from osgeo import ogr, osr, gdal
-from pysheds.grid import Grid
-import requests
+from catchment import trace_catchment, snap_to_stream, cell_index, window_transform, NLDI_SNAP_THRESHOLD
+from polygonize import mask_to_geometry
+from raster import load_tile_store
+from nldi_cache import CachedNLDI, default_nldi
+from nldi_client import NLDIClient
+import threading
+import logging
 import time
 import json
+import os
 
 #arguments
-NLDI_URL = 'https://labs.waterdata.usgs.gov/api/nldi/linked-data/comid/'
-NLDI_GEOSERVER_URL = 'https://labs.waterdata.usgs.gov/geoserver/wmadata/ows'
 OUT_PATH = 'C:/NYBackup/GitHub/ss-delineate/data/'
 IN_FDR = 'C:/NYBackup/GitHub/ss-delineate/data/nhd_fdr.tif'
 OUT_FDR = 'C:/NYBackup/GitHub/ss-delineate/data/catch_fdr.tif'
+NLDI_BACKEND = os.environ.get('SS_DELINEATE_NLDI_BACKEND', 'remote') # 'local' answers from nldi_local.py, no network
+FDR_STORE = os.environ.get('SS_DELINEATE_NLDI_FDR', 'C:/NYBackup/GitHub/ss-delineate/data/nldi_fdr/') # built by preprocess.py --nldi-fdr
+DEBUG_OUTPUT = os.environ.get('SS_DELINEATE_DEBUG_OUTPUT') == '1' # write the fdr window and shapefiles to OUT_PATH
+
+logger = logging.getLogger(__name__)
+
+FDR_STORE_HANDLE = None
+FDR_STORE_LOCK = threading.Lock()
+LOCAL_BACKEND = None
+
+def default_backend():
+
+    #the local backend is opened once per process, the remote one is the shared response cache
+    global LOCAL_BACKEND
+    if NLDI_BACKEND != 'local':
+        return default_nldi()
+    with FDR_STORE_LOCK:
+        if LOCAL_BACKEND is None:
+            from nldi_local import LocalNLDI
+            LOCAL_BACKEND = LocalNLDI()
+        return LOCAL_BACKEND
+
+def fdr_store():
+
+    #opened once per process, False when there is no prepared store and IN_FDR is warped per request
+    global FDR_STORE_HANDLE
+    with FDR_STORE_LOCK:
+        if FDR_STORE_HANDLE is None:
+            FDR_STORE_HANDLE = load_tile_store(FDR_STORE) or False
+            if not FDR_STORE_HANDLE:
+                logger.warning('No prepared fdr store at %s, warping %s for every request', FDR_STORE, IN_FDR)
+        return FDR_STORE_HANDLE
 
 class Watershed:
 
     ogr.UseExceptions()
     gdal.UseExceptions() 
 
-    def __init__(self, x=None, y=None):
+    def __init__(self, x=None, y=None, backend=None, debug=DEBUG_OUTPUT):
+
+        #backend is a CachedNLDI or LocalNLDI, a bare NLDIClient answers with feature dicts
+        #so it gets the shared response cache in front of it
+        if isinstance(backend, NLDIClient):
+            backend = CachedNLDI(backend, default_nldi().cache)
 
         self.x = x
         self.y = y
+        self.debug = debug
+        self.backend = backend if backend is not None else default_backend()
         self.catchment_identifier = None
         self.catchmentGeom = None
         self.splitCatchmentGeom = None
@@ -45,10 +88,15 @@ class Watershed:
         self.sourceprj = osr.SpatialReference()
         self.sourceprj.ImportFromProj4('+proj=longlat +ellps=WGS84 +datum=WGS84 +no_defs')
 
-        # Getting spatial reference of input raster
-        tif = gdal.Open(IN_FDR, gdal.GA_ReadOnly)
-        self.Projection = tif.GetProjectionRef()
-        self.targetprj = osr.SpatialReference(wkt = tif.GetProjection())
+        # Getting spatial reference of input raster, the prepared store is already in the working crs
+        self.fdrStore = fdr_store()
+        if self.fdrStore:
+            self.Projection = self.fdrStore.projection
+        else:
+            tif = gdal.Open(IN_FDR, gdal.GA_ReadOnly)
+            self.Projection = tif.GetProjectionRef()
+            tif = None
+        self.targetprj = osr.SpatialReference(wkt = self.Projection)
 
         #create transform
         self.transformToRaster = osr.CoordinateTransformation(self.sourceprj, self.targetprj)
@@ -77,7 +125,7 @@ class Watershed:
         #get area in local units
         area = in_geom.GetArea()
 
-        print('processing: ' + name + ' area: ' + str(area*0.00000038610))
+        logger.debug('processing: %s area: %s', name, area*0.00000038610)
 
         geojson_dict = {
             "type": "Feature",
@@ -91,13 +139,17 @@ class Watershed:
             f = open('C:/NYBackup/GitHub/ss-delineate/data/' + name + '.geojson','w')
             f.write(json.dumps(geojson_dict))
             f.close()
-            print('Exported geojson:', name)
+            logger.debug('Exported geojson: %s', name)
         
         return geojson_dict
 
     
     def geom_to_shapefile(self, geom, name):
 
+        #intermediate geometries stay in memory unless debugging
+        if not self.debug:
+            return
+
         #write out shapefile
         # set up the shapefile driver
         driver = ogr.GetDriverByName("ESRI Shapefile")
@@ -118,40 +170,24 @@ class Watershed:
 ## main functions
     def transform_click_point(self):
 
-        print('Input X,Y:', self.x, self.y)
+        logger.debug('Input X,Y: %s %s', self.x, self.y)
         self.projectedLng, self.projectedLat, z = self.transformToRaster.TransformPoint(self.x,self.y)      
-        print('Projected X,Y:',self.projectedLng, ',', self.projectedLat)
+        logger.debug('Projected X,Y: %s, %s', self.projectedLng, self.projectedLat)
 
         self.get_local_catchment_geom()
 
     def get_local_catchment_geom(self):
 
-        wkt_point = "POINT(%f %f)" %  (self.x , self.y)
-        cql_filter = "INTERSECTS(the_geom, %s)" % (wkt_point)
-
-        payload = {
-            'service': 'wfs', 
-            'version': '1.0.0', 
-            'request': 'GetFeature', 
-            'typeName': 'wmadata:catchmentsp', 
-            'outputFormat': 'application/json',
-            'srsName': 'EPSG:4326',
-            'CQL_FILTER': cql_filter
-        }
-
         #request catchment geometry from point in polygon query from NLDI geoserver
         # https://labs.waterdata.usgs.gov/geoserver/wmadata/ows?service=wfs&version=1.0.0&request=GetFeature&typeName=wmadata%3Acatchmentsp&outputFormat=application%2Fjson&srsName=EPSG%3A4326&CQL_FILTER=INTERSECTS%28the_geom%2C+POINT%28-73.745860+44.006830%29%29
-        r = requests.get(NLDI_GEOSERVER_URL, params=payload)
-        resp = r.json()
-
-        #print(r.text)
+        #repeat and nearby points are answered from the local response cache
+        properties, self.catchmentGeom = self.backend.catchment_at(self.x, self.y)
 
         #get catchment id
-        self.catchment_identifier = json.dumps(resp['features'][0]['properties']['featureid'])
+        self.catchment_identifier = json.dumps(properties['featureid'])
 
-        #get main catchment geometry polygon
-        gj_geom = json.dumps(resp['features'][0]['geometry'])
-        self.catchmentGeom = ogr.CreateGeometryFromJson(gj_geom)
+        #the basin only needs the comid, so fetch it while the split runs
+        basinFuture = self.backend.basin_async(self.catchment_identifier)
 
         #transform catchment geometry
         self.catchmentGeom.Transform(self.transformToRaster)
@@ -162,46 +198,37 @@ class Watershed:
         minX, maxX, minY, maxY = self.catchmentGeom.GetEnvelope() # Get bounding box of the shapefile feature
         bounds = [minX, minY, maxX, maxY]
 
-        print('projected bounds', bounds)
+        logger.debug('projected bounds %s', bounds)
 
-        self.splitCatchmentGeom = self.split_catchment(bounds, self.projectedLng,self.projectedLat)
+        try:
+            self.splitCatchmentGeom = self.split_catchment(bounds, self.projectedLng,self.projectedLat)
+        except Exception:
+            basinFuture.cancel()
+            raise
 
         #get upstream basin
-        self.upstreamBasinGeom = self.get_upstream_basin()
+        self.get_upstream_basin(basinFuture)
 
 
     def get_local_catchment_id(self):
 
         #request local catchment identifier from NLDI
         # https://labs.waterdata.usgs.gov/api/nldi/linked-data/comid/position?f=json&coords=POINT(-89.35%2043.0864)
-        wkt_point = wkt = "POINT(%f %f)" %  (self.x , self.y)
-        payload = {'f': 'json', 'coords':  wkt_point}
-        
         #get comid of catchment point is in
-        r = requests.get(NLDI_URL + 'position', params=payload)
-        
-        resp = r.json()
-        self.catchment_identifier = resp['features'][0]['properties']['identifier']
+        feature = self.backend.position(self.x, self.y)
+        self.catchment_identifier = feature['properties']['identifier']
 
         #print('identifier:  ', self.catchment_identifier)
 
         self.get_upstream_basin()
 
-    def get_upstream_basin(self):
-
-        #request upstream basin
-
-        payload = {'f': 'json', 'simplified': 'false'}
-        
-        #request upstream basin from NLDI using comid of catchment point is in
-        r = requests.get(NLDI_URL + self.catchment_identifier + '/basin', params=payload)
-
-        #print('upstream basin', r.text)
-        resp = r.json()
+    def get_upstream_basin(self, basinFuture=None):
 
-        #convert geojson to ogr geom
-        gj_geom = json.dumps(resp['features'][0]['geometry'])
-        self.upstreamBasinGeom = ogr.CreateGeometryFromJson(gj_geom)
+        #request upstream basin from NLDI using comid of catchment point is in, unless already in flight
+        if basinFuture is not None:
+            self.upstreamBasinGeom = basinFuture.result()
+        else:
+            self.upstreamBasinGeom = self.backend.basin(self.catchment_identifier)
         self.upstreamBasinGeom.Transform(self.transformToRaster)
 
         self.geom_to_shapefile(self.upstreamBasinGeom, 'upstreamBasin')
@@ -234,36 +261,33 @@ class Watershed:
         PixelRes = 30
 
         #method to use catchment bounding box instead of exact geom
-        gdal.Warp(OUT_FDR, IN_FDR, format=RasterFormat, outputBounds=bounds, xRes=PixelRes, yRes=PixelRes, dstSRS=self.Projection, resampleAlg=gdal.GRA_NearestNeighbour, options=['COMPRESS=DEFLATE'])
-
-        #start pysheds catchment delineation
-        grid = Grid.from_raster(OUT_FDR, data_name='dir')
-
-        #compute flow accumulation to snap to
+        minX, minY, maxX, maxY = bounds
+        window = self.fdrStore.read_window(x, y, minX, maxX, minY, maxY) if self.fdrStore else None
+        if window is not None:
+
+            #prepared store is already projected and tiled, a plain window read unless it crosses tiles
+            fdr, transform = window
+        else:
+            if self.debug:
+                window = gdal.Warp(OUT_FDR, IN_FDR, format=RasterFormat, outputBounds=bounds, xRes=PixelRes, yRes=PixelRes, dstSRS=self.Projection, resampleAlg=gdal.GRA_NearestNeighbour, options=['COMPRESS=DEFLATE'])
+            else:
+                window = gdal.Warp('', IN_FDR, format='MEM', outputBounds=bounds, xRes=PixelRes, yRes=PixelRes, dstSRS=self.Projection, resampleAlg=gdal.GRA_NearestNeighbour)
+            fdr = window.GetRasterBand(1).ReadAsArray()
+            transform = window.GetGeoTransform()
+            window = None
+
+        #snap the pour point outward to the nearest cell draining more than the threshold,
+        #counting only what drains through cells near the click instead of accumulating the whole window
         dirmap = (64,  128,  1,   2,    4,   8,    16,  32)
-        grid.accumulation(data='dir', dirmap=dirmap, out_name='acc', apply_mask=False)
-
-        grid.to_raster('acc', 'C:/NYBackup/GitHub/ss-delineate/data/acc.tif', view=False, blockxsize=16, blockysize=16)
+        row, col = cell_index(transform, x, y)
+        row, col = snap_to_stream(fdr, row, col, NLDI_SNAP_THRESHOLD, dirmap=dirmap)
 
-        #snap the pourpoint to 
-        xy = (x, y)
-        new_xy = grid.snap_to_mask(grid.acc > 50, xy, return_dist=False)
-
-        #get catchment with pysheds
-        grid.catchment(data='dir', x=new_xy[0], y=new_xy[1], out_name='catch', recursionlimit=15000, xytype='label')
-
-        # Clip the bounding box to the catchment
-        grid.clip_to('catch')
-
-        #some sort of strange raster to polygon conversion using rasterio method
-        shapes = grid.polygonize()
+        #trace the catchment upstream of the snapped pour point, no recursion limit
+        mask, window = trace_catchment(fdr, row, col, dirmap)
 
         #get split Catchment geometry
-        print('Split catchment complete')
-        split_geom = ogr.Geometry(ogr.wkbPolygon)
-
-        for shape in shapes:
-            split_geom = split_geom.Union(ogr.CreateGeometryFromJson(json.dumps(shape[0])))
+        split_geom = mask_to_geometry(mask, window_transform(transform, window))
+        logger.debug('Split catchment complete')
 
         #write out shapefile
         self.geom_to_shapefile(split_geom, 'splitCatchment')
@@ -0,0 +1,308 @@
+## StreamStats offline NLDI backend
+
+# -----------------------------------------------------
+# Answers the NLDI catchment, position and basin queries
+# from a local NHDPlus catchment GeoPackage, a COMID flow
+# table and precomputed upstream basin dissolves, so NLDI
+# mode delineation runs without the network
+#
+# build basins with: "python nldi_local.py C:/temp/nldi_local/"
+# -----------------------------------------------------
+
+# list of required python packages:
+# gdal, numpy
+
+from osgeo import ogr, osr
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+import numpy as np
+import threading
+import argparse
+import logging
+import sqlite3
+import time
+import os
+
+#arguments
+NLDI_LOCAL_PATH = os.environ.get('SS_DELINEATE_NLDI_LOCAL', 'C:/NYBackup/GitHub/ss-delineate/data/nldi_local/')
+CATCHMENT_GPKG = 'catchments.gpkg' # NHDPlus catchments, spatially indexed by the GeoPackage rtree
+CATCHMENT_LAYER = 'catchments'
+CATCHMENT_LAYER_ID = 'featureid'
+FLOW_LAYER = 'flow' # one row per comid, tocomid 0 at outlets
+FLOW_LAYER_ID = 'comid'
+FLOW_LAYER_TO_ID = 'tocomid'
+BASIN_DB = 'basins.sqlite' # comid -> dissolved upstream basin as wgs84 WKB
+ID_CHUNK = 500 # ids per attribute filter
+LOGGED_IDS = 20 # comids listed in a warning
+FETCH_WORKERS = 4
+
+logger = logging.getLogger(__name__)
+
+class FlowTable:
+
+    def __init__(self, comids, tocomids):
+
+        #sorted by downstream id so the cells flowing into any comid are one slice
+        self.comids = np.asarray(comids, dtype='int64')
+        self.tocomids = np.asarray(tocomids, dtype='int64')
+        order = np.argsort(self.tocomids, kind='stable')
+        self.fromSorted = self.comids[order]
+        self.toSorted = self.tocomids[order]
+
+    @classmethod
+    def from_layer(cls, layer):
+
+        layer.ResetReading()
+        defn = layer.GetLayerDefn()
+        idIndex = defn.GetFieldIndex(FLOW_LAYER_ID)
+        toIndex = defn.GetFieldIndex(FLOW_LAYER_TO_ID)
+        comids = []
+        tocomids = []
+        seen = set()
+        duplicates = []
+        for feat in layer:
+            comid = feat.GetFieldAsInteger64(idIndex)
+
+            #each comid drains to one place, extra rows (divergences) are dropped and the first kept
+            if comid in seen:
+                duplicates.append(comid)
+                continue
+            seen.add(comid)
+            comids.append(comid)
+            tocomids.append(feat.GetFieldAsInteger64(toIndex))
+        layer.ResetReading()
+
+        if duplicates:
+            logger.warning('Dropped %s extra %s rows, the first row of each comid is kept: %s', len(duplicates), FLOW_LAYER, sorted(set(duplicates))[:LOGGED_IDS])
+        return cls(comids, tocomids)
+
+    def upstream(self, comids):
+
+        #comids flowing directly into any of comids
+        comids = np.atleast_1d(np.asarray(comids, dtype='int64'))
+        left = np.searchsorted(self.toSorted, comids, 'left')
+        right = np.searchsorted(self.toSorted, comids, 'right')
+        if not (right - left).any():
+            return np.zeros(0, dtype='int64')
+        return np.concatenate([self.fromSorted[l:r] for l, r in zip(left, right) if r > l])
+
+    def all_upstream(self, comid):
+
+        #comid and everything above it, one frontier at a time, loops stop at cells already seen
+        seen = np.array([comid], dtype='int64')
+        frontier = seen
+        while len(frontier):
+            frontier = np.setdiff1d(self.upstream(frontier), seen)
+            seen = np.union1d(seen, frontier)
+        return seen
+
+    def headwaters_first(self):
+
+        #every comid after all of the comids flowing into it
+        remaining = dict(zip(self.comids.tolist(), [0] * len(self.comids)))
+        for tocomid in self.tocomids.tolist():
+            if tocomid in remaining:
+                remaining[tocomid] += 1
+        downstream = dict(zip(self.comids.tolist(), self.tocomids.tolist()))
+
+        queue = deque(comid for comid, count in remaining.items() if count == 0)
+        order = []
+        while queue:
+            comid = queue.popleft()
+            order.append(comid)
+            tocomid = downstream[comid]
+            if tocomid in remaining:
+                remaining[tocomid] -= 1
+                if remaining[tocomid] == 0:
+                    queue.append(tocomid)
+
+        #comids in a flow loop never run out of upstream comids, their basins are dissolved on request instead
+        if len(order) < len(remaining):
+            unordered = sorted(comid for comid, count in remaining.items() if count > 0)
+            logger.warning('%s comids are in a flow loop and were left out of the order: %s', len(unordered), unordered[:LOGGED_IDS])
+        return order
+
+class LocalNLDI:
+
+    ogr.UseExceptions()
+
+    def __init__(self, path=NLDI_LOCAL_PATH, workers=FETCH_WORKERS):
+
+        self.path = path
+        self.gdb = ogr.Open(path + CATCHMENT_GPKG, 0)
+        self.catchmentLayer = self.gdb.GetLayer(CATCHMENT_LAYER)
+        self.catchmentLayerIdIndex = self.catchmentLayer.GetLayerDefn().GetFieldIndex(CATCHMENT_LAYER_ID)
+        self.flowLayer = self.gdb.GetLayer(FLOW_LAYER)
+
+        #layers share one handle so filters must not interleave between threads
+        self.lock = threading.RLock()
+
+        #queries come in and go out as wgs84 lng/lat like the live NLDI
+        wgs_ref = osr.SpatialReference()
+        wgs_ref.ImportFromEPSG(4326)
+        wgs_ref.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        layer_ref = self.catchmentLayer.GetSpatialRef().Clone()
+        layer_ref.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        self.toLayer = osr.CoordinateTransformation(wgs_ref, layer_ref)
+        self.toWGS = osr.CoordinateTransformation(layer_ref, wgs_ref)
+
+        self._flow = None
+        self.basinLock = threading.Lock()
+        self.basins = sqlite3.connect(path + BASIN_DB, check_same_thread=False)
+        self.basins.execute('CREATE TABLE IF NOT EXISTS basins (comid INTEGER PRIMARY KEY, wkb BLOB)')
+
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='nldi-local')
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        self.basins.close()
+        self.catchmentLayer = None
+        self.flowLayer = None
+        self.gdb = None
+
+    @property
+    def flow(self):
+        with self.lock:
+            if self._flow is None:
+                self._flow = FlowTable.from_layer(self.flowLayer)
+            return self._flow
+
+    def catchments(self, comids):
+
+        #wgs84 geometries of the given comids, fetched in chunks of attribute filters
+        geometries = {}
+        comids = [int(comid) for comid in comids]
+        with self.lock:
+            for i in range(0, len(comids), ID_CHUNK):
+                chunk = comids[i:i + ID_CHUNK]
+                self.catchmentLayer.SetSpatialFilter(None)
+                self.catchmentLayer.SetAttributeFilter('%s IN (%s)' % (CATCHMENT_LAYER_ID, ','.join(str(comid) for comid in chunk)))
+                for feat in self.catchmentLayer:
+                    geom = feat.GetGeometryRef()
+                    if geom is not None:
+                        geom = geom.Clone()
+                        geom.Transform(self.toWGS)
+                        geometries[feat.GetFieldAsInteger64(self.catchmentLayerIdIndex)] = geom
+            self.catchmentLayer.SetAttributeFilter(None)
+            self.catchmentLayer.ResetReading()
+        return geometries
+
+    def catchment_id_at(self, x, y):
+
+        point = ogr.Geometry(ogr.wkbPoint)
+        point.AddPoint_2D(x, y)
+        point.Transform(self.toLayer)
+
+        #the rtree narrows to envelopes, the exact test picks the catchment
+        with self.lock:
+            self.catchmentLayer.SetAttributeFilter(None)
+            self.catchmentLayer.SetSpatialFilter(point)
+            comid = None
+            for feat in self.catchmentLayer:
+                geom = feat.GetGeometryRef()
+                if geom is not None and geom.Intersects(point):
+                    comid = feat.GetFieldAsInteger64(self.catchmentLayerIdIndex)
+            self.catchmentLayer.SetSpatialFilter(None)
+            self.catchmentLayer.ResetReading()
+
+        if comid is None:
+            raise ValueError('No catchment found at %s, %s' % (x, y))
+        return comid
+
+    def catchment_at(self, x, y):
+
+        #same answer as the geoserver catchmentsp query: properties and a fresh wgs84 geometry
+        comid = self.catchment_id_at(x, y)
+        return {'featureid': comid}, self.catchments([comid])[comid]
+
+    def position(self, x, y):
+        return {'properties': {'identifier': str(self.catchment_id_at(x, y))}}
+
+    def stored_basin(self, comid):
+        with self.basinLock:
+            row = self.basins.execute('SELECT wkb FROM basins WHERE comid = ?', (int(comid),)).fetchone()
+        return ogr.CreateGeometryFromWkb(bytes(row[0])) if row is not None else None
+
+    def store_basin(self, comid, geom, commit=True):
+        with self.basinLock:
+            self.basins.execute('INSERT OR REPLACE INTO basins VALUES (?, ?)', (int(comid), bytes(geom.ExportToWkb())))
+            if commit:
+                self.basins.commit()
+
+    def basin(self, comid):
+
+        #precomputed dissolve when there is one, otherwise dissolved from the flow table and kept
+        basin = self.stored_basin(comid)
+        if basin is not None:
+            return basin
+
+        timeBefore = time.perf_counter()
+        comids = self.flow.all_upstream(int(comid))
+        basin = dissolve(self.catchments(comids).values())
+        self.store_basin(comid, basin)
+        logger.info('Dissolved basin for comid %s from %s catchments in %.2fs', comid, len(comids), time.perf_counter() - timeBefore)
+        return basin
+
+    def basin_async(self, comid):
+        return self.executor.submit(self.basin, comid)
+
+def dissolve(geometries):
+
+    collection = ogr.Geometry(ogr.wkbMultiPolygon)
+    for geom in geometries:
+        if geom.GetGeometryType() in (ogr.wkbMultiPolygon, ogr.wkbMultiPolygon25D):
+            for i in range(geom.GetGeometryCount()):
+                collection.AddGeometry(geom.GetGeometryRef(i))
+        else:
+            collection.AddGeometry(geom)
+    return collection.UnionCascaded()
+
+def build_basins(path=NLDI_LOCAL_PATH):
+
+    #headwaters first, each basin is its catchment unioned with the basins directly above it
+    backend = LocalNLDI(path)
+    flow = backend.flow
+    order = flow.headwaters_first()
+    downstream = dict(zip(flow.comids.tolist(), flow.tocomids.tolist()))
+    known = set(order)
+
+    pending = {}
+    timeBefore = time.perf_counter()
+    for start in range(0, len(order), ID_CHUNK):
+
+        #catchments are read a chunk at a time so only basins still waiting on a downstream comid stay in memory
+        chunk = order[start:start + ID_CHUNK]
+        catchments = backend.catchments(chunk)
+
+        for i, comid in enumerate(chunk, start):
+            parts = [pending.pop(upstream) for upstream in flow.upstream(comid).tolist() if upstream in pending]
+            if comid in catchments:
+                parts.append(catchments.pop(comid))
+            if not parts:
+                continue
+
+            #each comid has one downstream, so an upstream basin is dropped once it is used
+            basin = dissolve(parts) if len(parts) > 1 else parts[0]
+            backend.store_basin(comid, basin, commit=False)
+            if downstream[comid] in known:
+                pending[comid] = basin
+
+            if (i + 1) % 1000 == 0:
+                backend.basins.commit()
+                logger.info('Built %s of %s basins in %.1fs', i + 1, len(order), time.perf_counter() - timeBefore)
+
+    backend.basins.commit()
+    backend.close()
+    return len(order)
+
+def main():
+
+    parser = argparse.ArgumentParser(description='precompute upstream basins for the offline NLDI backend')
+    parser.add_argument('path', help='folder with %s, ex: C:/temp/nldi_local/' % CATCHMENT_GPKG)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    print('Built', build_basins(args.path), 'basins')
+
+if __name__=='__main__':
+    main()
@@ -0,0 +1,303 @@
+## StreamStats delineation output encoding
+
+# -----------------------------------------------------
+# Watershed outputs kept as GeoJSON text straight from
+# ogr so responses are written without a parse and
+# re-serialize round trip, plus compact TopoJSON and
+# FlatGeobuf encodings and response compression
+# -----------------------------------------------------
+
+# list of required python packages:
+# gdal (FlatGeobuf), brotli (optional)
+
+from osgeo import ogr, osr, gdal
+import json
+import gzip
+import uuid
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+#arguments
+COORDINATE_PRECISION = 6 # decimal places of lng/lat, about 0.1 m
+TOPOJSON_QUANTIZATION = 100000 # grid steps across the output extent, about 1 m on a 100 km basin
+COMPRESSION_MIN_BYTES = 1024 # smaller bodies are sent as is
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+FORMATS = {
+    'geojson': 'application/json',
+    'topojson': 'application/json',
+    'flatgeobuf': 'application/flatgeobuf'
+}
+
+class Feature:
+
+    def __init__(self, geometryJson, area, geometry=None):
+
+        #geometry is the wgs84 ogr geometry, kept for binary encodings
+        self.geometryJson = geometryJson
+        self.area = area
+        self.geometry = geometry
+        self._geometry = None
+
+    def to_json(self):
+        return '{"type": "Feature", "geometry": %s, "properties": {"area": %s}}' % (self.geometryJson, json.dumps(self.area))
+
+    #dict style access so existing callers reading feature['properties']['area'] keep working
+    def __getitem__(self, key):
+
+        if key == 'type':
+            return 'Feature'
+        if key == 'properties':
+            return {'area': self.area}
+        if key == 'geometry':
+
+            #only parsed when someone actually asks for the coordinates
+            if self._geometry is None:
+                self._geometry = json.loads(self.geometryJson)
+            return self._geometry
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+class RawJSON:
+
+    #json text that was encoded elsewhere, passed through as is
+    def __init__(self, text):
+        self.text = text
+
+    def to_json(self):
+        return self.text
+
+def to_json(value):
+
+    #features and raw text are already encoded, anything else goes through json
+    if value is None:
+        return 'null'
+    if isinstance(value, (Feature, RawJSON)):
+        return value.to_json()
+    return json.dumps(value)
+
+def object_bytes(items):
+
+    #json object from (key, value) pairs without re-encoding any Feature
+    return ('{' + ', '.join('%s: %s' % (json.dumps(key), to_json(value)) for key, value in items) + '}').encode('utf-8')
+
+def add_member(document, key, value):
+
+    #splice one more member into an already encoded json object
+    member = ('%s: %s' % (json.dumps(key), to_json(value))).encode('utf-8')
+    body = document.rstrip()[:-1].rstrip()
+    separator = b', ' if not body.endswith(b'{') else b''
+    return body + separator + member + b'}'
+
+def quantize_ring(ring, x0, y0, kx, ky):
+
+    #integer grid coordinates, repeated points dropped, ring kept closed
+    points = []
+    for x, y in ((coord[0], coord[1]) for coord in ring):
+        point = (int(round((x - x0) / kx)), int(round((y - y0) / ky)))
+        if not points or points[-1] != point:
+            points.append(point)
+    if len(points) > 1 and points[0] != points[-1]:
+        points.append(points[0])
+    return points
+
+def polygons_of(geometry):
+
+    if geometry is None:
+        return []
+    if geometry['type'] == 'Polygon':
+        return [geometry['coordinates']]
+    if geometry['type'] == 'MultiPolygon':
+        return geometry['coordinates']
+    if geometry['type'] == 'GeometryCollection':
+        return [polygon for part in geometry['geometries'] for polygon in polygons_of(part)]
+    return []
+
+def find_junctions(rings):
+
+    #a point is a junction where the rings passing through it stop sharing neighbours
+    neighbours = {}
+    junctions = set()
+    for ring in rings:
+        points = ring[:-1]
+        for i, point in enumerate(points):
+            pair = (points[i - 1], points[(i + 1) % len(points)])
+            seen = neighbours.get(point)
+            if seen is None:
+                neighbours[point] = pair
+            elif seen != pair and seen != (pair[1], pair[0]):
+                junctions.add(point)
+    return junctions
+
+def cut_ring(ring, junctions):
+
+    points = ring[:-1]
+    cuts = [i for i, point in enumerate(points) if point in junctions]
+
+    #rings sharing no junction become one arc, started at the smallest point so copies match
+    if not cuts:
+        start = points.index(min(points)) if points else 0
+        rotated = points[start:] + points[:start]
+        return [rotated + rotated[:1]]
+
+    rotated = points[cuts[0]:] + points[:cuts[0]]
+    rotated.append(rotated[0])
+    offsets = [i - cuts[0] for i in cuts] + [len(points)]
+    return [rotated[offsets[i]:offsets[i + 1] + 1] for i in range(len(offsets) - 1)]
+
+def topology(features, quantization=TOPOJSON_QUANTIZATION):
+
+    #features are (name, Feature or None), shared boundaries are stored once as arcs
+    geometries = [(name, feature, polygons_of(feature['geometry'])) for name, feature in features if feature is not None]
+
+    coords = [coord for name, feature, polygons in geometries for polygon in polygons for ring in polygon for coord in ring]
+    if coords:
+        x0 = min(coord[0] for coord in coords)
+        y0 = min(coord[1] for coord in coords)
+        kx = (max(coord[0] for coord in coords) - x0) / (quantization - 1) or 1.0
+        ky = (max(coord[1] for coord in coords) - y0) / (quantization - 1) or 1.0
+    else:
+        x0 = y0 = 0.0
+        kx = ky = 1.0
+
+    quantized = [(name, feature, [[quantize_ring(ring, x0, y0, kx, ky) for ring in polygon] for polygon in polygons]) for name, feature, polygons in geometries]
+    junctions = find_junctions([ring for name, feature, polygons in quantized for polygon in polygons for ring in polygon if len(ring) > 1])
+
+    arcs = []
+    arcIndex = {}
+
+    def arc_id(arc):
+        key = tuple(arc)
+        if key in arcIndex:
+            return arcIndex[key]
+        reverse = tuple(reversed(arc))
+        if reverse in arcIndex:
+            return ~arcIndex[reverse]
+        arcIndex[key] = len(arcs)
+        arcs.append(arc)
+        return arcIndex[key]
+
+    objects = {}
+    for name, feature, polygons in quantized:
+        polygonArcs = [[[arc_id(arc) for arc in cut_ring(ring, junctions)] for ring in polygon if len(ring) > 1] for polygon in polygons]
+        if len(polygonArcs) == 1:
+            geometry = {'type': 'Polygon', 'arcs': polygonArcs[0]}
+        elif polygonArcs:
+            geometry = {'type': 'MultiPolygon', 'arcs': polygonArcs}
+        else:
+            geometry = {'type': None}
+        geometry['properties'] = {'area': feature.area}
+        objects[name] = geometry
+
+    #delta encode each arc
+    encoded = []
+    for arc in arcs:
+        previous = (0, 0)
+        delta = []
+        for point in arc:
+            delta.append([point[0] - previous[0], point[1] - previous[1]])
+            previous = point
+        encoded.append(delta)
+
+    return {
+        'type': 'Topology',
+        'transform': {'scale': [kx, ky], 'translate': [x0, y0]},
+        'objects': objects,
+        'arcs': encoded
+    }
+
+def flatgeobuf_bytes(features):
+
+    #one record per output, written through gdal into memory
+    path = '/vsimem/%s.fgb' % uuid.uuid4().hex
+    wgs_ref = osr.SpatialReference()
+    wgs_ref.ImportFromEPSG(4326)
+    wgs_ref.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+
+    dataset = ogr.GetDriverByName('FlatGeobuf').CreateDataSource(path)
+    layer = dataset.CreateLayer('watershed', wgs_ref, ogr.wkbMultiPolygon, options=['SPATIAL_INDEX=NO'])
+    layer.CreateField(ogr.FieldDefn('name', ogr.OFTString))
+    layer.CreateField(ogr.FieldDefn('area', ogr.OFTReal))
+
+    for name, feature in features:
+        if feature is None:
+            continue
+        feat = ogr.Feature(layer.GetLayerDefn())
+        feat.SetField('name', name)
+        feat.SetField('area', feature.area)
+        geometry = feature.geometry.Clone() if feature.geometry is not None else ogr.CreateGeometryFromJson(feature.geometryJson)
+        feat.SetGeometry(ogr.ForceToMultiPolygon(geometry))
+        layer.CreateFeature(feat)
+        feat = None
+
+    layer = None
+    dataset = None
+
+    f = gdal.VSIFOpenL(path, 'rb')
+    gdal.VSIFSeekL(f, 0, 2)
+    size = gdal.VSIFTellL(f)
+    gdal.VSIFSeekL(f, 0, 0)
+    data = gdal.VSIFReadL(1, size, f)
+    gdal.VSIFCloseL(f)
+    gdal.Unlink(path)
+
+    return bytes(data)
+
+def encode(items, format='geojson'):
+
+    #items are (name, value) pairs, Feature values are the watershed outputs
+    items = list(items)
+    if format == 'geojson':
+        return object_bytes(items)
+
+    features = [(name, value) for name, value in items if isinstance(value, Feature) or (value is None and name != 'metrics')]
+    if format == 'topojson':
+        document = json.dumps(topology(features), separators=(',', ':')).encode('utf-8')
+        for name, value in items:
+            if not isinstance(value, Feature) and value is not None:
+                document = add_member(document, name, value)
+        return document
+    if format == 'flatgeobuf':
+        return flatgeobuf_bytes(features)
+
+    raise ValueError('unknown format: %s' % format)
+
+def accepted_encodings(acceptEncoding):
+
+    #codings named in an Accept-Encoding header, skipping any sent with q=0
+    encodings = set()
+    for part in (acceptEncoding or '').split(','):
+        pieces = [piece.strip() for piece in part.split(';')]
+        if not pieces[0]:
+            continue
+        quality = 1.0
+        for piece in pieces[1:]:
+            if piece.startswith('q='):
+                try:
+                    quality = float(piece[2:])
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            encodings.add(pieces[0].lower())
+    return encodings
+
+def compress(body, acceptEncoding):
+
+    #returns the body and the Content-Encoding to send with it, brotli first when available
+    if len(body) < COMPRESSION_MIN_BYTES:
+        return body, None
+    encodings = accepted_encodings(acceptEncoding)
+    if brotli is not None and 'br' in encodings:
+        return brotli.compress(body, quality=BROTLI_QUALITY), 'br'
+    if 'gzip' in encodings or '*' in encodings:
+        return gzip.compress(body, GZIP_LEVEL), 'gzip'
+    return body, None
@@ -0,0 +1,54 @@
+## StreamStats mask polygonizing
+
+# -----------------------------------------------------
+# Turns a catchment mask into one polygon with a single
+# in-memory GDAL polygonize and one cascaded union
+# -----------------------------------------------------
+
+# list of required python packages:
+# gdal, numpy
+
+from osgeo import ogr, gdal
+from catchment import window_transform
+
+#masks bigger than this (in cells per side) are polygonized a tile at a time
+MASK_TILE_SIZE = 4096
+
+def polygonize_tile(tile, transform, parts):
+
+    rows, cols = tile.shape
+    raster = gdal.GetDriverByName('MEM').Create('', cols, rows, 1, gdal.GDT_Byte)
+    raster.SetGeoTransform(transform)
+    band = raster.GetRasterBand(1)
+    band.WriteArray(tile.astype('uint8'))
+
+    vector = ogr.GetDriverByName('Memory').CreateDataSource('')
+    layer = vector.CreateLayer('catch', geom_type=ogr.wkbPolygon)
+    layer.CreateField(ogr.FieldDefn('value', ogr.OFTInteger))
+
+    #band is its own mask so only catchment cells come out as polygons
+    gdal.Polygonize(band, band, layer, 0, [], callback=None)
+
+    for feat in layer:
+        parts.AddGeometry(feat.GetGeometryRef())
+
+def mask_to_geometry(mask, transform, tile_size=MASK_TILE_SIZE):
+
+    rows, cols = mask.shape
+    parts = ogr.Geometry(ogr.wkbMultiPolygon)
+
+    for row0 in range(0, rows, tile_size):
+        for col0 in range(0, cols, tile_size):
+            tile = mask[row0:row0 + tile_size, col0:col0 + tile_size]
+            if not tile.any():
+                continue
+            window = (row0, row0 + tile.shape[0], col0, col0 + tile.shape[1])
+            polygonize_tile(tile, window_transform(transform, window), parts)
+
+    if parts.GetGeometryCount() == 0:
+        return ogr.Geometry(ogr.wkbPolygon)
+
+    #one cascaded union merges raster fragments and the seams between tiles
+    if parts.GetGeometryCount() == 1:
+        return parts.GetGeometryRef(0).Clone()
+    return parts.UnionCascaded()
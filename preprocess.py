@@ -0,0 +1,365 @@
+## StreamStats archydro preprocessing
+
+# -----------------------------------------------------
+# One time builds of request time helpers for each HUC:
+# a Catchment GridID raster aligned with the fdr grid,
+# a sidecar of catchment envelopes keyed on GridID and
+# a tiled, compressed raster stack (fdr plus a pixel
+# interleaved str/GridID file) listed in stacks.json,
+# per GridID merged upstream polygons (adjoint catchment
+# plus every upstream HUC) so a global delineation is
+# one union with the split catchment,
+# and optionally an uncompressed memory-mapped array
+# store that every worker process can share.
+# Also prepares the NLDI mode flow direction store:
+# fdr grids reprojected once, tiled and indexed by extent
+#
+# run with: "python preprocess.py C:/temp/ --region ny"
+#      or:  "python preprocess.py C:/temp/nldi_fdr/ --nldi-fdr nhd_fdr.tif"
+# -----------------------------------------------------
+
+# list of required python packages:
+# gdal, numpy
+
+from osgeo import ogr, gdal, gdal_array, osr
+from raster import TILE_INDEX_NAME
+from catchment import POLYGON_BUFFER_DISTANCE
+from catalog import RegionCatalog, HucHandle, grid_version, UPSTREAM_STORE_NAME, CATCHMENT_LAYER_ID, CATCHMENT_GRID_NAME, CATCHMENT_ENVELOPES_NAME, STACK_DIR, STACK_FDR_NAME, STACK_CELLS_NAME, STACK_MANIFEST_NAME, STACK_NODATA, ARRAY_STORE_DIR, ARRAY_HEADER_NAME
+import numpy as np
+import argparse
+import time
+import sqlite3
+import json
+import os
+
+#arguments
+CATCHMENT_GRID_NODATA = 0 # GridIDs start at 1
+STACK_BLOCK_SIZE = 256 # tiles small enough that a split window reads little beyond itself
+STACK_OPTIONS = ['TILED=YES', 'BLOCKXSIZE=%s' % STACK_BLOCK_SIZE, 'BLOCKYSIZE=%s' % STACK_BLOCK_SIZE, 'COMPRESS=DEFLATE', 'PREDICTOR=2']
+NLDI_FDR_OPTIONS = ['TILED=YES', 'BLOCKXSIZE=%s' % STACK_BLOCK_SIZE, 'BLOCKYSIZE=%s' % STACK_BLOCK_SIZE, 'COMPRESS=NONE', 'BIGTIFF=IF_SAFER']
+NLDI_FDR_RES = 30 # meters, same as the warp the split step used to do per request
+
+def build_catchment_grid(hucHandle):
+
+    gdal.UseExceptions()
+
+    #same size, origin and cell size as fdr so one cell index reads both
+    fdr = gdal.Open(hucHandle.fdr_grid, gdal.GA_ReadOnly)
+    catidPath = hucHandle.localDataPath + CATCHMENT_GRID_NAME
+    tmpPath = catidPath + '.tmp.tif'
+
+    driver = gdal.GetDriverByName('GTiff')
+    catid = driver.Create(tmpPath, fdr.RasterXSize, fdr.RasterYSize, 1, gdal.GDT_Int32, options=['TILED=YES', 'COMPRESS=DEFLATE'])
+    catid.SetGeoTransform(fdr.GetGeoTransform())
+    catid.SetProjection(fdr.GetProjection())
+    band = catid.GetRasterBand(1)
+    band.SetNoDataValue(CATCHMENT_GRID_NODATA)
+    band.Fill(CATCHMENT_GRID_NODATA)
+
+    #catchments follow cell edges, so burning by cell center gives every cell exactly one GridID
+    with hucHandle.lock:
+        catchmentLayer = hucHandle.catchmentLayer
+        catchmentLayer.SetSpatialFilter(None)
+        catchmentLayer.SetAttributeFilter(None)
+        gdal.RasterizeLayer(catid, [1], catchmentLayer, options=['ATTRIBUTE=' + CATCHMENT_LAYER_ID])
+
+        envelopes = {}
+        catchmentLayer.ResetReading()
+        for catchment_feat in catchmentLayer:
+            geom = catchment_feat.GetGeometryRef()
+            if geom is None:
+                continue
+            envelopes[catchment_feat.GetFieldAsString(hucHandle.catchmentLayerNameFieldIndex)] = list(geom.GetEnvelope())
+        catchmentLayer.ResetReading()
+
+    band.FlushCache()
+    band = None
+    catid = None
+    fdr = None
+    os.replace(tmpPath, catidPath)
+
+    #envelopes are only trusted while the gdb they came from is unchanged
+    with open(hucHandle.localDataPath + CATCHMENT_ENVELOPES_NAME, 'w') as f:
+        json.dump({'dataVersion': hucHandle.dataVersion, 'envelopes': envelopes}, f)
+
+    return catidPath
+
+def build_stack(hucHandle, include_catid=True):
+
+    gdal.UseExceptions()
+
+    stackPath = hucHandle.localDataPath + STACK_DIR
+    os.makedirs(stackPath, exist_ok=True)
+
+    #fdr is sampled over whole split windows, so it gets its own byte typed tiles
+    fdrPath = stackPath + STACK_FDR_NAME
+    gdal.Translate(fdrPath + '.tmp.tif', hucHandle.fdr_grid, format='GTiff', creationOptions=STACK_OPTIONS)
+    os.replace(fdrPath + '.tmp.tif', fdrPath)
+
+    #str and GridID are read together at the input point, pixel interleaving puts both in one block
+    sources = [gdal.Open(hucHandle.str_grid, gdal.GA_ReadOnly)]
+    if include_catid:
+        sources.append(gdal.Open(hucHandle.localDataPath + CATCHMENT_GRID_NAME, gdal.GA_ReadOnly))
+    template = sources[0]
+    for source in sources[1:]:
+        if (source.RasterXSize, source.RasterYSize, source.GetGeoTransform()) != (template.RasterXSize, template.RasterYSize, template.GetGeoTransform()):
+            raise ValueError('grids for %s are not aligned' % hucHandle.hucName)
+
+    cellsPath = stackPath + STACK_CELLS_NAME
+    driver = gdal.GetDriverByName('GTiff')
+    cells = driver.Create(cellsPath + '.tmp.tif', template.RasterXSize, template.RasterYSize, len(sources), gdal.GDT_Int32, options=STACK_OPTIONS + ['INTERLEAVE=PIXEL'])
+    cells.SetGeoTransform(template.GetGeoTransform())
+    cells.SetProjection(template.GetProjection())
+
+    #one strip of tiles at a time keeps memory flat on large HUCs, nodata is normalized to STACK_NODATA
+    for i, source in enumerate(sources):
+        sourceBand = source.GetRasterBand(1)
+        sourceNodata = sourceBand.GetNoDataValue()
+        band = cells.GetRasterBand(i + 1)
+        band.SetNoDataValue(STACK_NODATA)
+        for row in range(0, template.RasterYSize, STACK_BLOCK_SIZE):
+            rows = min(STACK_BLOCK_SIZE, template.RasterYSize - row)
+            data = sourceBand.ReadAsArray(0, row, template.RasterXSize, rows)
+            out = data.astype('int32')
+            if sourceNodata is not None:
+                out[data == sourceNodata] = STACK_NODATA
+            if i == 1:
+                out[data == CATCHMENT_GRID_NODATA] = STACK_NODATA
+            band.WriteArray(out, 0, row)
+        band.FlushCache()
+        band = None
+        sourceBand = None
+
+    geoTransform = template.GetGeoTransform()
+    rasterXSize, rasterYSize = template.RasterXSize, template.RasterYSize
+    cells = None
+    sources = None
+    template = None
+    os.replace(cellsPath + '.tmp.tif', cellsPath)
+
+    bands = {'str': 1}
+    if include_catid:
+        bands['catid'] = 2
+
+    #HucHandle only uses the stack while both versions still match
+    return {
+        'dataVersion': hucHandle.dataVersion,
+        'gridVersion': grid_version(hucHandle.localDataPath),
+        'fdr': STACK_FDR_NAME,
+        'cells': STACK_CELLS_NAME,
+        'bands': bands,
+        'rows': rasterYSize,
+        'cols': rasterXSize,
+        'geoTransform': list(geoTransform),
+        'extent': [geoTransform[0], geoTransform[0] + geoTransform[1] * rasterXSize, geoTransform[3] + geoTransform[5] * rasterYSize, geoTransform[3]]
+    }
+
+def build_array_store(hucHandle, include_catid=True):
+
+    gdal.UseExceptions()
+
+    storePath = hucHandle.localDataPath + ARRAY_STORE_DIR
+    os.makedirs(storePath, exist_ok=True)
+
+    grids = [('fdr', hucHandle.fdr_grid), ('str', hucHandle.str_grid)]
+    if include_catid and os.path.exists(hucHandle.localDataPath + CATCHMENT_GRID_NAME):
+        grids.append(('catid', hucHandle.localDataPath + CATCHMENT_GRID_NAME))
+
+    header = {'dataVersion': hucHandle.dataVersion, 'gridVersion': grid_version(hucHandle.localDataPath), 'grids': {}}
+    for name, path in grids:
+        source = gdal.Open(path, gdal.GA_ReadOnly)
+        band = source.GetRasterBand(1)
+        dtype = np.dtype(gdal_array.GDALTypeCodeToNumericTypeCode(band.DataType))
+
+        #written in strips through a map of the output so memory stays flat on large HUCs
+        fileName = name + '.npy'
+        out = np.lib.format.open_memmap(storePath + fileName + '.tmp', mode='w+', dtype=dtype, shape=(source.RasterYSize, source.RasterXSize))
+        for row in range(0, source.RasterYSize, STACK_BLOCK_SIZE):
+            rows = min(STACK_BLOCK_SIZE, source.RasterYSize - row)
+            out[row:row + rows] = band.ReadAsArray(0, row, source.RasterXSize, rows)
+        out.flush()
+        out = None
+        os.replace(storePath + fileName + '.tmp', storePath + fileName)
+
+        header['grids'][name] = {
+            'file': fileName,
+            'dtype': dtype.str,
+            'geoTransform': list(source.GetGeoTransform()),
+            'projection': source.GetProjection(),
+            'nodata': band.GetNoDataValue()
+        }
+        band = None
+        source = None
+
+    #header last, so a half written store is never picked up
+    with open(storePath + ARRAY_HEADER_NAME + '.tmp', 'w') as f:
+        json.dump(header, f, indent=1)
+    os.replace(storePath + ARRAY_HEADER_NAME + '.tmp', storePath + ARRAY_HEADER_NAME)
+
+    return storePath
+
+def build_upstream_store(regionHandle, hucHandle):
+
+    #everything above a catchment is fixed, only the split piece depends on the click
+    hucGraph = regionHandle.huc_graph
+    storePath = hucHandle.localDataPath + UPSTREAM_STORE_NAME
+    tmpPath = storePath + '.tmp'
+    if os.path.exists(tmpPath):
+        os.remove(tmpPath)
+
+    store = sqlite3.connect(tmpPath)
+    store.execute('CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)')
+    store.execute('CREATE TABLE upstream (gridid TEXT PRIMARY KEY, adjoint BLOB, merged BLOB, area REAL, hucs TEXT, junctions TEXT)')
+    store.executemany('INSERT INTO meta VALUES (?, ?)', [('dataVersion', hucHandle.dataVersion), ('regionVersion', regionHandle.dataVersion)])
+
+    with hucHandle.lock:
+        adjointCatchmentLayer = hucHandle.adjointCatchmentLayer
+        adjointCatchmentLayer.SetSpatialFilter(None)
+        adjointCatchmentLayer.SetAttributeFilter(None)
+        adjoints = []
+        for adjointCatchment_feat in adjointCatchmentLayer:
+            geom = adjointCatchment_feat.GetGeometryRef()
+            if geom is not None:
+                adjoints.append((adjointCatchment_feat.GetFieldAsString(hucHandle.adjointCatchmentLayerNameFieldIndex), geom.Clone()))
+        adjointCatchmentLayer.ResetReading()
+
+    dissolved = {}
+    for catchmentID, adjointCatchmentGeom in adjoints:
+
+        #same parts handling and sliver buffer as delineate.get_local and aggregate_geometries
+        if adjointCatchmentGeom.GetGeometryName() == 'MULTIPOLYGON':
+            mergedAdjointCatchmentGeom = ogr.Geometry(ogr.wkbMultiPolygon)
+            for geom_part in adjointCatchmentGeom:
+                mergedAdjointCatchmentGeom.AddGeometry(geom_part)
+            adjointCatchmentGeom = mergedAdjointCatchmentGeom.UnionCascaded()
+        adjointCatchmentGeom = adjointCatchmentGeom.Buffer(POLYGON_BUFFER_DISTANCE)
+
+        #hucs draining into the adjoint catchment, nearby catchments usually share the same dissolve
+        junctions = hucGraph.junctions_in(adjointCatchmentGeom)
+        hucs = hucGraph.upstream_hucs(junctions) if len(junctions) else []
+        merged = None
+        area = adjointCatchmentGeom.GetArea()
+        if len(hucs):
+            key = tuple(sorted(hucs))
+            if key not in dissolved:
+                dissolved[key] = regionHandle.dissolve_hucs(list(hucs))
+            merged = adjointCatchmentGeom.Buffer(POLYGON_BUFFER_DISTANCE).Union(dissolved[key])
+            area = merged.GetArea()
+
+        store.execute('INSERT OR REPLACE INTO upstream VALUES (?, ?, ?, ?, ?, ?)', (
+            catchmentID,
+            bytes(adjointCatchmentGeom.ExportToWkb()),
+            bytes(merged.ExportToWkb()) if merged is not None else None,
+            area,
+            json.dumps(list(hucs)),
+            json.dumps(list(junctions))
+        ))
+
+    store.commit()
+    store.close()
+    os.replace(tmpPath, storePath)
+    return storePath
+
+def build_nldi_fdr_store(inputs, outPath, projection=None):
+
+    gdal.UseExceptions()
+    os.makedirs(outPath, exist_ok=True)
+
+    #every grid ends up in one working crs, the first input's unless one is given
+    target = osr.SpatialReference()
+    target.SetFromUserInput(projection or gdal.Open(inputs[0], gdal.GA_ReadOnly).GetProjection())
+    projection = target.ExportToWkt()
+
+    tiles = []
+    for inPath in inputs:
+        timeBefore = time.perf_counter()
+        name = os.path.splitext(os.path.basename(inPath))[0] + '.tif'
+        source = gdal.Open(inPath, gdal.GA_ReadOnly)
+
+        #grids already in the working crs are only retiled, their cells are not resampled
+        if osr.SpatialReference(wkt=source.GetProjection()).IsSame(target):
+            gdal.Translate(outPath + name + '.tmp.tif', source, format='GTiff', creationOptions=NLDI_FDR_OPTIONS)
+        else:
+            gdal.Warp(outPath + name + '.tmp.tif', source, format='GTiff', dstSRS=projection, xRes=NLDI_FDR_RES, yRes=NLDI_FDR_RES, resampleAlg=gdal.GRA_NearestNeighbour, creationOptions=NLDI_FDR_OPTIONS)
+        source = None
+        os.replace(outPath + name + '.tmp.tif', outPath + name)
+
+        tile = gdal.Open(outPath + name, gdal.GA_ReadOnly)
+        geoTransform = tile.GetGeoTransform()
+        tiles.append({
+            'file': name,
+            'extent': [geoTransform[0], geoTransform[0] + geoTransform[1] * tile.RasterXSize, geoTransform[3] + geoTransform[5] * tile.RasterYSize, geoTransform[3]]
+        })
+        tile = None
+        print('Prepared', outPath + name, 'in %.1fs' % (time.perf_counter() - timeBefore))
+
+    with open(outPath + TILE_INDEX_NAME + '.tmp', 'w') as f:
+        json.dump({'projection': projection, 'tiles': tiles}, f, indent=1)
+    os.replace(outPath + TILE_INDEX_NAME + '.tmp', outPath + TILE_INDEX_NAME)
+    return outPath + TILE_INDEX_NAME
+
+def write_manifest(globalDataPath, stacks):
+
+    #merged with any earlier run so single HUC rebuilds keep the rest, swapped in whole
+    manifestPath = globalDataPath + STACK_MANIFEST_NAME
+    manifest = {'hucs': {}}
+    if os.path.exists(manifestPath):
+        with open(manifestPath) as f:
+            manifest = json.load(f)
+    manifest['hucs'].update(stacks)
+
+    with open(manifestPath + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(manifestPath + '.tmp', manifestPath)
+    return manifestPath
+
+def preprocess_region(dataPath, region, hucs=None, include_catid=True, stacks=True, arrays=False, upstream=True):
+
+    catalog = RegionCatalog(dataPath)
+    regionHandle = catalog.region(region)
+    hucNames = hucs or sorted(set(regionHandle.hucIndex.values))
+
+    built = {}
+    for hucName in hucNames:
+        timeBefore = time.perf_counter()
+        try:
+            hucHandle = HucHandle(regionHandle.globalDataPath, hucName, regionVersion=regionHandle.dataVersion)
+            if include_catid:
+                build_catchment_grid(hucHandle)
+            if stacks:
+                built[hucName] = build_stack(hucHandle, include_catid)
+            if arrays:
+                build_array_store(hucHandle, include_catid)
+            if upstream:
+                build_upstream_store(regionHandle, hucHandle)
+            print('Preprocessed', hucName, 'in %.1fs' % (time.perf_counter() - timeBefore))
+        except Exception as e:
+            print('ERROR: could not preprocess', hucName, e)
+
+    if built:
+        print('Wrote', write_manifest(regionHandle.globalDataPath, built))
+
+def main():
+
+    parser = argparse.ArgumentParser(description='build request time helpers for archydro HUCs')
+    parser.add_argument('data', help='archydro data path, ex: C:/temp/ (output folder with --nldi-fdr)')
+    parser.add_argument('--region')
+    parser.add_argument('--huc', nargs='*', help='only these HUCs (default all in hucpoly)')
+    parser.add_argument('--no-catid', action='store_true', help='skip the GridID grid, stacks then hold str only')
+    parser.add_argument('--no-stacks', action='store_true', help='skip the tiled raster stacks')
+    parser.add_argument('--arrays', action='store_true', help='also write uncompressed memory-mapped grids for multi process servers')
+    parser.add_argument('--no-upstream', action='store_true', help='skip the per GridID merged upstream polygons')
+    parser.add_argument('--nldi-fdr', nargs='+', metavar='FDR', help='build the NLDI mode flow direction store from these national or per VPU fdr grids')
+    parser.add_argument('--nldi-srs', help='working crs for --nldi-fdr, ex: EPSG:5070 (default the first grid\'s)')
+    args = parser.parse_args()
+
+    if args.nldi_fdr:
+        print('Wrote', build_nldi_fdr_store(args.nldi_fdr, args.data, args.nldi_srs))
+        return
+    if not args.region:
+        parser.error('--region is required')
+
+    preprocess_region(args.data, args.region, args.huc, not args.no_catid, not args.no_stacks, args.arrays, not args.no_upstream)
+
+if __name__=='__main__':
+    main()
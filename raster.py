@@ -0,0 +1,295 @@
+## StreamStats raster sampling helpers
+
+# -----------------------------------------------------
+# Point and window reads against open fdr/str grids,
+# either through gdal or as zero-copy views of the
+# memory-mapped array store built by preprocess.py
+# -----------------------------------------------------
+
+# list of required python packages:
+# gdal, numpy
+
+from osgeo import gdal, gdal_array
+import numpy as np
+import threading
+import json
+
+#arguments
+TILE_INDEX_NAME = 'index.json' # extent and file of every grid in a TileStore
+
+class RasterSampler:
+
+    gdal.UseExceptions()
+
+    def __init__(self, path, band=1):
+
+        self.path = path
+        self.dataset = gdal.Open(path, gdal.GA_ReadOnly)
+        self.band = self.dataset.GetRasterBand(band)
+        self.nodata = self.band.GetNoDataValue()
+        self.cols = self.dataset.RasterXSize
+        self.rows = self.dataset.RasterYSize
+        self.blockXSize, self.blockYSize = self.band.GetBlockSize()
+
+        transform = self.dataset.GetGeoTransform()
+        self.transform = transform
+        self.xOrigin = transform[0]
+        self.yOrigin = transform[3]
+        self.pixelWidth = transform[1]
+        self.pixelHeight = -transform[5]
+        self.projection = self.dataset.GetProjection()
+
+        #gdal datasets are not safe to read from several threads at once
+        self.lock = threading.Lock()
+
+    def close(self):
+        self.band = None
+        self.dataset = None
+
+    def cell(self, x, y):
+
+        #works for scalars and numpy arrays alike
+        col = np.floor((np.asarray(x, dtype='float64') - self.xOrigin) / self.pixelWidth).astype('int64')
+        row = np.floor((self.yOrigin - np.asarray(y, dtype='float64')) / self.pixelHeight).astype('int64')
+        return row, col
+
+    def cell_corner(self, row, col):
+
+        #pysheds actually wants the top left of pixel, not the center
+        outX = (col * self.pixelWidth) + self.xOrigin
+        outY = (row * -self.pixelHeight) + self.yOrigin
+        return outX, outY
+
+    def contains(self, row, col):
+        return (row >= 0) & (row < self.rows) & (col >= 0) & (col < self.cols)
+
+    def window(self, minX, maxX, minY, maxY):
+
+        #expand bounds out to whole cells and clamp to the grid
+        col0 = max(int(np.floor((minX - self.xOrigin) / self.pixelWidth)), 0)
+        col1 = min(int(np.ceil((maxX - self.xOrigin) / self.pixelWidth)), self.cols)
+        row0 = max(int(np.floor((self.yOrigin - maxY) / self.pixelHeight)), 0)
+        row1 = min(int(np.ceil((self.yOrigin - minY) / self.pixelHeight)), self.rows)
+        return row0, row1, col0, col1
+
+    def read_window(self, minX, maxX, minY, maxY):
+
+        row0, row1, col0, col1 = self.window(minX, maxX, minY, maxY)
+
+        #every call gets its own array so concurrent requests never share a buffer
+        with self.lock:
+            data = self.band.ReadAsArray(col0, row0, max(col1 - col0, 0), max(row1 - row0, 0))
+
+        outX, outY = self.cell_corner(row0, col0)
+        transform = (outX, self.transform[1], self.transform[2], outY, self.transform[4], self.transform[5])
+
+        return data, transform
+
+    def sample(self, x, y):
+
+        row, col = self.cell(x, y)
+        row, col = int(row), int(col)
+        outX, outY = self.cell_corner(row, col)
+
+        if not self.contains(row, col):
+            return None, outX, outY
+
+        #a 1x1 read only pulls the block holding this cell into the gdal block cache
+        with self.lock:
+            data = self.band.ReadAsArray(col, row, 1, 1)
+
+        return data[0][0], outX, outY
+
+    def sample_bands(self, x, y):
+
+        #every band at one cell from a single read, pixel interleaved stacks pull one block for all of them
+        row, col = self.cell(x, y)
+        row, col = int(row), int(col)
+        outX, outY = self.cell_corner(row, col)
+
+        if not self.contains(row, col):
+            return None, outX, outY
+
+        with self.lock:
+            data = self.dataset.ReadAsArray(col, row, 1, 1)
+
+        return data.reshape(-1), outX, outY
+
+    def sample_many(self, xs, ys):
+
+        rows, cols = self.cell(np.atleast_1d(xs), np.atleast_1d(ys))
+        outX, outY = self.cell_corner(rows, cols)
+
+        inside = self.contains(rows, cols)
+        values = np.zeros(rows.shape, dtype=gdal_array.GDALTypeCodeToNumericTypeCode(self.band.DataType))
+
+        #group cells by the block they fall in so each block is read once
+        blockRows = rows[inside] // self.blockYSize
+        blockCols = cols[inside] // self.blockXSize
+        insideIndex = np.nonzero(inside)[0]
+        blocks = np.stack([blockRows, blockCols], axis=1)
+
+        if len(blocks):
+            uniqueBlocks, inverse = np.unique(blocks, axis=0, return_inverse=True)
+            inverse = inverse.reshape(-1)
+
+            with self.lock:
+                for i, (blockRow, blockCol) in enumerate(uniqueBlocks):
+                    xoff = int(blockCol * self.blockXSize)
+                    yoff = int(blockRow * self.blockYSize)
+                    xsize = min(self.blockXSize, self.cols - xoff)
+                    ysize = min(self.blockYSize, self.rows - yoff)
+                    block = self.band.ReadAsArray(xoff, yoff, xsize, ysize)
+
+                    members = insideIndex[inverse == i]
+                    values[members] = block[rows[members] - yoff, cols[members] - xoff]
+
+        mask = ~inside
+        if self.nodata is not None:
+            mask |= (values == self.nodata)
+
+        return np.ma.masked_array(values, mask=mask), outX, outY
+
+class ArraySampler(RasterSampler):
+
+    def __init__(self, path, header):
+
+        #uncompressed .npy mapped read only, every worker process shares the same page cache
+        self.path = path
+        self.array = np.load(path, mmap_mode='r')
+        self.nodata = header.get('nodata')
+        self.rows, self.cols = self.array.shape[:2]
+        self.blockXSize, self.blockYSize = self.cols, self.rows
+
+        transform = tuple(header['geoTransform'])
+        self.transform = transform
+        self.xOrigin = transform[0]
+        self.yOrigin = transform[3]
+        self.pixelWidth = transform[1]
+        self.pixelHeight = -transform[5]
+        self.projection = header.get('projection', '')
+
+        #kept for callers that lock around reads, views of a read only map need none
+        self.lock = threading.Lock()
+
+    def close(self):
+        self.array = None
+
+    def read_window(self, minX, maxX, minY, maxY):
+
+        #a view into the map, nothing is copied until a caller writes
+        row0, row1, col0, col1 = self.window(minX, maxX, minY, maxY)
+        data = self.array[row0:max(row1, row0), col0:max(col1, col0)]
+
+        outX, outY = self.cell_corner(row0, col0)
+        transform = (outX, self.transform[1], self.transform[2], outY, self.transform[4], self.transform[5])
+
+        return data, transform
+
+    def sample(self, x, y):
+
+        row, col = self.cell(x, y)
+        row, col = int(row), int(col)
+        outX, outY = self.cell_corner(row, col)
+
+        if not self.contains(row, col):
+            return None, outX, outY
+
+        return self.array[row, col], outX, outY
+
+    def sample_bands(self, x, y):
+
+        value, outX, outY = self.sample(x, y)
+        return (np.atleast_1d(value) if value is not None else None), outX, outY
+
+    def sample_many(self, xs, ys):
+
+        rows, cols = self.cell(np.atleast_1d(xs), np.atleast_1d(ys))
+        outX, outY = self.cell_corner(rows, cols)
+
+        inside = self.contains(rows, cols)
+        values = np.zeros(rows.shape, dtype=self.array.dtype)
+        values[inside] = self.array[rows[inside], cols[inside]]
+
+        mask = ~inside
+        if self.nodata is not None:
+            mask |= (values == self.nodata)
+
+        return np.ma.masked_array(values, mask=mask), outX, outY
+
+def tile_area(tile):
+    minX, maxX, minY, maxY = tile['extent']
+    return (maxX - minX) * (maxY - minY)
+
+def load_tile_store(path):
+
+    #None when preprocess.py hasn't built a store at path
+    try:
+        with open(path + TILE_INDEX_NAME) as f:
+            return TileStore(path, json.load(f))
+    except (OSError, ValueError):
+        return None
+
+class TileStore:
+
+    def __init__(self, path, index):
+
+        #grids in one crs, each listed with its extent so a window is read from just the tiles it touches
+        self.path = path
+        self.tiles = index['tiles']
+        self.projection = index['projection']
+        self.samplers = {}
+        self.lock = threading.Lock()
+
+    def sampler(self, name):
+        with self.lock:
+            if name not in self.samplers:
+                self.samplers[name] = RasterSampler(self.path + name)
+            return self.samplers[name]
+
+    def tile_at(self, x, y):
+
+        #tile holding x, y, the smallest when tiles overlap
+        matches = [tile for tile in self.tiles if tile['extent'][0] <= x < tile['extent'][1] and tile['extent'][2] < y <= tile['extent'][3]]
+        if not matches:
+            return None
+        return min(matches, key=tile_area)
+
+    def sampler_at(self, x, y):
+
+        tile = self.tile_at(x, y)
+        return self.sampler(tile['file']) if tile is not None else None
+
+    def read_window(self, x, y, minX, maxX, minY, maxY):
+
+        #cells covering the bounds on the grid of the tile holding x, y, None when no tile holds it
+        tile = self.tile_at(x, y)
+        if tile is None:
+            return None
+        sampler = self.sampler(tile['file'])
+
+        tileMinX, tileMaxX, tileMinY, tileMaxY = tile['extent']
+        if tileMinX <= minX and maxX <= tileMaxX and tileMinY <= minY and maxY <= tileMaxY:
+            return sampler.read_window(minX, maxX, minY, maxY)
+
+        #the window crosses a tile edge, mosaic every tile it touches instead of clamping to one
+        col0 = int(np.floor((minX - sampler.xOrigin) / sampler.pixelWidth))
+        col1 = int(np.ceil((maxX - sampler.xOrigin) / sampler.pixelWidth))
+        row0 = int(np.floor((sampler.yOrigin - maxY) / sampler.pixelHeight))
+        row1 = int(np.ceil((sampler.yOrigin - minY) / sampler.pixelHeight))
+        outX, outY = sampler.cell_corner(row0, col0)
+
+        #smallest tiles last so they win where tiles overlap, same as tile_at
+        matches = sorted([tile for tile in self.tiles if tile['extent'][0] < maxX and tile['extent'][1] > minX and tile['extent'][2] < maxY and tile['extent'][3] > minY], key=tile_area, reverse=True)
+        window = gdal.Warp('', [self.path + tile['file'] for tile in matches], format='MEM', outputBounds=(outX, outY - (row1 - row0) * sampler.pixelHeight, outX + (col1 - col0) * sampler.pixelWidth, outY),
+                           xRes=sampler.pixelWidth, yRes=sampler.pixelHeight, resampleAlg=gdal.GRA_NearestNeighbour)
+        data = window.GetRasterBand(1).ReadAsArray()
+        window = None
+
+        return data, (outX, sampler.transform[1], sampler.transform[2], outY, sampler.transform[4], sampler.transform[5])
+
+    def close(self):
+        with self.lock:
+            for sampler in self.samplers.values():
+                sampler.close()
+            self.samplers = {}
@@ -0,0 +1,91 @@
+## StreamStats delineation result cache
+
+# -----------------------------------------------------
+# Every click inside the same str/fdr cell gives the same
+# watershed, so serialized results are cached on the
+# snapped cell and identical requests share one run
+# -----------------------------------------------------
+
+from osgeo import ogr
+from concurrent.futures import Future
+from cache import tiered_cache, cache_key
+from metrics import REGISTRY
+from output import add_member
+import delineate
+import threading
+
+class ResultCache:
+
+    def __init__(self, catalog, cache=None):
+
+        self.catalog = catalog
+        self.cache = cache if cache is not None else tiered_cache('results')
+        self.inflight = {}
+        self.lock = threading.Lock()
+
+    def key(self, lat, lng, region, format='geojson'):
+
+        #snapping only needs the projection, the huc and the grid origin, no raster reads
+        regionHandle = self.catalog.region(region)
+        x, y = regionHandle.project(lng, lat)
+
+        point = ogr.Geometry(ogr.wkbPoint)
+        point.SetPoint_2D(0, x, y)
+        hucName = regionHandle.huc_for_point(point)
+        if hucName is None:
+            return None
+
+        hucHandle = regionHandle.huc(hucName)
+        row, col = hucHandle.str_sampler.cell(x, y)
+
+        #the disk tier outlives restarts, so a rebuilt grid or preprocess.py store must change the key too
+        return cache_key('result', format, region, hucName, int(row), int(col), regionHandle.dataVersion, hucHandle.dataVersion, hucHandle.storeVersion)
+
+    def delineate(self, lat, lng, region, include_metrics=False, format='geojson'):
+
+        #response body as bytes, metrics spliced into the json formats without decoding the features
+        body, metrics = self.lookup(lat, lng, region, format)
+        if include_metrics and format != 'flatgeobuf':
+            body = add_member(body, 'metrics', metrics)
+        return body
+
+    def lookup(self, lat, lng, region, format='geojson'):
+
+        key = self.key(lat, lng, region, format)
+        if key is None:
+            return self.run(lat, lng, region, format)
+
+        cached = self.cache.get(key)
+        if cached is not None:
+            REGISTRY.cache_hit()
+            return cached, {'cached': True}
+
+        #the first request for a cell runs it, the rest wait on the same future
+        with self.lock:
+            future = self.inflight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self.inflight[key] = future
+
+        if not leader:
+            return future.result(), {'cached': True}
+
+        try:
+            body, metrics = self.run(lat, lng, region, format)
+            self.cache.put(key, body)
+            future.set_result(body)
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                del self.inflight[key]
+
+        return body, metrics
+
+    def run(self, lat, lng, region, format='geojson'):
+
+        watershed = delineate.Watershed(lat, lng, region, self.catalog.dataPath, self.catalog)
+        REGISTRY.observe(watershed.metrics)
+        return watershed.encode(format), dict(watershed.metrics.as_dict(), cached=False)
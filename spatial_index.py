@@ -0,0 +1,161 @@
+## StreamStats in-memory spatial index
+
+# -----------------------------------------------------
+# Sort-Tile-Recursive packed R-tree over feature
+# envelopes, with the feature geometries held in memory
+# so point lookups never go back to the FileGDB
+# -----------------------------------------------------
+
+# list of required python packages:
+# gdal, numpy, shapely (optional, prepared geometries)
+
+from osgeo import ogr
+import numpy as np
+import threading
+
+try:
+    from shapely import wkb as shapely_wkb
+    from shapely.geometry import Point
+    from shapely.prepared import prep
+except ImportError:
+    shapely_wkb = None
+
+#arguments
+NODE_CAPACITY = 16
+
+def str_order(envelopes, capacity=NODE_CAPACITY):
+
+    #slice by envelope center x, then sort each slice by center y
+    count = len(envelopes)
+    leaves = int(np.ceil(count / float(capacity)))
+    sliceSize = int(np.ceil(np.sqrt(leaves))) * capacity
+
+    centerX = (envelopes[:, 0] + envelopes[:, 1]) / 2.0
+    centerY = (envelopes[:, 2] + envelopes[:, 3]) / 2.0
+
+    sliceOf = np.empty(count, dtype='int64')
+    sliceOf[np.argsort(centerX, kind='stable')] = np.arange(count) // sliceSize
+    return np.lexsort((centerY, sliceOf))
+
+class STRtree:
+
+    def __init__(self, envelopes, capacity=NODE_CAPACITY):
+
+        #envelopes in ogr GetEnvelope order: minX, maxX, minY, maxY
+        envelopes = np.asarray(envelopes, dtype='float64').reshape(-1, 4)
+        self.capacity = capacity
+        self.count = len(envelopes)
+        self.items = str_order(envelopes, capacity) if self.count else np.zeros(0, dtype='int64')
+
+        #each level groups runs of capacity boxes from the level below, root level last until reversed
+        levels = []
+        boxes = envelopes[self.items]
+        while len(boxes):
+            levels.append(boxes)
+            if len(boxes) == 1:
+                break
+            starts = np.arange(0, len(boxes), capacity)
+            boxes = np.column_stack((
+                np.minimum.reduceat(boxes[:, 0], starts),
+                np.maximum.reduceat(boxes[:, 1], starts),
+                np.minimum.reduceat(boxes[:, 2], starts),
+                np.maximum.reduceat(boxes[:, 3], starts)
+            ))
+        self.levels = levels[::-1]
+
+    def query(self, minX, maxX, minY, maxY):
+
+        #item indexes whose envelope touches the query box, ascending
+        if not self.count:
+            return np.zeros(0, dtype='int64')
+
+        nodes = np.arange(len(self.levels[0]))
+        for depth, boxes in enumerate(self.levels):
+            boxes = boxes[nodes]
+            nodes = nodes[(boxes[:, 0] <= maxX) & (boxes[:, 1] >= minX) & (boxes[:, 2] <= maxY) & (boxes[:, 3] >= minY)]
+            if depth == len(self.levels) - 1 or not len(nodes):
+                break
+
+            #children of node i are i * capacity up to the next node's first child
+            children = (nodes[:, None] * self.capacity + np.arange(self.capacity)).ravel()
+            nodes = children[children < len(self.levels[depth + 1])]
+
+        return np.sort(self.items[nodes])
+
+class FeatureIndex:
+
+    def __init__(self, geometries, values):
+
+        self.geometries = geometries
+        self.values = values
+        self.tree = STRtree([geom.GetEnvelope() for geom in geometries])
+
+        #prepared geometries answer repeated point tests much faster than plain ones, but GEOS
+        #builds their index on the first test so the tests are serialized between threads
+        self.shapes = None
+        self.prepared = None
+        self.preparedLock = threading.Lock()
+        if shapely_wkb is not None:
+            self.shapes = [shapely_wkb.loads(bytes(geom.ExportToWkb())) for geom in geometries]
+            self.prepared = [prep(shape) for shape in self.shapes]
+
+    @classmethod
+    def from_layer(cls, layer, fieldIndex):
+
+        #one pass over the layer, geometries are cloned so the layer can be reused
+        layer.SetSpatialFilter(None)
+        layer.SetAttributeFilter(None)
+        geometries = []
+        values = []
+        for feat in layer:
+            geom = feat.GetGeometryRef()
+            if geom is None:
+                continue
+            geometries.append(geom.Clone())
+            values.append(feat.GetFieldAsString(fieldIndex))
+        layer.ResetReading()
+
+        return cls(geometries, values)
+
+    def at_point(self, x, y):
+
+        #same as iterating a point spatial filter, the last matching feature wins
+        candidates = self.tree.query(x, x, y, y)
+        if not len(candidates):
+            return None
+
+        if self.prepared is not None:
+            point = Point(x, y)
+            with self.preparedLock:
+                for i in candidates[::-1]:
+                    if self.prepared[i].intersects(point):
+                        return int(i)
+            return None
+
+        point = ogr.Geometry(ogr.wkbPoint)
+        point.SetPoint_2D(0, x, y)
+        for i in candidates[::-1]:
+            if self.geometries[i].Intersects(point):
+                return int(i)
+        return None
+
+    def near_point(self, x, y, distance):
+
+        #same as a buffered point spatial filter, the last matching feature wins
+        candidates = self.tree.query(x - distance, x + distance, y - distance, y + distance)
+        if not len(candidates):
+            return None
+
+        if self.shapes is not None:
+            point = Point(x, y)
+            for i in candidates[::-1]:
+                if self.shapes[i].distance(point) <= distance:
+                    return int(i)
+            return None
+
+        point = ogr.Geometry(ogr.wkbPoint)
+        point.SetPoint_2D(0, x, y)
+        for i in candidates[::-1]:
+            if self.geometries[i].Distance(point) <= distance:
+                return int(i)
+        return None
@@ -0,0 +1,322 @@
+## StreamStats synthetic archydro generator
+
+# -----------------------------------------------------
+# Builds a small, self consistent archydro region with
+# known drainage areas so delineation can be tested and
+# benchmarked without the real NY/MA datasets
+#
+# run with: "python synthetic.py C:/temp/synthetic/ --hucs 12 --depth 4 --rows 201 --cols 400"
+# -----------------------------------------------------
+
+# list of required python packages:
+# gdal (3.6+ to write FileGDB), numpy
+
+from osgeo import ogr, osr, gdal
+import numpy as np
+import argparse
+import json
+import os
+
+from catalog import HUCPOLY_LAYER, HUCPOLY_LAYER_ID, HUCPOLY_LAYER_JUNCTION_ID, GLOBAL_STREAM_LAYER_ID, CATCHMENT_LAYER, CATCHMENT_LAYER_ID, ADJOINT_CATCHMENT_LAYER, ADJOINT_CATCHMENT_LAYER_ID
+
+#arguments
+SYNTHETIC_EPSG = 5070 # NAD83 CONUS Albers, same family of projection the archydro regions use
+SYNTHETIC_ORIGIN = (1700000.0, 2450000.0) # top left of the region in SYNTHETIC_EPSG
+GLOBAL_STREAM_LAYER = 'streams'
+HUC_NET_JUNCTIONS_LAYER = 'Huc_net_Junctions'
+HUC_NET_JUNCTIONS_LAYER_ID = 'HydroID'
+MANIFEST_NAME = 'synthetic.json'
+
+#flow direction codes used for the synthetic grids
+FDR_EAST = 1
+FDR_SOUTH = 4
+FDR_NORTH = 64
+FDR_NODATA = 255
+STR_NODATA = 255
+
+def huc_grids(rows, cols):
+
+    #main stem runs east along the middle row, every other cell drains straight to it
+    mainStem = rows // 2
+    fdr = np.empty((rows, cols), dtype='uint8')
+    fdr[:mainStem] = FDR_SOUTH
+    fdr[mainStem + 1:] = FDR_NORTH
+    fdr[mainStem] = FDR_EAST
+
+    strGrid = np.full((rows, cols), STR_NODATA, dtype='uint8')
+    strGrid[mainStem] = 1
+
+    return fdr, strGrid
+
+def slab_bounds(cols, catchments):
+
+    #catchments are full height column slabs, the last one takes the remainder
+    catchments = max(1, min(catchments, cols))
+    edges = np.linspace(0, cols, catchments + 1).astype(int)
+    return [(int(edges[i]), int(edges[i + 1])) for i in range(catchments)]
+
+def drainage_cells(row, col, rows, cols, hucIndex):
+
+    #cells draining through row, col of the hucIndex'th huc in a chain
+    mainStem = rows // 2
+    if row < mainStem:
+        return row + 1
+    if row > mainStem:
+        return rows - row
+    return (hucIndex * cols + col + 1) * rows
+
+def huc_layout(hucs, depth):
+
+    #hucs are laid out in parallel chains flowing east, each at most depth hucs long
+    depth = max(1, depth)
+    layout = []
+    for i in range(hucs):
+        chain, index = divmod(i, depth)
+        layout.append({'name': '%04d%04d' % (9000 + chain, index + 1), 'chain': chain, 'index': index})
+    return layout
+
+def rectangle(minX, maxX, minY, maxY):
+
+    ring = ogr.Geometry(ogr.wkbLinearRing)
+    for x, y in ((minX, maxY), (maxX, maxY), (maxX, minY), (minX, minY), (minX, maxY)):
+        ring.AddPoint_2D(x, y)
+    polygon = ogr.Geometry(ogr.wkbPolygon)
+    polygon.AddGeometry(ring)
+    multipolygon = ogr.Geometry(ogr.wkbMultiPolygon)
+    multipolygon.AddGeometry(polygon)
+    return multipolygon
+
+def create_gdb(path):
+
+    driver = ogr.GetDriverByName('OpenFileGDB')
+    if driver is None or not driver.TestCapability(ogr.ODrCCreateDataSource):
+        print('ERROR: this GDAL cannot write FileGDB, OpenFileGDB write support needs GDAL 3.6+')
+        return None
+    if os.path.exists(path):
+        driver.DeleteDataSource(path)
+    return driver.CreateDataSource(path)
+
+def create_layer(gdb, name, srs, geomType, fields):
+
+    layer = gdb.CreateLayer(name, srs, geomType)
+    for fieldName, fieldType in fields:
+        layer.CreateField(ogr.FieldDefn(fieldName, fieldType))
+    return layer
+
+def add_feature(layer, geom, **values):
+
+    feat = ogr.Feature(layer.GetLayerDefn())
+    for fieldName, value in values.items():
+        feat.SetField(fieldName, value)
+    feat.SetGeometry(geom)
+    layer.CreateFeature(feat)
+    feat = None
+
+def write_grid(path, array, transform, srs, nodata):
+
+    driver = gdal.GetDriverByName('GTiff')
+    dataset = driver.Create(path, array.shape[1], array.shape[0], 1, gdal.GDT_Byte, options=['TILED=YES', 'COMPRESS=DEFLATE'])
+    dataset.SetGeoTransform(transform)
+    dataset.SetProjection(srs.ExportToWkt())
+    band = dataset.GetRasterBand(1)
+    band.SetNoDataValue(nodata)
+    band.WriteArray(array)
+    band.FlushCache()
+    dataset = None
+
+class SyntheticRegion:
+
+    def __init__(self, hucs=4, depth=4, rows=201, cols=400, catchments=8, cell_size=10.0, origin=SYNTHETIC_ORIGIN):
+
+        self.rows = rows if rows % 2 else rows + 1
+        self.cols = cols
+        self.catchments = catchments
+        self.cellSize = float(cell_size)
+        self.origin = origin
+        self.depth = max(1, depth)
+        self.layout = huc_layout(hucs, self.depth)
+        self.slabs = slab_bounds(cols, catchments)
+
+        self.srs = osr.SpatialReference()
+        self.srs.ImportFromEPSG(SYNTHETIC_EPSG)
+        self.wgs_ref = osr.SpatialReference()
+        self.wgs_ref.ImportFromEPSG(4326)
+        self.wgs_ref.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        self.srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        self.toWGS = osr.CoordinateTransformation(self.srs, self.wgs_ref)
+
+    def huc_extent(self, huc):
+
+        width = self.cols * self.cellSize
+        height = self.rows * self.cellSize
+        minX = self.origin[0] + huc['index'] * width
+        maxY = self.origin[1] - huc['chain'] * height
+        return minX, minX + width, maxY - height, maxY
+
+    def cell_center(self, huc, row, col):
+
+        minX, maxX, minY, maxY = self.huc_extent(huc)
+        return minX + (col + 0.5) * self.cellSize, maxY - (row + 0.5) * self.cellSize
+
+    def junction_id(self, huc):
+        return huc['chain'] * self.depth + huc['index'] + 1
+
+    def main_stem_y(self, huc):
+        return self.cell_center(huc, self.rows // 2, 0)[1]
+
+    def write(self, dataPath, region):
+
+        globalDataPath = os.path.join(dataPath, region, 'archydro')
+        os.makedirs(globalDataPath, exist_ok=True)
+
+        if not self.write_global(os.path.join(globalDataPath, 'global.gdb')):
+            return None
+
+        fdr, strGrid = huc_grids(self.rows, self.cols)
+        for huc in self.layout:
+            localDataPath = os.path.join(globalDataPath, huc['name'])
+            os.makedirs(localDataPath, exist_ok=True)
+
+            minX, maxX, minY, maxY = self.huc_extent(huc)
+            transform = (minX, self.cellSize, 0.0, maxY, 0.0, -self.cellSize)
+
+            #named like the esri grids so HucHandle finds them, gdal opens them by content
+            write_grid(os.path.join(localDataPath, 'fdr'), fdr, transform, self.srs, FDR_NODATA)
+            write_grid(os.path.join(localDataPath, 'str'), strGrid, transform, self.srs, STR_NODATA)
+
+            if not self.write_local(os.path.join(localDataPath, huc['name'] + '.gdb'), huc):
+                return None
+
+        manifest = self.manifest(region)
+        with open(os.path.join(dataPath, region, MANIFEST_NAME), 'w') as f:
+            json.dump(manifest, f, indent=2)
+
+        print('Wrote synthetic region', region, 'with', len(self.layout), 'HUCs and', len(manifest['points']), 'test points')
+        return manifest
+
+    def write_global(self, path):
+
+        gdb = create_gdb(path)
+        if gdb is None:
+            return False
+
+        hucLayer = create_layer(gdb, HUCPOLY_LAYER, self.srs, ogr.wkbMultiPolygon, [(HUCPOLY_LAYER_ID, ogr.OFTString), (HUCPOLY_LAYER_JUNCTION_ID, ogr.OFTInteger)])
+        streamsLayer = create_layer(gdb, GLOBAL_STREAM_LAYER, self.srs, ogr.wkbLineString, [(GLOBAL_STREAM_LAYER_ID, ogr.OFTInteger)])
+        junctionsLayer = create_layer(gdb, HUC_NET_JUNCTIONS_LAYER, self.srs, ogr.wkbPoint, [(HUC_NET_JUNCTIONS_LAYER_ID, ogr.OFTInteger)])
+
+        for huc in self.layout:
+            minX, maxX, minY, maxY = self.huc_extent(huc)
+            junctionID = self.junction_id(huc)
+            add_feature(hucLayer, rectangle(minX, maxX, minY, maxY), **{HUCPOLY_LAYER_ID: huc['name'], HUCPOLY_LAYER_JUNCTION_ID: junctionID})
+
+            #each huc drains through a junction on its east edge, where the next huc starts
+            junction = ogr.Geometry(ogr.wkbPoint)
+            junction.SetPoint_2D(0, maxX, self.main_stem_y(huc))
+            add_feature(junctionsLayer, junction, **{HUC_NET_JUNCTIONS_LAYER_ID: junctionID})
+
+            #the main stem is only a global stream once it carries water from another huc
+            if huc['index'] > 0:
+                stream = ogr.Geometry(ogr.wkbLineString)
+                stream.AddPoint_2D(minX, self.main_stem_y(huc))
+                stream.AddPoint_2D(maxX, self.main_stem_y(huc))
+                add_feature(streamsLayer, stream, **{GLOBAL_STREAM_LAYER_ID: junctionID})
+
+        gdb = None
+        return True
+
+    def write_local(self, path, huc):
+
+        gdb = create_gdb(path)
+        if gdb is None:
+            return False
+
+        catchmentLayer = create_layer(gdb, CATCHMENT_LAYER, self.srs, ogr.wkbMultiPolygon, [(CATCHMENT_LAYER_ID, ogr.OFTInteger)])
+        adjointCatchmentLayer = create_layer(gdb, ADJOINT_CATCHMENT_LAYER, self.srs, ogr.wkbMultiPolygon, [(ADJOINT_CATCHMENT_LAYER_ID, ogr.OFTInteger)])
+
+        minX, maxX, minY, maxY = self.huc_extent(huc)
+        for gridID, (col0, col1) in enumerate(self.slabs, 1):
+            add_feature(catchmentLayer, rectangle(minX + col0 * self.cellSize, minX + col1 * self.cellSize, minY, maxY), **{CATCHMENT_LAYER_ID: gridID})
+
+            #adjoint catchment is everything upstream of the slab inside this huc
+            if col0 > 0:
+                add_feature(adjointCatchmentLayer, rectangle(minX, minX + col0 * self.cellSize, minY, maxY), **{ADJOINT_CATCHMENT_LAYER_ID: gridID})
+
+        gdb = None
+        return True
+
+    def point(self, name, pointType, huc, row, col):
+
+        x, y = self.cell_center(huc, row, col)
+        lng, lat, z = self.toWGS.TransformPoint(x, y)
+        cells = drainage_cells(row, col, self.rows, self.cols, huc['index'])
+        return {
+            'name': name,
+            'type': pointType,
+            'huc': huc['name'],
+            'lat': lat,
+            'lng': lng,
+            'x': x,
+            'y': y,
+            'cells': cells,
+            'area': cells * self.cellSize * self.cellSize
+        }
+
+    def manifest(self, region):
+
+        mainStem = self.rows // 2
+        points = []
+        for huc in self.layout:
+
+            #off the stream, a quarter of the way down from the top
+            col0, col1 = self.slabs[len(self.slabs) // 2]
+            points.append(self.point(huc['name'] + '_local', 'local', huc, self.rows // 4, (col0 + col1) // 2))
+
+            #on the main stem, in the middle of the last catchment so it never sits on the outlet junction
+            if len(self.slabs) > 1:
+                col0, col1 = self.slabs[-1]
+                pointType = 'global' if huc['index'] > 0 else 'localGlobal'
+                points.append(self.point(huc['name'] + '_' + pointType, pointType, huc, mainStem, (col0 + col1) // 2))
+
+            #first catchment of a headwater huc has a stream but nothing upstream of it
+            if huc['index'] == 0:
+                col0, col1 = self.slabs[0]
+                points.append(self.point(huc['name'] + '_local_on_str_no_adjoint', 'local_on_str_no_adjoint', huc, mainStem, (col0 + col1) // 2))
+
+        return {
+            'region': region,
+            'epsg': SYNTHETIC_EPSG,
+            'hucs': len(self.layout),
+            'depth': self.depth,
+            'rows': self.rows,
+            'cols': self.cols,
+            'catchments': len(self.slabs),
+            'cellSize': self.cellSize,
+            'points': points
+        }
+
+def load_manifest(dataPath, region):
+
+    with open(os.path.join(dataPath, region, MANIFEST_NAME)) as f:
+        return json.load(f)
+
+def main():
+
+    parser = argparse.ArgumentParser(description='build a synthetic archydro region')
+    parser.add_argument('data', help='data path to write into, ex: C:/temp/synthetic/')
+    parser.add_argument('--region', default='synthetic')
+    parser.add_argument('--hucs', type=int, default=4, help='number of HUCs')
+    parser.add_argument('--depth', type=int, default=4, help='longest chain of nested HUCs')
+    parser.add_argument('--rows', type=int, default=201, help='grid rows per HUC (made odd)')
+    parser.add_argument('--cols', type=int, default=400, help='grid columns per HUC')
+    parser.add_argument('--catchments', type=int, default=8, help='catchments per HUC')
+    parser.add_argument('--cell-size', type=float, default=10.0, help='cell size in meters')
+    args = parser.parse_args()
+
+    gdal.UseExceptions()
+    ogr.UseExceptions()
+
+    region = SyntheticRegion(args.hucs, args.depth, args.rows, args.cols, args.catchments, args.cell_size)
+    region.write(args.data, args.region)
+
+if __name__=='__main__':
+    main()
@@ -0,0 +1,128 @@
+import batch # The code to test
+import unittest
+import tempfile
+import json
+import os
+
+from unittest import mock
+from multiprocessing.pool import ThreadPool
+from types import SimpleNamespace
+from output import Feature
+
+class fake_region:
+
+    #west of -73.5 is huc 0201, east of it 0202, nothing east of -70
+    def project(self, lng, lat):
+        return lng, lat
+
+    def huc_for_point(self, point):
+        if point.GetX() > -70:
+            return None
+        return '0201' if point.GetX() < -73.5 else '0202'
+
+class fake_catalog:
+
+    def region(self, region):
+        if region != 'ny':
+            raise ValueError('unknown region: %s' % region)
+        return fake_region()
+
+class fake_watershed:
+
+    #small watershed per point, points at lat 0 fail like a point off the stream grid
+    def __init__(self, lat, lng, region, dataPath, catalog):
+        if lat == 0:
+            raise ValueError('no stream near point')
+        self.classification = 'local'
+        self.mergedCatchment = Feature('{"type": "Point", "coordinates": [%s, %s]}' % (lng, lat), 2.0)
+        self.splitCatchment = Feature('null', 1.0)
+
+def point(id, lng, lat=44.0, region='ny'):
+    return {'id': id, 'region': region, 'lat': lat, 'lng': lng}
+
+class batch_read_tests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_read_csv(self):
+        path = os.path.join(self.tmp.name, 'points.csv')
+        with open(path, 'w') as f:
+            f.write('Site_No,Latitude,Longitude,Region\n01312000,44.00683,-73.74586,ny\n,42.5,-71.5,\n')
+
+        points = batch.read_points(path, region='ma')
+
+        self.assertEqual(points[0], {'id': '01312000', 'region': 'ny', 'lat': 44.00683, 'lng': -73.74586})
+        self.assertEqual(points[1], {'id': '1', 'region': 'ma', 'lat': 42.5, 'lng': -71.5})
+
+    def test_read_geojson(self):
+        path = os.path.join(self.tmp.name, 'points.geojson')
+        with open(path, 'w') as f:
+            json.dump({'type': 'FeatureCollection', 'features': [
+                {'type': 'Feature', 'id': 'a', 'geometry': {'type': 'Point', 'coordinates': [-73.74586, 44.00683]}, 'properties': {'Region': 'ny'}}
+            ]}, f)
+
+        points = batch.read_points(path)
+
+        self.assertEqual(points, [{'id': 'a', 'region': 'ny', 'lat': 44.00683, 'lng': -73.74586}])
+
+class batch_group_tests(unittest.TestCase):
+
+    def test_groups_by_huc_largest_first(self):
+        points = [point('a', -74), point('b', -73), point('c', -74), point('d', -74), point('e', -60), point('f', -74, region='xx')]
+
+        with mock.patch.object(batch, 'get_catalog', lambda dataPath: fake_catalog()), mock.patch.object(batch, 'CHUNK_SIZE', 2):
+            tasks = batch.group_points(points, 'data/')
+
+        #the three point huc is split into chunks, input order is kept inside each chunk
+        self.assertEqual([(region, hucName, [p['id'] for p in members]) for region, hucName, members in tasks], [
+            ('ny', '0201', ['a', 'c']),
+            ('ny', '0201', ['d']),
+            ('ny', '0202', ['b']),
+            ('ny', None, ['e']),
+            ('xx', None, ['f'])
+        ])
+
+class batch_pool_tests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_pool_writes_ndjson(self):
+        points = [point('a', -74), point('b', -73), point('c', -74), point('bad', -74, lat=0), point('e', -60)]
+        outPath = os.path.join(self.tmp.name, 'watersheds.geojsonl')
+
+        #threads stand in for the worker processes so the fakes are shared on every platform
+        with mock.patch.object(batch, 'get_catalog', lambda dataPath: fake_catalog()), \
+             mock.patch.object(batch, 'RegionCatalog', lambda dataPath: fake_catalog()), \
+             mock.patch.object(batch.delineate, 'Watershed', fake_watershed), \
+             mock.patch.object(batch, 'get_context', lambda method: SimpleNamespace(Pool=ThreadPool)), \
+             mock.patch.object(batch, 'CHUNK_SIZE', 2):
+            stats = batch.delineate_batch(points, 'data/', outPath, processes=2)
+
+        with open(outPath) as f:
+            features = [json.loads(line) for line in f]
+
+        self.assertEqual((stats['points'], stats['errors']), (5, 2))
+        self.assertEqual(sorted(feature['properties']['id'] for feature in features), ['a', 'b', 'bad', 'c', 'e'])
+
+        #chunks finish in any order but each one is written in input order
+        ids = [feature['properties']['id'] for feature in features]
+        self.assertLess(ids.index('a'), ids.index('c'))
+
+        byId = {feature['properties']['id']: feature for feature in features}
+        self.assertEqual(byId['a']['geometry'], {'type': 'Point', 'coordinates': [-74, 44.0]})
+        self.assertEqual(byId['a']['properties'], {'id': 'a', 'region': 'ny', 'lat': 44.0, 'lng': -74, 'huc': '0201', 'type': 'local', 'area': 2.0, 'splitArea': 1.0})
+        self.assertEqual(byId['bad']['properties']['error'], 'no stream near point')
+        self.assertIsNone(byId['bad']['geometry'])
+        self.assertEqual(byId['e']['properties']['error'], 'point is not inside any HUC')
+        self.assertNotIn('huc', byId['e']['properties'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+import cache # The code to test
+import unittest
+import tempfile
+import os
+
+class cache_tests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_lru_evicts_oldest(self):
+        lru = cache.LRUCache(max_bytes=10)
+        lru.put('a', b'1234')
+        lru.put('b', b'1234')
+        lru.get('a')
+        lru.put('c', b'1234')
+
+        self.assertIsNone(lru.get('b'))
+        self.assertEqual(lru.get('a'), b'1234')
+        self.assertEqual(lru.bytes, 8)
+
+    def test_disk_round_trip_and_eviction(self):
+        disk = cache.DiskCache(self.tmp.name, max_bytes=100)
+        disk.put('a', b'x' * 60)
+        os.utime(disk.file_path('a'), (0, 0))
+        disk.put('b', b'y' * 60)
+
+        self.assertIsNone(disk.get('a'))
+        self.assertEqual(disk.get('b'), b'y' * 60)
+
+    def test_tiered_promotes_from_disk(self):
+        tiered = cache.TieredCache(cache.LRUCache(), cache.DiskCache(self.tmp.name))
+        tiered.disk.put('k', b'value')
+
+        self.assertEqual(tiered.get('k'), b'value')
+        self.assertEqual(tiered.memory.get('k'), b'value')
+
+    def test_cache_key(self):
+        self.assertEqual(cache.cache_key('ny', 1, ['a', 'b']), cache.cache_key('ny', '1', ['a', 'b']))
+        self.assertNotEqual(cache.cache_key('ny', ['a']), cache.cache_key('ma', ['a']))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import catalog # The code to test
+import unittest
+import threading
+
+class fake_sampler:
+
+    #3x3 grid of unit cells from 0, 0, values by row from the top
+    def __init__(self, values, nodata=None):
+        self.values = values
+        self.nodata = nodata
+
+    def sample(self, x, y):
+        row, col = int(3 - y), int(x)
+        if not (0 <= row < 3 and 0 <= col < 3):
+            return None, float(col), float(3 - row)
+        return self.values[row][col], float(col), float(3 - row)
+
+    def sample_bands(self, x, y):
+        value, outX, outY = self.sample(x, y)
+        return value, outX, outY
+
+def huc_handle(catidGrid, strGrid, envelopes, stack=None):
+
+    #just the parts of a HucHandle the local lookups read, no gdb or grids on disk
+    hucHandle = catalog.HucHandle.__new__(catalog.HucHandle)
+    hucHandle.lock = threading.RLock()
+    hucHandle.stack = stack
+    hucHandle.arrays = None
+    hucHandle._catchmentEnvelopes = envelopes
+    hucHandle._catchmentGrid = (catidGrid, envelopes) if catidGrid is not None else False
+    hucHandle._str_sampler = strGrid
+    return hucHandle
+
+ENVELOPES = {'7': [0, 2, 1, 3], '8': [2, 3, 0, 3]}
+
+class catchment_cell_tests(unittest.TestCase):
+
+    def setUp(self):
+        catid = fake_sampler([[7, 7, 8], [7, 0, 8], [0, 9, 8]], nodata=0)
+        strGrid = fake_sampler([[0, 1, 0], [0, 1, 0], [0, 1, 0]])
+        self.hucHandle = huc_handle(catid, strGrid, ENVELOPES)
+
+    def test_catchment_cell(self):
+        self.assertEqual(self.hucHandle.catchment_cell(0.5, 2.5), ('7', (0, 2, 1, 3)))
+        self.assertEqual(self.hucHandle.catchment_cell(2.5, 0.5), ('8', (2, 3, 0, 3)))
+
+    def test_nodata_cell(self):
+
+        #None, not (None, None), so get_local falls back to the catchment index
+        self.assertIsNone(self.hucHandle.catchment_cell(1.5, 1.5))
+        self.assertEqual(self.hucHandle.sample_local(1.5, 1.5), (1, 1.0, 2.0, None))
+
+    def test_outside_grid(self):
+        self.assertIsNone(self.hucHandle.catchment_cell(5.5, 1.5))
+
+    def test_id_missing_from_sidecar(self):
+        self.assertIsNone(self.hucHandle.catchment_cell(1.5, 0.5))
+
+    def test_no_grid(self):
+        hucHandle = huc_handle(None, fake_sampler([[0] * 3] * 3), False)
+        self.assertIsNone(hucHandle.catchment_cell(0.5, 2.5))
+
+    def test_stack_nodata(self):
+
+        #str and GridID bands read together, -1 marks cells outside every catchment
+        stackGrid = fake_sampler([[(0, 7), (1, catalog.STACK_NODATA), (0, 8)]] * 3)
+        hucHandle = huc_handle(None, stackGrid, ENVELOPES, stack={'bands': {'str': 1, 'catid': 2}})
+        self.assertEqual(hucHandle.sample_local(0.5, 2.5)[3], ('7', (0, 2, 1, 3)))
+        self.assertEqual(hucHandle.sample_local(1.5, 2.5), (1, 1.0, 3.0, None))
+
+if __name__ == '__main__':
+    unittest.main()
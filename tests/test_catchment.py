@@ -0,0 +1,105 @@
+import catchment # The code to test
+import unittest
+import numpy as np
+
+def brute_force_catchment(fdr, row, col):
+
+    #follow every cell downstream and keep the ones that reach the pour point
+    rows, cols = fdr.shape
+    steps = dict(zip(catchment.ESRI_DIRMAP, catchment.D8_OFFSETS))
+    mask = np.zeros(fdr.shape, dtype=bool)
+    for r in range(rows):
+        for c in range(cols):
+            cr, cc = r, c
+            for i in range(rows * cols):
+                if (cr, cc) == (row, col):
+                    mask[r, c] = True
+                    break
+                step = steps.get(int(fdr[cr, cc]))
+                if step is None:
+                    break
+                cr, cc = cr + step[0], cc + step[1]
+                if not (0 <= cr < rows and 0 <= cc < cols):
+                    break
+    return mask
+
+class catchment_tests(unittest.TestCase):
+
+    def test_simple_valley(self):
+
+        #everything drains to the middle column, which drains south
+        fdr = np.array([
+            [1, 4, 16],
+            [1, 4, 16],
+            [1, 4, 16],
+        ], dtype='uint8')
+
+        mask, window = catchment.trace_catchment(fdr, 1, 1)
+        self.assertEqual(window, (0, 2, 0, 3))
+        self.assertEqual(mask.sum(), 6)
+
+    def test_matches_brute_force(self):
+        rng = np.random.default_rng(42)
+        fdr = rng.choice(np.array(catchment.ESRI_DIRMAP + (0,), dtype='uint8'), size=(15, 20))
+
+        for row, col in [(0, 0), (7, 10), (14, 19), (10, 5)]:
+            mask, window = catchment.trace_catchment(fdr, row, col)
+            full = np.zeros(fdr.shape, dtype=bool)
+            full[window[0]:window[1], window[2]:window[3]] = mask
+            np.testing.assert_array_equal(full, brute_force_catchment(fdr, row, col))
+
+    def test_long_flow_path(self):
+
+        #serpentine path through every cell, far deeper than any recursion limit
+        rows, cols = 100, 100
+        fdr = np.where(np.arange(rows)[:, None] % 2 == 0, 1, 16).repeat(cols, axis=1).astype('uint8')
+        fdr[0::2, -1] = 4
+        fdr[1::2, 0] = 4
+        fdr[-1, 0] = 0
+
+        mask, window = catchment.trace_catchment(fdr, rows - 1, 0)
+        self.assertEqual(mask.sum(), rows * cols)
+
+    def test_outside_window(self):
+        with self.assertRaises(ValueError):
+            catchment.trace_catchment(np.zeros((3, 3), dtype='uint8'), 3, 0)
+
+    def test_upstream_counts_match_brute_force(self):
+        rng = np.random.default_rng(7)
+        fdr = rng.choice(np.array(catchment.ESRI_DIRMAP + (0,), dtype='uint8'), size=(15, 20))
+        candidates = rng.choice(fdr.size, size=30, replace=False)
+
+        counts = catchment.upstream_counts(fdr, candidates)
+        for cell, count in zip(candidates, counts):
+            self.assertEqual(count, brute_force_catchment(fdr, *divmod(int(cell), 20)).sum())
+
+    def test_snap_to_stream(self):
+
+        #hillslopes drain east into a stream in column 6, which drains south
+        fdr = np.ones((20, 12), dtype='uint8')
+        fdr[:, 6] = 4
+        fdr[:, 7:] = 16
+
+        self.assertEqual(catchment.snap_to_stream(fdr, 15, 3, threshold=50, radius=4), (15, 6))
+        with self.assertLogs(catchment.logger, 'WARNING'):
+            self.assertEqual(catchment.snap_to_stream(fdr, 15, 3, threshold=50, radius=2), (15, 3))
+        self.assertEqual(catchment.snap_to_stream(fdr, 2, 6, threshold=50, radius=3), (4, 6))
+
+    def test_snap_radius(self):
+
+        #one stream in column 0 draining south, everything else drains west into it
+        fdr = np.full((40, 40), 16, dtype='uint8')
+        fdr[:, 0] = 4
+
+        #the default radius reaches a stream SNAP_RADIUS cells away and no further
+        self.assertEqual(catchment.snap_to_stream(fdr, 30, catchment.SNAP_RADIUS, threshold=50), (30, 0))
+        with self.assertLogs(catchment.logger, 'WARNING'):
+            self.assertEqual(catchment.snap_to_stream(fdr, 30, catchment.SNAP_RADIUS + 1, threshold=50), (30, catchment.SNAP_RADIUS + 1))
+
+    def test_cell_index_and_window_transform(self):
+        transform = (1000.0, 30.0, 0.0, 5000.0, 0.0, -30.0)
+        self.assertEqual(catchment.cell_index(transform, 1000.0 + 30 * 4, 5000.0 - 30 * 2), (2, 4))
+        self.assertEqual(catchment.window_transform(transform, (2, 5, 4, 9)), (1120.0, 30.0, 0.0, 4940.0, 0.0, -30.0))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+import huc_graph # The code to test
+import unittest
+
+class huc_graph_tests(unittest.TestCase):
+
+    def setUp(self):
+
+        #a -> c, b -> c, c -> d, e is disconnected. each huc also holds its own outlet junction
+        hucsByJunction = {'1': ['a'], '2': ['b'], '3': ['c'], '4': ['d'], '5': ['e']}
+        directUpstream = {
+            'a': ['a'],
+            'b': ['b'],
+            'c': ['a', 'b', 'c'],
+            'd': ['c', 'd'],
+            'e': ['e']
+        }
+        self.graph = huc_graph.HucGraph(list(hucsByJunction), None, hucsByJunction, directUpstream)
+
+    def test_upstream_closure(self):
+        self.assertEqual(set(self.graph.upstream_of('d')), {'a', 'b', 'c', 'd'})
+        self.assertEqual(set(self.graph.upstream_of('a')), {'a'})
+
+    def test_upstream_hucs_from_junctions(self):
+        self.assertEqual(set(self.graph.upstream_hucs(['3', '5'])), {'a', 'b', 'c', 'e'})
+        self.assertEqual(self.graph.upstream_hucs(['99']), [])
+
+    def test_closure_reused(self):
+        self.graph.upstream_of('c')
+        self.graph.directUpstream['c'] = []
+        self.assertEqual(set(self.graph.upstream_of('d')), {'a', 'b', 'c', 'd'})
+
+    def test_long_chain_has_no_recursion_limit(self):
+        directUpstream = {str(i): [str(i - 1)] for i in range(1, 20000)}
+        graph = huc_graph.HucGraph([], None, {'x': ['19999']}, directUpstream)
+        self.assertEqual(len(graph.upstream_hucs(['x'])), 20000)
+
+    def test_normalize_id(self):
+        self.assertEqual(huc_graph.normalize_id('12.0'), '12')
+        self.assertEqual(huc_graph.normalize_id(' 12 '), '12')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+import jobs # The code to test
+import unittest
+import results
+import json
+import time
+import sys
+import os
+
+class stub_cache(results.ResultCache):
+
+    #skip the catalog and the real delineation, lat picks what the worker does
+    def __init__(self, catalog):
+        self.catalog = catalog
+
+    def lookup(self, lat, lng, region, format='geojson'):
+        if lat == 1:
+            raise ValueError('no stream near point')
+        if lat == 2:
+            sys.exit(1)
+        return json.dumps({'pid': os.getpid(), 'lat': lat}).encode('utf-8'), {'cached': True}
+
+class split_queue(jobs.JobQueue):
+
+    #region names stand in for the global stream test
+    def classify(self, lat, lng, region):
+        return 'slow' if region == 'slow' else 'fast'
+
+def wait_for(jobQueue, jobId, timeout=30):
+
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = jobQueue.status(jobId)
+        if job['status'] in jobs.FINISHED_STATES:
+            return job
+        time.sleep(0.05)
+    raise AssertionError('job %s did not finish: %s' % (jobId, jobQueue.status(jobId)))
+
+class job_state_tests(unittest.TestCase):
+
+    #no workers are started, messages are fed straight to update
+    def setUp(self):
+        self.jobQueue = jobs.JobQueue('data/', fast_workers=0, slow_workers=0)
+        self.jobQueue.jobs['a'] = {'id': 'a', 'status': 'queued', 'queue': 'fast', 'submitted': time.time()}
+
+    def test_running_then_done(self):
+        self.jobQueue.update('a', 'running', 123)
+        self.assertEqual(self.jobQueue.status('a')['pid'], 123)
+
+        self.jobQueue.update('a', 'done', ('{"area": 1}', {'cached': True}))
+        job = self.jobQueue.status('a')
+        self.assertEqual(job['status'], 'done')
+        self.assertEqual(job['result'].to_json(), '{"area": 1}')
+        self.assertNotIn('pid', job)
+
+    def test_finished_jobs_are_not_changed(self):
+        self.jobQueue.update('a', 'running', 123)
+        self.jobQueue.update('a', 'done', ('{"area": 1}', {'cached': True}))
+
+        #the worker was reaped after its result was read
+        self.jobQueue.fail_running(123)
+        self.assertEqual(self.jobQueue.status('a')['status'], 'done')
+
+        self.jobQueue.update('a', 'error', 'late message')
+        self.assertEqual(self.jobQueue.status('a')['status'], 'done')
+
+    def test_late_result_does_not_replace_failure(self):
+        self.jobQueue.update('a', 'running', 123)
+        self.jobQueue.fail_running(123)
+        self.jobQueue.update('a', 'done', ('{"area": 1}', {'cached': True}))
+
+        job = self.jobQueue.status('a')
+        self.assertEqual(job['status'], 'error')
+        self.assertNotIn('result', job)
+
+    def test_prune_drops_old_finished_jobs(self):
+        self.jobQueue.jobs['b'] = {'id': 'b', 'status': 'done', 'finished': time.time() - jobs.FINISHED_JOB_TTL - 1}
+        self.jobQueue.jobs['c'] = {'id': 'c', 'status': 'done', 'finished': time.time()}
+        self.jobQueue.prune()
+
+        self.assertEqual(sorted(self.jobQueue.jobs), ['a', 'c'])
+
+    def test_unknown_job(self):
+        self.assertIsNone(self.jobQueue.status('missing'))
+        self.jobQueue.update('missing', 'running', 123)
+        self.assertIsNone(self.jobQueue.status('missing'))
+
+class job_queue_tests(unittest.TestCase):
+
+    #real worker processes, each recycled after two jobs
+    def setUp(self):
+        self.jobQueue = split_queue('data/', fast_workers=1, slow_workers=1, max_jobs=2, cache_class=stub_cache)
+
+    def tearDown(self):
+        self.jobQueue.stop()
+
+    def submit(self, lat, region='fast'):
+        return self.jobQueue.submit(lat, -73.0, region)['id']
+
+    def test_fast_and_slow_queues(self):
+        fast = self.jobQueue.submit(44.0, -73.0, 'fast')
+        slow = self.jobQueue.submit(44.0, -73.0, 'slow')
+        self.assertEqual((fast['status'], fast['queue']), ('queued', 'fast'))
+        self.assertEqual(slow['queue'], 'slow')
+
+        self.assertEqual(wait_for(self.jobQueue, fast['id'])['status'], 'done')
+        self.assertEqual(wait_for(self.jobQueue, slow['id'])['status'], 'done')
+
+    def test_results_and_errors(self):
+        done = self.submit(44.0)
+        failed = self.submit(1)
+
+        job = wait_for(self.jobQueue, done)
+        self.assertEqual(json.loads(job['result'].to_json())['lat'], 44.0)
+        self.assertIn('started', job)
+
+        job = wait_for(self.jobQueue, failed)
+        self.assertEqual((job['status'], job['error']), ('error', 'no stream near point'))
+
+    def test_workers_are_recycled(self):
+        ids = [self.submit(44.0 + i) for i in range(5)]
+        pids = [json.loads(wait_for(self.jobQueue, jobId)['result'].to_json())['pid'] for jobId in ids]
+
+        #one fast worker taking two jobs at a time
+        self.assertEqual(len(set(pids)), 3)
+        self.assertEqual(pids[0], pids[1])
+        self.assertNotEqual(pids[1], pids[2])
+
+    def test_crashed_worker(self):
+        crashed = self.submit(2)
+        job = wait_for(self.jobQueue, crashed)
+        self.assertEqual((job['status'], job['error']), ('error', 'worker exited while running this job'))
+
+        #the pool replaced the worker and keeps taking jobs
+        self.assertEqual(wait_for(self.jobQueue, self.submit(44.0))['status'], 'done')
+
+if __name__ == '__main__':
+    unittest.main()
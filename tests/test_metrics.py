@@ -0,0 +1,71 @@
+import metrics # The code to test
+import unittest
+
+class fake_geometry:
+
+    #just enough of an ogr geometry for count_vertices
+    def __init__(self, parts=(), points=0):
+        self.parts = parts
+        self.points = points
+
+    def GetGeometryCount(self):
+        return len(self.parts)
+
+    def GetGeometryRef(self, i):
+        return self.parts[i]
+
+    def GetPointCount(self):
+        return self.points
+
+class metrics_tests(unittest.TestCase):
+
+    def test_stage_times_accumulate(self):
+        requestMetrics = metrics.Metrics()
+        with requestMetrics.stage('geom_to_geojson'):
+            pass
+        with requestMetrics.stage('geom_to_geojson'):
+            pass
+        requestMetrics.add('cellsRead', 10)
+        requestMetrics.add('cellsRead')
+
+        result = requestMetrics.as_dict()
+        self.assertEqual(list(result['timings']), ['geom_to_geojson'])
+        self.assertGreaterEqual(result['timings']['geom_to_geojson'], 0.0)
+        self.assertEqual(result['counts'], {'cellsRead': 11})
+
+    def test_stage_recorded_on_error(self):
+        requestMetrics = metrics.Metrics()
+        with self.assertRaises(ValueError):
+            with requestMetrics.stage('split_catchment'):
+                raise ValueError('outside')
+        self.assertIn('split_catchment', requestMetrics.timings)
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = metrics.Histogram((1, 10))
+        for value in (0.5, 5, 5, 50):
+            histogram.observe(value)
+
+        result = histogram.as_dict()
+        self.assertEqual(result['buckets'], {'1': 1, '10': 3, '+Inf': 4})
+        self.assertEqual((result['count'], result['min'], result['max']), (4, 0.5, 50))
+
+    def test_registry_groups_by_classification(self):
+        registry = metrics.MetricsRegistry()
+        registry.observe({'classification': 'global', 'timings': {'total': 2.0}, 'counts': {'upstreamHucs': 3}})
+        registry.observe({'classification': 'local', 'timings': {'total': 0.1}, 'counts': {}})
+        registry.cache_hit()
+
+        snapshot = registry.snapshot()
+        self.assertEqual(snapshot['requests'], {'global': 1, 'local': 1})
+        self.assertEqual(snapshot['cacheHits'], 1)
+        self.assertEqual(snapshot['stages']['total']['global']['count'], 1)
+        self.assertEqual(snapshot['counts']['upstreamHucs']['global']['sum'], 3)
+
+    def test_count_vertices(self):
+        ring = fake_geometry(points=5)
+        multipolygon = fake_geometry(parts=(fake_geometry(parts=(ring, ring)), fake_geometry(parts=(ring,))))
+        self.assertEqual(metrics.count_vertices(multipolygon), 15)
+        self.assertEqual(metrics.count_vertices(None), 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import nldi_cache # The code to test
+import nldi_client
+import unittest
+
+from cache import TieredCache, LRUCache
+
+SQUARE = {'type': 'Polygon', 'coordinates': [[[0, 0], [1, 0], [1, 1], [0, 1], [0, 0]]]}
+
+class fake_client(nldi_client.NLDIClient):
+
+    #answers every request with the unit square, or 304 when the ETag matches
+    def __init__(self):
+        nldi_client.NLDIClient.__init__(self, 'http://nldi/comid/', 'http://nldi/ows')
+        self.calls = []
+        self.etag = '"v1"'
+
+    def fetch(self, url, params, etag=None):
+        self.calls.append((url, etag))
+        if etag is not None and etag == self.etag:
+            return None, etag
+        return {'features': [{'properties': {'featureid': 22294818}, 'geometry': SQUARE}]}, self.etag
+
+class counting_cache(TieredCache):
+
+    def __init__(self):
+        TieredCache.__init__(self, LRUCache())
+        self.puts = []
+
+    def put(self, key, value):
+        self.puts.append(key)
+        TieredCache.put(self, key, value)
+
+class clock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+class nldi_cache_tests(unittest.TestCase):
+
+    def setUp(self):
+        self.client = fake_client()
+        self.clock = clock()
+        self.nldi = nldi_cache.CachedNLDI(self.client, TieredCache(LRUCache()), ttl=60, clock=self.clock)
+
+    def tearDown(self):
+        self.client.close()
+
+    def test_entry_round_trip(self):
+        header = {'fetchedAt': 1.0, 'etag': None, 'properties': {'featureid': 1}}
+        self.assertEqual(nldi_cache.unpack_entry(nldi_cache.pack_entry(header, b'\x01\x02')), (header, b'\x01\x02'))
+
+    def test_nearby_points_share_a_catchment(self):
+        properties, geom = self.nldi.catchment_at(0.25, 0.25)
+        self.assertEqual(properties['featureid'], 22294818)
+        self.assertAlmostEqual(geom.GetArea(), 1.0)
+
+        properties, geom = self.nldi.catchment_at(0.75, 0.5)
+        self.assertEqual(properties['featureid'], 22294818)
+        self.assertEqual(len(self.client.calls), 1)
+        self.assertEqual((self.nldi.hits, self.nldi.misses), (1, 1))
+
+    def test_point_key_written_once(self):
+        cache = counting_cache()
+        nldi = nldi_cache.CachedNLDI(self.client, cache, ttl=60, clock=self.clock)
+        nldi.catchment_at(0.25, 0.25)
+        puts = len(cache.puts)
+
+        #repeat hits on the same point leave the cache alone, a new point inside the catchment adds its key
+        nldi.catchment_at(0.25, 0.25)
+        nldi.catchment_at(0.25, 0.25)
+        self.assertEqual(len(cache.puts), puts)
+        nldi.catchment_at(0.75, 0.5)
+        self.assertEqual(len(cache.puts), puts + 1)
+        self.assertEqual(len(self.client.calls), 1)
+
+    def test_basin_cached_by_comid(self):
+        self.assertAlmostEqual(self.nldi.basin('22294818').GetArea(), 1.0)
+        self.assertAlmostEqual(self.nldi.basin('22294818').GetArea(), 1.0)
+        self.assertEqual(len(self.client.calls), 1)
+
+    def test_stale_entries_are_revalidated(self):
+        self.nldi.basin('22294818')
+        self.clock.now += 120
+        self.assertAlmostEqual(self.nldi.basin('22294818').GetArea(), 1.0)
+        self.assertEqual(self.client.calls[-1], ('http://nldi/comid/22294818/basin', '"v1"'))
+
+        #the 304 restarted the entry's ttl
+        self.nldi.basin('22294818')
+        self.assertEqual(len(self.client.calls), 2)
+
+    def test_returned_geometries_are_copies(self):
+        geom = self.nldi.basin('22294818')
+        geom.AddGeometry(geom.GetGeometryRef(0).Clone())
+        self.assertEqual(self.nldi.basin('22294818').GetGeometryCount(), 1)
+
+if __name__ == '__main__':
+    unittest.main()
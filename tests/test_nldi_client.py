@@ -0,0 +1,104 @@
+import nldi_client # The code to test
+import unittest
+import threading
+import json
+import time
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+class stub_nldi(BaseHTTPRequestHandler):
+
+    #geoserver at /ows, nldi comid routes under /comid/
+    failures = {}
+    delay = 0.0
+    requests = []
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        stub_nldi.requests.append(url.path)
+
+        if stub_nldi.failures.get(url.path, 0) > 0:
+            stub_nldi.failures[url.path] -= 1
+            return self.send_json(503, {})
+
+        square = {'type': 'Polygon', 'coordinates': [[[0, 0], [1, 0], [1, 1], [0, 1], [0, 0]]]}
+        if url.path == '/ows':
+            if 'POINT(5' in query['CQL_FILTER'][0]:
+                return self.send_json(200, {'features': []})
+            return self.send_json(200, {'features': [{'properties': {'featureid': 22294818}, 'geometry': square}]})
+        if url.path == '/comid/position':
+            return self.send_json(200, {'features': [{'properties': {'identifier': '22294818'}}]})
+        if url.path.endswith('/basin'):
+            time.sleep(stub_nldi.delay)
+            return self.send_json(200, {'features': [{'properties': {}, 'geometry': square}]})
+        self.send_json(404, {})
+
+class nldi_client_tests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), stub_nldi)
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+        cls.base = 'http://127.0.0.1:%s' % cls.server.server_address[1]
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        stub_nldi.failures = {}
+        stub_nldi.delay = 0.0
+        stub_nldi.requests = []
+        session = nldi_client.make_session(backoff=0)
+        self.client = nldi_client.NLDIClient(self.base + '/comid/', self.base + '/ows', session=session, timeout=(1, 2))
+
+    def tearDown(self):
+        self.client.close()
+
+    def test_catchment_and_basin(self):
+        feature = self.client.catchment_at(-73.74586, 44.00683)
+        self.assertEqual(feature['properties']['featureid'], 22294818)
+        self.assertEqual(self.client.position(-73.74586, 44.00683)['properties']['identifier'], '22294818')
+        self.assertEqual(self.client.basin('22294818')['geometry']['type'], 'Polygon')
+
+    def test_retries_transient_errors(self):
+        stub_nldi.failures = {'/comid/22294818/basin': 2}
+        self.assertEqual(self.client.basin('22294818')['geometry']['type'], 'Polygon')
+        self.assertEqual(stub_nldi.requests.count('/comid/22294818/basin'), 3)
+
+    def test_gives_up_after_bounded_retries(self):
+        stub_nldi.failures = {'/comid/22294818/basin': nldi_client.MAX_RETRIES + 5}
+        with self.assertRaises(nldi_client.NLDIError):
+            self.client.basin('22294818')
+        self.assertEqual(stub_nldi.requests.count('/comid/22294818/basin'), nldi_client.MAX_RETRIES + 1)
+
+    def test_no_catchment_found(self):
+        with self.assertRaises(nldi_client.NLDIError):
+            self.client.catchment_at(5.0, 5.0)
+
+    def test_basin_async_overlaps_other_work(self):
+        stub_nldi.delay = 0.3
+        timeBefore = time.perf_counter()
+        future = self.client.basin_async('22294818')
+        time.sleep(0.3)
+        feature = future.result()
+        self.assertEqual(feature['geometry']['type'], 'Polygon')
+        self.assertLess(time.perf_counter() - timeBefore, 0.55)
+
+if __name__ == '__main__':
+    unittest.main()
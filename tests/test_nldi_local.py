@@ -0,0 +1,144 @@
+import nldi_local # The code to test
+import unittest
+import tempfile
+
+from unittest import mock
+from osgeo import ogr, osr
+
+#     1   2
+#      \ /
+#   4   3
+#    \ /
+#     5 -> outlet
+FLOW = ((1, 3), (2, 3), (3, 5), (4, 5), (5, 0))
+
+class fake_flow_layer:
+
+    #just enough of an ogr layer for FlowTable.from_layer
+    def __init__(self, rows):
+        self.rows = rows
+
+    def ResetReading(self):
+        pass
+
+    def GetLayerDefn(self):
+        return self
+
+    def GetFieldIndex(self, name):
+        return [nldi_local.FLOW_LAYER_ID, nldi_local.FLOW_LAYER_TO_ID].index(name)
+
+    def __iter__(self):
+        return iter(fake_flow_row(row) for row in self.rows)
+
+class fake_flow_row:
+
+    def __init__(self, row):
+        self.row = row
+
+    def GetFieldAsInteger64(self, i):
+        return self.row[i]
+
+class flow_table_tests(unittest.TestCase):
+
+    def setUp(self):
+        self.flow = nldi_local.FlowTable([comid for comid, tocomid in FLOW], [tocomid for comid, tocomid in FLOW])
+
+    def test_upstream(self):
+        self.assertEqual(sorted(self.flow.upstream(3).tolist()), [1, 2])
+        self.assertEqual(sorted(self.flow.upstream([3, 5]).tolist()), [1, 2, 3, 4])
+        self.assertEqual(len(self.flow.upstream(1)), 0)
+
+    def test_all_upstream(self):
+        self.assertEqual(self.flow.all_upstream(5).tolist(), [1, 2, 3, 4, 5])
+        self.assertEqual(self.flow.all_upstream(3).tolist(), [1, 2, 3])
+
+    def test_headwaters_first(self):
+        order = self.flow.headwaters_first()
+        self.assertEqual(sorted(order), [1, 2, 3, 4, 5])
+        for comid, tocomid in FLOW:
+            if tocomid:
+                self.assertLess(order.index(comid), order.index(tocomid))
+
+    def test_loops_terminate(self):
+        flow = nldi_local.FlowTable([1, 2], [2, 1])
+        self.assertEqual(flow.all_upstream(1).tolist(), [1, 2])
+
+    def test_loops_left_out_of_order(self):
+
+        #2 and 3 drain into each other, 1 drains into the loop
+        flow = nldi_local.FlowTable([1, 2, 3, 4], [2, 3, 2, 0])
+        with self.assertLogs(nldi_local.logger, 'WARNING') as logs:
+            self.assertEqual(flow.headwaters_first(), [1, 4])
+        self.assertIn('[2, 3]', logs.output[0])
+
+    def test_duplicate_flow_rows_dropped(self):
+        layer = fake_flow_layer([(1, 3), (2, 3), (3, 5), (3, 4), (4, 5), (5, 0)])
+        with self.assertLogs(nldi_local.logger, 'WARNING'):
+            flow = nldi_local.FlowTable.from_layer(layer)
+
+        self.assertEqual(flow.comids.tolist(), [1, 2, 3, 4, 5])
+        self.assertEqual(flow.tocomids.tolist(), [3, 3, 5, 5, 0])
+        self.assertEqual(flow.headwaters_first()[-1], 5)
+
+class local_backend_tests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = self.tmp.name.replace('\\', '/') + '/'
+
+        #unit squares laid out west to east in comid order, in wgs84
+        wgs_ref = osr.SpatialReference()
+        wgs_ref.ImportFromEPSG(4326)
+        gpkg = ogr.GetDriverByName('GPKG').CreateDataSource(self.path + nldi_local.CATCHMENT_GPKG)
+        layer = gpkg.CreateLayer(nldi_local.CATCHMENT_LAYER, wgs_ref, ogr.wkbPolygon)
+        layer.CreateField(ogr.FieldDefn(nldi_local.CATCHMENT_LAYER_ID, ogr.OFTInteger64))
+        flowLayer = gpkg.CreateLayer(nldi_local.FLOW_LAYER, None, ogr.wkbNone)
+        flowLayer.CreateField(ogr.FieldDefn(nldi_local.FLOW_LAYER_ID, ogr.OFTInteger64))
+        flowLayer.CreateField(ogr.FieldDefn(nldi_local.FLOW_LAYER_TO_ID, ogr.OFTInteger64))
+
+        for comid, tocomid in FLOW:
+            feat = ogr.Feature(layer.GetLayerDefn())
+            feat.SetField(nldi_local.CATCHMENT_LAYER_ID, comid)
+            feat.SetGeometry(ogr.CreateGeometryFromWkt('POLYGON((%s 0, %s 0, %s 1, %s 1, %s 0))' % (comid, comid + 1, comid + 1, comid, comid)))
+            layer.CreateFeature(feat)
+
+            feat = ogr.Feature(flowLayer.GetLayerDefn())
+            feat.SetField(nldi_local.FLOW_LAYER_ID, comid)
+            feat.SetField(nldi_local.FLOW_LAYER_TO_ID, tocomid)
+            flowLayer.CreateFeature(feat)
+        feat = None
+        layer = None
+        flowLayer = None
+        gpkg = None
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_catchment_and_basin(self):
+        backend = nldi_local.LocalNLDI(self.path)
+        try:
+            properties, geom = backend.catchment_at(3.5, 0.5)
+            self.assertEqual(properties['featureid'], 3)
+            self.assertAlmostEqual(geom.GetArea(), 1.0)
+            self.assertEqual(backend.position(4.5, 0.5)['properties']['identifier'], '4')
+
+            self.assertAlmostEqual(backend.basin_async(3).result().GetArea(), 3.0)
+            self.assertIsNotNone(backend.stored_basin(3))
+        finally:
+            backend.close()
+
+    def test_build_basins(self):
+
+        #small chunks so basins carry over between catchment reads
+        with mock.patch.object(nldi_local, 'ID_CHUNK', 2):
+            self.assertEqual(nldi_local.build_basins(self.path), 5)
+
+        backend = nldi_local.LocalNLDI(self.path)
+        try:
+            self.assertAlmostEqual(backend.stored_basin(5).GetArea(), 5.0)
+            self.assertAlmostEqual(backend.stored_basin(4).GetArea(), 1.0)
+        finally:
+            backend.close()
+
+if __name__ == '__main__':
+    unittest.main()
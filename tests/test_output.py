@@ -0,0 +1,83 @@
+import output # The code to test
+import unittest
+import gzip
+import json
+
+class output_tests(unittest.TestCase):
+
+    def test_feature_json_and_dict_access(self):
+        feature = output.Feature('{ "type": "Point", "coordinates": [ -73.5, 44.0 ] }', 12.5)
+
+        self.assertEqual(json.loads(feature.to_json()), {'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': [-73.5, 44.0]}, 'properties': {'area': 12.5}})
+        self.assertEqual(feature['properties']['area'], 12.5)
+        self.assertEqual(feature['geometry']['coordinates'], [-73.5, 44.0])
+        self.assertIsNone(feature.get('id'))
+
+    def test_object_bytes_keeps_feature_text(self):
+        feature = output.Feature('{"type": "Point", "coordinates": [1, 2]}', 3.0)
+        body = output.object_bytes([('splitCatchment', feature), ('adjointCatchment', None), ('mergedCatchment', feature)])
+
+        self.assertIn(b'"splitCatchment": {"type": "Feature", "geometry": {"type": "Point", "coordinates": [1, 2]}', body)
+        self.assertIsNone(json.loads(body)['adjointCatchment'])
+
+    def test_add_member(self):
+        body = output.add_member(b'{"a": 1}', 'metrics', {'cached': True})
+        self.assertEqual(json.loads(body), {'a': 1, 'metrics': {'cached': True}})
+        self.assertEqual(json.loads(output.add_member(b'{}', 'b', output.RawJSON('[1]'))), {'b': [1]})
+
+    def square(self, x0, y0, size, area):
+        ring = [[x0, y0], [x0 + size, y0], [x0 + size, y0 + size], [x0, y0 + size], [x0, y0]]
+        return output.Feature(json.dumps({'type': 'Polygon', 'coordinates': [ring]}), area)
+
+    def decode(self, topology, arcIndexes):
+
+        #rebuild a ring's coordinates from arc indexes, like a topojson client would
+        scale, translate = topology['transform']['scale'], topology['transform']['translate']
+        ring = []
+        for index in arcIndexes:
+            x = y = 0
+            points = []
+            for dx, dy in topology['arcs'][index if index >= 0 else ~index]:
+                x, y = x + dx, y + dy
+                points.append((x * scale[0] + translate[0], y * scale[1] + translate[1]))
+            if index < 0:
+                points.reverse()
+            ring.extend(points[1:] if ring else points)
+        return ring
+
+    def test_shared_edge_stored_once(self):
+        left = self.square(0, 0, 1, 1.0)
+        right = self.square(1, 0, 1, 1.0)
+        topology = output.topology([('left', left), ('right', right), ('missing', None)], 1001)
+
+        #shared edge plus one arc for the rest of each square
+        self.assertEqual(len(topology['arcs']), 3)
+        self.assertEqual(set(topology['objects']), {'left', 'right'})
+
+        ring = self.decode(topology, topology['objects']['right']['arcs'][0])
+        self.assertEqual(ring[0], ring[-1])
+        self.assertEqual({(round(x, 6), round(y, 6)) for x, y in ring}, {(1, 0), (2, 0), (2, 1), (1, 1)})
+
+    def test_identical_features_share_every_arc(self):
+        split = self.square(0, 0, 1, 1.0)
+        topology = output.topology([('splitCatchment', split), ('mergedCatchment', split)])
+        self.assertEqual(len(topology['arcs']), 1)
+        self.assertEqual(topology['objects']['splitCatchment']['arcs'], topology['objects']['mergedCatchment']['arcs'])
+
+    def test_encode_topojson_keeps_metrics(self):
+        body = output.encode([('splitCatchment', self.square(0, 0, 1, 1.0)), ('adjointCatchment', None), ('metrics', {'cached': True})], 'topojson')
+        document = json.loads(body)
+        self.assertEqual(document['type'], 'Topology')
+        self.assertEqual(document['metrics'], {'cached': True})
+
+    def test_compress_negotiation(self):
+        body = b'{"a": 1}' * 1000
+        compressed, encoding = output.compress(body, 'gzip;q=1.0, identity;q=0.5')
+        self.assertEqual(encoding, 'gzip')
+        self.assertEqual(gzip.decompress(compressed), body)
+
+        self.assertEqual(output.compress(body, 'gzip;q=0'), (body, None))
+        self.assertEqual(output.compress(b'{}', 'gzip'), (b'{}', None))
+
+if __name__ == '__main__':
+    unittest.main()
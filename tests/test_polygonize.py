@@ -0,0 +1,32 @@
+import polygonize # The code to test
+import unittest
+import numpy as np
+
+class polygonize_tests(unittest.TestCase):
+
+    def setUp(self):
+        self.transform = (1000.0, 30.0, 0.0, 5000.0, 0.0, -30.0)
+
+        #an L shaped catchment plus a single cell only touching it on a corner
+        self.mask = np.zeros((20, 30), dtype=bool)
+        self.mask[2:18, 3:8] = True
+        self.mask[14:18, 8:25] = True
+        self.mask[1, 2] = True
+
+    def test_area_matches_cells(self):
+        geom = polygonize.mask_to_geometry(self.mask, self.transform)
+        self.assertAlmostEqual(geom.GetArea(), self.mask.sum() * 30 * 30)
+
+    def test_tiles_are_merged(self):
+        whole = polygonize.mask_to_geometry(self.mask, self.transform)
+        tiled = polygonize.mask_to_geometry(self.mask, self.transform, tile_size=4)
+
+        self.assertAlmostEqual(tiled.GetArea(), whole.GetArea())
+        self.assertTrue(tiled.Equals(whole) or tiled.SymDifference(whole).GetArea() < 1e-6)
+
+    def test_empty_mask(self):
+        geom = polygonize.mask_to_geometry(np.zeros((5, 5), dtype=bool), self.transform)
+        self.assertTrue(geom.IsEmpty())
+
+if __name__ == '__main__':
+    unittest.main()
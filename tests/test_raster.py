@@ -0,0 +1,180 @@
+import raster # The code to test
+import unittest
+import tempfile
+import json
+import os
+import numpy as np
+from osgeo import gdal
+
+class raster_sampler_tests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'str.tif')
+
+        #100x80 grid of 30m cells with 16x16 blocks, value = row * 1000 + col
+        ds = gdal.GetDriverByName('GTiff').Create(self.path, 100, 80, 1, gdal.GDT_Int32, options=['TILED=YES', 'BLOCKXSIZE=16', 'BLOCKYSIZE=16'])
+        ds.SetGeoTransform((1000.0, 30.0, 0.0, 5000.0, 0.0, -30.0))
+        rows, cols = np.mgrid[0:80, 0:100]
+        ds.GetRasterBand(1).WriteArray((rows * 1000 + cols).astype('int32'))
+        ds = None
+
+        self.sampler = raster.RasterSampler(self.path)
+
+    def tearDown(self):
+        self.sampler.close()
+        self.tmp.cleanup()
+
+    def test_sample_snaps_to_top_left(self):
+        value, outX, outY = self.sampler.sample(1000.0 + 30 * 7 + 12, 5000.0 - 30 * 3 - 4)
+
+        self.assertEqual(value, 3007)
+        self.assertEqual((outX, outY), (1000.0 + 30 * 7, 5000.0 - 30 * 3))
+
+    def test_sample_outside(self):
+        value, outX, outY = self.sampler.sample(900.0, 5000.0)
+        self.assertIsNone(value)
+
+    def test_sample_many_matches_sample(self):
+        xs = np.array([1005.0, 1000.0 + 30 * 99 + 1, 1000.0 + 30 * 40 + 15, 500.0])
+        ys = np.array([4995.0, 5000.0 - 30 * 79 - 1, 5000.0 - 30 * 33 - 15, 4000.0])
+
+        values, outX, outY = self.sampler.sample_many(xs, ys)
+
+        self.assertEqual(values[:3].tolist(), [0, 79099, 33040])
+        self.assertTrue(values.mask[3])
+        for i in range(3):
+            self.assertEqual(self.sampler.sample(xs[i], ys[i])[1:], (outX[i], outY[i]))
+
+    def test_read_window_snaps_to_cells(self):
+        data, transform = self.sampler.read_window(1000.0 + 30 * 2 + 5, 1000.0 + 30 * 5 + 1, 5000.0 - 30 * 4 - 2, 5000.0 - 30 * 1 - 10)
+
+        self.assertEqual(data.shape, (4, 4))
+        self.assertEqual(data[0][0], 1002)
+        self.assertEqual(transform, (1000.0 + 30 * 2, 30.0, 0.0, 5000.0 - 30 * 1, 0.0, -30.0))
+
+    def test_read_window_clamped(self):
+        data, transform = self.sampler.read_window(0.0, 1000.0 + 30 * 3, 4000.0, 6000.0)
+
+        self.assertEqual(data.shape, (34, 3))
+        self.assertEqual(transform[0], 1000.0)
+        self.assertEqual(transform[3], 5000.0)
+
+class array_sampler_tests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'str.npy')
+
+        #same grid as above, stored the way preprocess.py writes the array store
+        rows, cols = np.mgrid[0:80, 0:100]
+        np.save(self.path, (rows * 1000 + cols).astype('int32'))
+        header = {'geoTransform': [1000.0, 30.0, 0.0, 5000.0, 0.0, -30.0], 'projection': '', 'nodata': 79099}
+
+        self.sampler = raster.ArraySampler(self.path, header)
+
+    def tearDown(self):
+        self.sampler.close()
+        self.tmp.cleanup()
+
+    def test_sample_snaps_to_top_left(self):
+        value, outX, outY = self.sampler.sample(1000.0 + 30 * 7 + 12, 5000.0 - 30 * 3 - 4)
+
+        self.assertEqual(value, 3007)
+        self.assertEqual((outX, outY), (1000.0 + 30 * 7, 5000.0 - 30 * 3))
+        self.assertIsNone(self.sampler.sample(900.0, 5000.0)[0])
+
+    def test_read_window_is_a_view(self):
+        data, transform = self.sampler.read_window(1000.0 + 30 * 2 + 5, 1000.0 + 30 * 5 + 1, 5000.0 - 30 * 4 - 2, 5000.0 - 30 * 1 - 10)
+
+        self.assertEqual(data.shape, (4, 4))
+        self.assertEqual(data[0][0], 1002)
+        self.assertEqual(transform, (1000.0 + 30 * 2, 30.0, 0.0, 5000.0 - 30 * 1, 0.0, -30.0))
+        self.assertTrue(np.shares_memory(data, self.sampler.array))
+        self.assertFalse(data.flags.writeable)
+
+    def test_sample_many_masks_nodata(self):
+        xs = np.array([1005.0, 1000.0 + 30 * 99 + 1, 1000.0 + 30 * 40 + 15, 500.0])
+        ys = np.array([4995.0, 5000.0 - 30 * 79 - 1, 5000.0 - 30 * 33 - 15, 4000.0])
+        values, outX, outY = self.sampler.sample_many(xs, ys)
+
+        self.assertEqual(values.mask.tolist(), [False, True, False, True])
+        self.assertEqual((values[0], values[2]), (0, 33040))
+
+class tile_store_tests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = self.tmp.name.replace('\\', '/') + '/'
+
+        #a big tile with a smaller one overlapping its corner
+        tiles = []
+        for name, origin, size, value in (('big.tif', (0.0, 3000.0), 100, 1), ('small.tif', (0.0, 3000.0), 10, 2)):
+            ds = gdal.GetDriverByName('GTiff').Create(self.path + name, size, size, 1, gdal.GDT_Byte, options=['TILED=YES'])
+            ds.SetGeoTransform((origin[0], 30.0, 0.0, origin[1], 0.0, -30.0))
+            ds.GetRasterBand(1).Fill(value)
+            ds = None
+            tiles.append({'file': name, 'extent': [origin[0], origin[0] + 30.0 * size, origin[1] - 30.0 * size, origin[1]]})
+        with open(self.path + raster.TILE_INDEX_NAME, 'w') as f:
+            json.dump({'projection': '', 'tiles': tiles}, f)
+
+        self.store = raster.load_tile_store(self.path)
+
+    def tearDown(self):
+        self.store.close()
+        self.tmp.cleanup()
+
+    def test_smallest_tile_wins(self):
+        self.assertEqual(self.store.sampler_at(15.0, 2985.0).path, self.path + 'small.tif')
+        self.assertEqual(self.store.sampler_at(1500.0, 1500.0).path, self.path + 'big.tif')
+        self.assertIsNone(self.store.sampler_at(-15.0, 1500.0))
+
+    def test_window_read_without_warp(self):
+        data, transform = self.store.sampler_at(1500.0, 1500.0).read_window(1500.0, 1620.0, 1380.0, 1500.0)
+        self.assertEqual(data.shape, (4, 4))
+        self.assertEqual(transform, (1500.0, 30.0, 0.0, 1500.0, 0.0, -30.0))
+
+    def test_missing_store(self):
+        self.assertIsNone(raster.load_tile_store(self.path + 'missing/'))
+
+class tile_edge_tests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = self.tmp.name.replace('\\', '/') + '/'
+
+        #two 10x10 tiles side by side, value = tile number * 100 + row * 10 + col
+        tiles = []
+        for i, name in enumerate(('west.tif', 'east.tif')):
+            ds = gdal.GetDriverByName('GTiff').Create(self.path + name, 10, 10, 1, gdal.GDT_Int32)
+            ds.SetGeoTransform((300.0 * i, 30.0, 0.0, 300.0, 0.0, -30.0))
+            rows, cols = np.mgrid[0:10, 0:10]
+            ds.GetRasterBand(1).WriteArray((i * 100 + rows * 10 + cols).astype('int32'))
+            ds = None
+            tiles.append({'file': name, 'extent': [300.0 * i, 300.0 * (i + 1), 0.0, 300.0]})
+        with open(self.path + raster.TILE_INDEX_NAME, 'w') as f:
+            json.dump({'projection': '', 'tiles': tiles}, f)
+
+        self.store = raster.load_tile_store(self.path)
+
+    def tearDown(self):
+        self.store.close()
+        self.tmp.cleanup()
+
+    def test_window_inside_one_tile(self):
+        data, transform = self.store.read_window(45.0, 255.0, 30.0, 90.0, 210.0, 270.0)
+        self.assertEqual(data.tolist(), [[11, 12], [21, 22]])
+        self.assertEqual(transform, (30.0, 30.0, 0.0, 270.0, 0.0, -30.0))
+
+    def test_window_across_tiles(self):
+
+        #clicked in the west tile, the catchment reaches two cells into the east one
+        data, transform = self.store.read_window(255.0, 255.0, 240.0, 360.0, 210.0, 270.0)
+        self.assertEqual(data.tolist(), [[18, 19, 110, 111], [28, 29, 120, 121]])
+        self.assertEqual(transform, (240.0, 30.0, 0.0, 270.0, 0.0, -30.0))
+
+    def test_click_outside_every_tile(self):
+        self.assertIsNone(self.store.read_window(-15.0, 150.0, -30.0, 30.0, 120.0, 180.0))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+import results # The code to test
+import unittest
+import threading
+import tempfile
+import catalog
+import cache
+import json
+import os
+
+class counting_cache(results.ResultCache):
+
+    #skip the catalog and the real delineation, count how often a cell is computed
+    def __init__(self):
+        results.ResultCache.__init__(self, None, cache.TieredCache(cache.LRUCache()))
+        self.runs = 0
+        self.release = threading.Event()
+
+    def key(self, lat, lng, region, format='geojson'):
+        return cache.cache_key(format, region, round(lat, 2), round(lng, 2))
+
+    def run(self, lat, lng, region, format='geojson'):
+        self.runs += 1
+        self.release.wait(5)
+        return b'{"mergedCatchment": {"properties": {"area": 1.0}}}', {'classification': 'local', 'timings': {}, 'counts': {}, 'cached': False}
+
+class fake_sampler:
+    def cell(self, x, y):
+        return int(y), int(x)
+
+class fake_huc:
+
+    #versions read the way HucHandle reads them when it is opened
+    def __init__(self, localDataPath):
+        self.dataVersion = '1'
+        self.storeVersion = catalog.store_version(localDataPath)
+        self.str_sampler = fake_sampler()
+
+class fake_region:
+
+    def __init__(self, localDataPath):
+        self.localDataPath = localDataPath
+        self.dataVersion = '1'
+
+    def project(self, lng, lat):
+        return lng, lat
+
+    def huc_for_point(self, point):
+        return '0202'
+
+    def huc(self, hucName):
+
+        #a fresh handle each time, like the catalog after a restart
+        return fake_huc(self.localDataPath)
+
+class fake_catalog:
+
+    def __init__(self, localDataPath):
+        self.regionHandle = fake_region(localDataPath)
+
+    def region(self, region):
+        return self.regionHandle
+
+class versioned_cache(results.ResultCache):
+
+    #real keys from the catalog, counted runs instead of delineations
+    def __init__(self, catalog, cache):
+        results.ResultCache.__init__(self, catalog, cache)
+        self.runs = 0
+
+    def run(self, lat, lng, region, format='geojson'):
+        self.runs += 1
+        return b'{}', {'classification': 'local', 'timings': {}, 'counts': {}, 'cached': False}
+
+class result_cache_tests(unittest.TestCase):
+
+    def test_same_cell_served_from_cache(self):
+        resultCache = counting_cache()
+        resultCache.release.set()
+
+        first = resultCache.delineate(44.001, -73.001, 'ny')
+        second = resultCache.delineate(44.002, -73.002, 'ny')
+
+        self.assertEqual(first, second)
+        self.assertEqual(resultCache.runs, 1)
+
+    def test_concurrent_requests_share_one_run(self):
+        resultCache = counting_cache()
+        answers = []
+
+        threads = [threading.Thread(target=lambda: answers.append(resultCache.delineate(44.001, -73.001, 'ny'))) for i in range(5)]
+        for thread in threads:
+            thread.start()
+        resultCache.release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(answers), 5)
+        self.assertEqual(resultCache.runs, 1)
+        self.assertEqual(resultCache.inflight, {})
+
+    def test_metrics_spliced_into_body(self):
+        resultCache = counting_cache()
+        resultCache.release.set()
+
+        first = json.loads(resultCache.delineate(44.001, -73.001, 'ny', include_metrics=True))
+        second = json.loads(resultCache.delineate(44.001, -73.001, 'ny', include_metrics=True))
+
+        self.assertEqual(first['mergedCatchment'], {'properties': {'area': 1.0}})
+        self.assertEqual((first['metrics']['cached'], first['metrics']['classification']), (False, 'local'))
+        self.assertEqual(second['metrics'], {'cached': True})
+
+class result_key_tests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = self.tmp.name.replace('\\', '/') + '/'
+        for name in ('fdr', 'str', catalog.CATCHMENT_GRID_NAME):
+            with open(self.path + name, 'wb') as f:
+                f.write(b'grid')
+            os.utime(self.path + name, (1000000, 1000000))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_rebuilt_grid_misses(self):
+        resultCache = versioned_cache(fake_catalog(self.path), cache.TieredCache(cache.LRUCache()))
+        resultCache.lookup(44.5, -73.5, 'ny')
+        resultCache.lookup(44.5, -73.5, 'ny')
+        self.assertEqual(resultCache.runs, 1)
+
+        #preprocess.py rebuilt the GridID grid, the gdbs are untouched
+        os.utime(self.path + catalog.CATCHMENT_GRID_NAME, (1000100, 1000100))
+        resultCache.lookup(44.5, -73.5, 'ny')
+        self.assertEqual(resultCache.runs, 2)
+
+        #so did rebuilding the fdr grid
+        os.utime(self.path + 'fdr', (1000200, 1000200))
+        resultCache.lookup(44.5, -73.5, 'ny')
+        self.assertEqual(resultCache.runs, 3)
+
+if __name__ == '__main__':
+    unittest.main()
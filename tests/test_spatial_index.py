@@ -0,0 +1,75 @@
+import spatial_index # The code to test
+import unittest
+import threading
+import numpy as np
+
+from osgeo import ogr
+
+def square(x0, y0, size):
+    return ogr.CreateGeometryFromWkt('POLYGON((%s %s, %s %s, %s %s, %s %s, %s %s))' % (x0, y0, x0 + size, y0, x0 + size, y0 + size, x0, y0 + size, x0, y0))
+
+class str_tree_tests(unittest.TestCase):
+
+    def brute_force(self, envelopes, minX, maxX, minY, maxY):
+        return [i for i, (x0, x1, y0, y1) in enumerate(envelopes) if x0 <= maxX and x1 >= minX and y0 <= maxY and y1 >= minY]
+
+    def test_matches_brute_force(self):
+        rng = np.random.RandomState(7)
+        corners = rng.uniform(0, 1000, size=(500, 2))
+        sizes = rng.uniform(0, 50, size=(500, 2))
+        envelopes = np.column_stack((corners[:, 0], corners[:, 0] + sizes[:, 0], corners[:, 1], corners[:, 1] + sizes[:, 1]))
+        tree = spatial_index.STRtree(envelopes, capacity=4)
+
+        for x, y in rng.uniform(0, 1000, size=(200, 2)):
+            self.assertEqual(list(tree.query(x, x, y, y)), self.brute_force(envelopes, x, x, y, y))
+        for x, y in rng.uniform(0, 1000, size=(50, 2)):
+            self.assertEqual(list(tree.query(x - 30, x + 30, y - 30, y + 30)), self.brute_force(envelopes, x - 30, x + 30, y - 30, y + 30))
+
+    def test_small_and_empty_trees(self):
+        self.assertEqual(list(spatial_index.STRtree([]).query(0, 1, 0, 1)), [])
+        tree = spatial_index.STRtree([(0, 1, 0, 1)])
+        self.assertEqual(list(tree.query(0.5, 0.5, 0.5, 0.5)), [0])
+        self.assertEqual(list(tree.query(2, 3, 2, 3)), [])
+
+class feature_index_tests(unittest.TestCase):
+
+    def setUp(self):
+
+        #two overlapping squares and one off by itself
+        self.index = spatial_index.FeatureIndex([square(0, 0, 10), square(5, 0, 10), square(100, 100, 10)], ['a', 'b', 'c'])
+
+    def test_at_point(self):
+        self.assertEqual(self.index.at_point(2, 5), 0)
+        self.assertEqual(self.index.at_point(105, 105), 2)
+        self.assertIsNone(self.index.at_point(50, 50))
+
+        #the last matching feature wins where they overlap
+        self.assertEqual(self.index.at_point(7, 5), 1)
+
+    def test_near_point(self):
+        self.assertEqual(self.index.near_point(17, 5, 3), 1)
+        self.assertEqual(self.index.near_point(-1, 5, 2), 0)
+        self.assertIsNone(self.index.near_point(17, 5, 1))
+        self.assertIsNone(self.index.near_point(50, 50, 10))
+
+    def test_shared_between_threads(self):
+        rng = np.random.RandomState(3)
+        points = rng.uniform(-5, 115, size=(500, 2))
+        expected = [self.index.at_point(x, y) for x, y in points]
+
+        #a fresh index so the first prepared tests happen on several threads at once
+        index = spatial_index.FeatureIndex([square(0, 0, 10), square(5, 0, 10), square(100, 100, 10)], ['a', 'b', 'c'])
+        answers = [None] * 8
+        def run(i):
+            answers[i] = [index.at_point(x, y) for x, y in points]
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        for answer in answers:
+            self.assertEqual(answer, expected)
+
+if __name__ == '__main__':
+    unittest.main()
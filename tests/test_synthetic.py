@@ -0,0 +1,75 @@
+import synthetic # The code to test
+import catchment
+import unittest
+import tempfile
+import numpy as np
+
+from osgeo import ogr
+
+def can_write_gdb():
+    driver = ogr.GetDriverByName('OpenFileGDB')
+    return driver is not None and bool(driver.TestCapability(ogr.ODrCCreateDataSource))
+
+class synthetic_grid_tests(unittest.TestCase):
+
+    def test_drainage_matches_trace(self):
+        rows, cols = 11, 30
+        fdr, strGrid = synthetic.huc_grids(rows, cols)
+
+        self.assertTrue((strGrid[rows // 2] == 1).all())
+        for row, col in ((0, 4), (3, 17), (rows // 2, 12), (rows // 2, cols - 1), (rows - 1, 2)):
+            mask, window = catchment.trace_catchment(fdr, row, col)
+            self.assertEqual(int(mask.sum()), synthetic.drainage_cells(row, col, rows, cols, 0))
+
+    def test_drainage_includes_upstream_hucs(self):
+        self.assertEqual(synthetic.drainage_cells(5, 0, 11, 30, 2), (2 * 30 + 1) * 11)
+
+    def test_slab_bounds_cover_grid(self):
+        slabs = synthetic.slab_bounds(100, 7)
+        self.assertEqual(slabs[0][0], 0)
+        self.assertEqual(slabs[-1][1], 100)
+        for (a0, a1), (b0, b1) in zip(slabs, slabs[1:]):
+            self.assertEqual(a1, b0)
+
+    def test_layout_chains(self):
+        layout = synthetic.huc_layout(7, 3)
+        self.assertEqual([huc['index'] for huc in layout], [0, 1, 2, 0, 1, 2, 0])
+        self.assertEqual(len(set(huc['name'] for huc in layout)), 7)
+
+@unittest.skipUnless(can_write_gdb(), 'needs GDAL 3.6+ to write FileGDB')
+class synthetic_region_tests(unittest.TestCase):
+
+    def test_delineated_areas_match_manifest(self):
+
+        import delineate
+        from catalog import RegionCatalog
+        from cache import TieredCache, LRUCache
+
+        with tempfile.TemporaryDirectory() as tmp:
+            dataPath = tmp.replace('\\', '/') + '/'
+            manifest = synthetic.SyntheticRegion(hucs=3, depth=3, rows=41, cols=60, catchments=4).write(dataPath, 'synthetic')
+
+            catalog = RegionCatalog(dataPath)
+            catalog.geometryCache = TieredCache(LRUCache())
+
+            for point in manifest['points']:
+                results = delineate.Watershed(point['lat'], point['lng'], 'synthetic', dataPath, catalog)
+                self.assertAlmostEqual(results.mergedCatchment['properties']['area'] / point['area'], 1.0, delta=0.02, msg=point['name'])
+
+            #same answers once catchments, grids and upstream polygons come from the preprocessed stores
+            import preprocess
+            preprocess.preprocess_region(dataPath, 'synthetic', arrays=True)
+            catalog = RegionCatalog(dataPath)
+            catalog.geometryCache = TieredCache(LRUCache())
+
+            for point in manifest['points']:
+                results = delineate.Watershed(point['lat'], point['lng'], 'synthetic', dataPath, catalog)
+                self.assertTrue(results.hucHandle.catchmentGrid)
+                self.assertIsNotNone(results.hucHandle.stack)
+                self.assertIsNotNone(results.hucHandle.arrays)
+                if point['type'] in ('localGlobal', 'global'):
+                    self.assertEqual(results.metrics.as_dict()['counts'].get('precomputedUpstream'), 1)
+                self.assertAlmostEqual(results.mergedCatchment['properties']['area'] / point['area'], 1.0, delta=0.02, msg=point['name'])
+
+if __name__ == '__main__':
+    unittest.main()